@@ -6,13 +6,12 @@
 import sys,os,time,datetime
 import numpy as np
 from tools import whatistime,howlong
-from tools import Readcoord,Printcoord,Checkpoint,Readinitcond
+from tools import Readcoord,Printcoord,Checkpoint
 from entrance import ReadInput,StartInfo
 from methods import QM
 from aimd import AIMD
 from hybrid import MIXAIMD
-from dynamixsampling import Sampling
-from adaptive_sampling import AdaptiveSampling
+from dynamixsampling import SamplingArray
 
 def logo(version):
 
@@ -91,6 +90,12 @@ class PYRAIMD:
             model.evaluate(None)  # None will use json file
 
     def _dynamics(self):
+        ## run all sampled initial conditions in a process pool if ensemble is requested
+        if self.variables_all['md']['ensemble'] == 1:
+            from ensemble import Ensemble
+            Ensemble(self.variables_all).run()
+            return None
+
         title    = self.variables_all['control']['title']
         qm       = self.variables_all['control']['qm']
         md       = self.variables_all['md']
@@ -106,8 +111,9 @@ class PYRAIMD:
             velo=np.loadtxt('%s.velo' % (title))
         else:
             ## use sampling method to generate intial condition
-            trvm=Sampling(title,nesmb,gl_seed,temp,method,format)[-1]
-            xyz,mass,velo=Readinitcond(trvm)
+            init=SamplingArray(title,nesmb,gl_seed,temp,method,format)
+            xyz=[[a]+c for a,c in zip(init['atoms'].tolist(),init['coord'][-1].tolist())]
+            velo=init['velo'][-1]
             ## save sampled geometry and velocity
             initxyz_info='%d\n%s\n%s' % (len(xyz),'%s sampled geom %s at %s K' % (method,nesmb,temp),Printcoord(xyz))
             initxyz=open('%s.xyz' % (title),'w')
@@ -138,8 +144,9 @@ class PYRAIMD:
             velo=np.loadtxt('%s.velo' % (title))
         else:
             ## use sampling method to generate intial condition
-            trvm=Sampling(title,nesmb,gl_seed,temp,method,format)[-1]
-            xyz,mass,velo=Readinitcond(trvm)
+            init=SamplingArray(title,nesmb,gl_seed,temp,method,format)
+            xyz=[[a]+c for a,c in zip(init['atoms'].tolist(),init['coord'][-1].tolist())]
+            velo=init['velo'][-1]
             ## save sampled geometry and velocity
             initxyz_info='%d\n%s\n%s' % (len(xyz),'%s sampled geom %s at %s K' % (method,nesmb,temp),Printcoord(xyz))
             initxyz=open('%s.xyz' % (title),'w')
@@ -156,6 +163,8 @@ class PYRAIMD:
         traj.run(xyz,velo)
 
     def	_active_search(self):
+        ## adaptive sampling is only imported for adaptive jobs
+        from adaptive_sampling import AdaptiveSampling
         sampling=AdaptiveSampling(self.variables_all)
         sampling.search()
 
@@ -1,17 +1,18 @@
 ## active search for PyRAIMD
 ## Jingbai Li Jul 11 2020
 
-import time,datetime,json,shutil
+import time,datetime,json,pickle
 import multiprocessing,os
 from multiprocessing import Pool
 import numpy as np
 from aimd import AIMD
 from methods import QM
-from data_processing import AddTrainData,GetInvR
-from tools import Printcoord,Readinitcond
+from data_processing import AddTrainData,TrainDataInfo
+from featurizer import GetInvR
+from tools import Printcoord,AppendAdaptiveLog,WriteModelParent
 from aligngeom import AlignGeom
-from dynamixsampling import Sampling
-from periodic_table import BondLib
+from dynamixsampling import SamplingArray
+from periodic_table import BondLength
 
 class AdaptiveSampling:
 
@@ -42,6 +43,8 @@ class AdaptiveSampling:
        	self.load         = control['load']
         self.transfer     = control['transfer']
         self.pop_step     = control['pop_step']
+        self.restart      = control['restart']
+        self.overlap      = control['overlap']
         self.variables = variables_all.copy() # hard copy all input variables, so I can change them safely
         self.threshold = {
         'maxsample'    : control['maxsample'],
@@ -52,6 +55,8 @@ class AdaptiveSampling:
         'maxnac'       : control['maxnac'],
         'minnac'       : control['minnac'],
         'neighbor'     : control['neighbor'],
+        'selection'    : control['selection'],
+        'maxbatch'     : control['maxbatch'],
         }
 
        	## variables for checking QC results
@@ -71,19 +76,42 @@ class AdaptiveSampling:
         self.selec_n      = [[] for x in range(nesmb)]   # error of nac
         self.index_n      = [[] for x in range(nesmb)]   # index of selected geometry based on nac error
 
+        ## campaign state for restarting adaptive sampling
+        self.stages       = ['train','md','screen','qc','merge']
+        self.state        = {
+        'iter'        : 0,     # iteration of the last completed stage
+        'stage'       : None,  # the last completed stage
+        'dataset'     : variables_all[self.qm]['data'].path,  # training data directory
+        'nentry'      : len(variables_all[self.qm]['data']),   # number of entries after the last merge
+        'md_traj'     : None,  # md history from the completed md stage
+        'selec_geo'   : None,  # selected geometries from the completed screen stage
+        'discard_geo' : None,  # discarded geometries from the completed screen stage
+        'converged'   : 0,     # number of converged trajectories
+        'refinement'  : 0,     # number of refinement geometries
+        'qc'          : {},    # finished qc results of the current iteration
+        }
+
         np.random.seed(gl_seed)
-        trvm=Sampling(self.title,nesmb,gl_seed,temp,method,format)
-        for ntraj,x in enumerate(trvm):
-            xyz,M,V=Readinitcond(x)
-            self.initcond[ntraj]=[xyz,V]
+        ## sampled coordinates and velocities are passed in memory as (nesmb,natom,3) arrays
+        init=SamplingArray(self.title,nesmb,gl_seed,temp,method,format)
+        atoms=init['atoms'].tolist()
+        for ntraj,(coord,velo) in enumerate(zip(init['coord'],init['velo'])):
+            xyz=[[a]+c for a,c in zip(atoms,coord.tolist())]
+            self.initcond[ntraj]=[xyz,velo]
+
+    def _run_aimd(self,model_id=None,ncpu=None):
+        ## model_id selects the model driving the trajectories, the current model by default
+        if model_id == None:
+            model_id = self.iter
+        if ncpu == None:
+            ncpu = self.ml_ncpu
 
-    def _run_aimd(self):
         ## wrap variables for multiprocessing
-        variables_wrapper=[[n,x[0],x[1]]for n,x in enumerate(self.initcond)]
+        variables_wrapper=[[n,x[0],x[1],model_id]for n,x in enumerate(self.initcond)]
         ntraj=len(variables_wrapper)
 
         ## adjust multiprocessing if necessary
-        ncpu = np.amin([ntraj,self.ml_ncpu])
+        ncpu = np.amin([ntraj,ncpu])
 
         md_traj=[[] for x in range(ntraj)]
         ## start multiprocessing
@@ -98,9 +126,9 @@ class AdaptiveSampling:
         ## run AIMD
         ## multiprocessing doesn't support shared-memory
         ## load mode in each worker process here :(
-        qm=QM(self.qm,self.variables,id=self.iter)
+        traj_id,xyz,velo,model_id=initial_condition
+        qm=QM(self.qm,self.variables,id=model_id)
         qm.load()
-        traj_id,xyz,velo=initial_condition
         traj=AIMD(self.variables,QM=qm,id=traj_id+1,dir=True)
         md_hist=traj.run(xyz,velo)
         return traj_id,md_hist
@@ -112,16 +140,25 @@ class AdaptiveSampling:
             geom+=xyz
         variables_wrapper=[[n,xyz]for n,xyz in enumerate(geom)]
         ngeom=len(variables_wrapper)
+
+        ## reuse the finished qc results from a previous run
+        qc_results=[[] for x in range(ngeom)]
+        for geom_id,result in self.state['qc'].items():
+            qc_results[geom_id]=result
+        variables_wrapper=[x for x in variables_wrapper if x[0] not in self.state['qc'].keys()]
+
         ## adjust multiprocessing if necessary
-        ncpu = np.amin([ngeom,self.qc_ncpu])
+        ncpu = np.amin([len(variables_wrapper),self.qc_ncpu])
 
         ## start multiprocessing
-        qc_results=[[] for x in range(ngeom)]
-        pool=multiprocessing.Pool(processes=ncpu)
-        for val in pool.imap_unordered(self._abinit_wrapper,variables_wrapper):
-            geom_id,xyz,energy,gradient,nac,civec,movec=val
-            qc_results[geom_id]=[xyz,energy.tolist(),gradient.tolist(),nac.tolist(),civec.tolist(),movec.tolist()]
-        pool.close()
+        if len(variables_wrapper) > 0:
+            pool=multiprocessing.Pool(processes=ncpu)
+            for val in pool.imap_unordered(self._abinit_wrapper,variables_wrapper):
+                geom_id,xyz,energy,gradient,nac,civec,movec=val
+                qc_results[geom_id]=[xyz,energy.tolist(),gradient.tolist(),nac.tolist(),civec.tolist(),movec.tolist()]
+                self.state['qc'][geom_id]=qc_results[geom_id]
+                self._dump_state()
+            pool.close()
 
         ## check qc results and exclude non-converged ones
         results=[]
@@ -137,12 +174,12 @@ class AdaptiveSampling:
         ## run QC calculation
         geom_id,xyz=selec_geom
         ## the geometry alignment is not necessary if NAC is not request. Maybe add a condition statement in the future
-        geom_pool=self.variables[self.qm]['data'][2]
-        choose=np.random.choice(np.arange(len(geom_pool)),np.amin([50,len(geom_pool)]),replace=False)
-        geom_pool=np.array(geom_pool)[choose]
+        data=self.variables[self.qm]['data']
+        choose=np.random.choice(np.arange(len(data)),np.amin([50,len(data)]),replace=False)
+        geom_pool=data.xyz(choose)
         similar,rmsd_min=AlignGeom(xyz,geom_pool)
-        movec=self.variables[self.qm]['data'][-1][similar]
-        civec=self.variables[self.qm]['data'][-2][similar]
+        movec=data.take('mo',choose[similar])[0]
+        civec=data.take('ci',choose[similar])[0]
         addons={
         'pciv' : civec,
         'pmov' : movec,
@@ -185,9 +222,14 @@ class AdaptiveSampling:
         'new_geom'     : [],
         'discard_geom' : [],
         'uncertain'    : [],
+        'selected'     : [],
         'pop'          : [],
         }
 
+        index_u=[[] for x in range(self.ntraj)]   # index of uncertain geometries
+        index_r=[[] for x in range(self.ntraj)]   # index of refinement geometries
+        all_geo=[[] for x in range(self.ntraj)]   # all recorded geometries
+        all_err=[[] for x in range(self.ntraj)]   # relative prediction errors
         for ntraj in range(self.ntraj):
             last,geo,e,g,n,err_e,err_g,err_n,pop=np.array(md_traj[ntraj]).T
 
@@ -242,13 +284,11 @@ class AdaptiveSampling:
                         pos+=1
                         gap_e[:,pos]=np.abs(e[:,i]-e[:,j])
                 gap_e=np.amin(gap_e,axis=1)    # pick the smallest gap per point
-                index_r = np.argsort(gap_e[self.refine_start:self.refine_end])[0:self.refine_num]
-                index_tot=np.concatenate((index_tot,index_r)).astype(int)
-                index_tot=np.unique(index_tot)
+                index_r[ntraj] = np.argsort(gap_e[self.refine_start:self.refine_end])[0:self.refine_num]
 
-            keep_geo,discard_geo    = self._distance_filter(np.array(geo)[index_tot].tolist()) # filter out the unphyiscal geometries based on atom distances
-            self.selec_geo[ntraj]   = keep_geo
-            self.discard_geo[ntraj] = discard_geo
+            index_u[ntraj]          = index_tot
+            all_geo[ntraj]          = geo
+            all_err[ntraj]          = np.amax([err_e.astype(float)/minerr_e,err_g.astype(float)/minerr_g,err_n.astype(float)/minerr_n],axis=0)
             self.selec_e[ntraj]     = selec_e
             self.index_e[ntraj]     = index_e
        	    self.selec_g[ntraj]     = selec_g
@@ -256,6 +296,19 @@ class AdaptiveSampling:
        	    self.selec_n[ntraj]     = selec_n
             self.index_n[ntraj]     = index_n
 
+        ## pick a diverse batch from the uncertain geometries of all trajectories, optionally
+        if self.threshold['selection'] == 'fps':
+            index_u = self._select_batch(all_geo,all_err,index_u)
+
+        for ntraj in range(self.ntraj):
+            index_tot=np.concatenate((index_u[ntraj],index_r[ntraj])).astype(int)
+            index_tot=np.unique(index_tot)
+            checkpoint['selected'].append(len(index_u[ntraj]))
+
+            keep_geo,discard_geo    = self._distance_filter(np.array(all_geo[ntraj])[index_tot].tolist()) # filter out the unphyiscal geometries based on atom distances
+            self.selec_geo[ntraj]   = keep_geo
+            self.discard_geo[ntraj] = discard_geo
+
         checkpoint['new_geom']      = self.selec_geo        # new geometries
         checkpoint['discard_geom']  = self.discard_geo      # discarded geometries
 
@@ -263,23 +316,18 @@ class AdaptiveSampling:
 
     def _distance_filter(self,geom):
         ## This function filter out unphysical geometries based on atom distances
+        ## A geometry is unphysical if any atom pair is closer than 0.7 times of the bond length
         keep=[]
         discard=[]
         if len(geom) > 0:
             natom=len(geom[0])
+            upper=np.triu_indices(natom,1)
             for geo in geom:
-                unphysical=0
-                for i in range(natom):
-                    for j in range(i+1,natom): 
-                        atom1=geo[i][0]
-                        coord1=np.array(geo[i][1:4])
-       	       	       	atom2=geo[j][0]
-                        coord2=np.array(geo[j][1:4])
-                        distance=np.sum((coord1-coord2)**2)**0.5
-                        threshld=BondLib(atom1,atom2)
-                        if distance < threshld*0.7:
-                            unphysical=1
-                if unphysical == 1:
+                atoms=np.array(geo)[:,0]
+                coord=np.array(geo)[:,1:4].astype(float)
+                distance=np.sum((coord[upper[0]]-coord[upper[1]])**2,axis=1)**0.5
+                threshld=BondLength(atoms)[upper]
+                if np.any(distance < threshld*0.7):
                     discard.append(geo) 
                 else:
                     keep.append(geo)
@@ -331,11 +379,77 @@ class AdaptiveSampling:
 
         return selec_error,index_error
 
+    def _select_batch(self,geom,error,index):
+        ## This function select a diverse batch of uncertain geometries from all trajectories jointly
+        ## This function use farthest-point sampling in inverse distance space weighted by prediction error
+        ## This function keep at most maxsample geometries per trajectory and maxbatch geometries in total
+
+        maxsample = self.threshold['maxsample']
+        maxbatch  = self.threshold['maxbatch']
+
+        ## gather uncertain geometries from all trajectories
+        traj_id=[]
+        geom_id=[]
+        for ntraj,idx in enumerate(index):
+            traj_id+=[ntraj for x in idx]
+            geom_id+=[x for x in idx]
+        traj_id=np.array(traj_id).astype(int)
+        geom_id=np.array(geom_id).astype(int)
+        ncand=len(geom_id)
+
+        selec=[[] for x in range(self.ntraj)]
+        if ncand == 0 or maxsample <= 0:
+            return selec
+
+        if maxbatch <= 0:
+            maxbatch=ncand
+
+        feat=GetInvR(np.array([np.array(geom[traj_id[n]][geom_id[n]])[:,1:4] for n in range(ncand)]).astype(float))
+        weight=np.array([error[traj_id[n]][geom_id[n]] for n in range(ncand)])
+        weight=weight/np.amax(weight)
+
+        count=np.zeros(self.ntraj)             # number of selected geometries per trajectory
+        avail=np.ones(ncand,dtype=bool)        # geometries allowed to be selected
+        dist=np.ones(ncand)*np.inf             # distance to the nearest selected geometry
+        pick=np.argmax(weight)                 # start from the largest error
+        for n in range(np.amin([ncand,maxbatch])):
+            selec[traj_id[pick]].append(geom_id[pick])
+            count[traj_id[pick]]+=1
+            avail[pick]=False
+            if count[traj_id[pick]] >= maxsample:
+                avail[traj_id == traj_id[pick]]=False
+            if np.sum(avail) == 0:
+                break
+            dist=np.minimum(dist,np.sum((feat-feat[pick])**2,axis=1)**0.5)
+            score=np.where(avail,dist*weight,-1)
+            pick=np.argmax(score)
+
+        selec=[np.sort(x) for x in selec]
+
+        return selec
+
     def _update_train_set(self,results):
         data,postdata,data_info=AddTrainData(self.variables[self.qm],results,self.iter+1)
         self.variables[self.qm]['data']      = data
         self.variables[self.qm]['postdata']  = postdata
        	self.variables[self.qm]['data_info'] = data_info
+        self.state['nentry']                 = len(data)
+        self.state['dataset']                = data.path
+
+    def _load_train_set(self):
+        ## This function reload the training data of the last completed merge stage
+        ## The entries appended after the last merge are dropped by the next append
+        if self.state['nentry'] == len(self.variables[self.qm]['data']):
+            return None
+
+        variables=self.variables[self.qm].copy()
+        variables['train_data'] = self.state['dataset']
+        variables['nentry']     = self.state['nentry']
+        variables['increment']  = 0
+        data,postdata,data_info=TrainDataInfo(variables)
+        self.variables[self.qm]['data']      = data
+        self.variables[self.qm]['postdata']  = postdata
+        self.variables[self.qm]['data_info'] = data_info
 
     def _train_model(self):
 
@@ -348,12 +462,15 @@ class AdaptiveSampling:
                 self.variables[self.qm]['train_mode'] = 'training'
             else:
        	    ## set to do a transfer learning for the next iteraction
-            ## copy previous model NN-(self.title)-(self.iter-1) to NN-(self.title)-(self.iter) as initial guess
+            ## NN-(self.title)-(self.iter) refers to the previous model NN-(self.title)-(self.iter-1) as initial guess
                 self.variables[self.qm]['train_mode'] = 'retraining'
                 if self.iter == 2:
-                    shutil.copytree('NN-%s' % (self.title),'NN-%s-%s' % (self.title,self.iter))
+                    WriteModelParent('NN-%s-%s' % (self.title,self.iter),'NN-%s' % (self.title))
                 else:
-                    shutil.copytree('NN-%s-%s' % (self.title,self.iter-1),'NN-%s-%s' % (self.title,self.iter))
+                    WriteModelParent('NN-%s-%s' % (self.title,self.iter),'NN-%s-%s' % (self.title,self.iter-1))
+
+        if self.overlap == 1 and self.iter > 1:
+            return self._train_overlap()
 
         if self.iter > 1 or self.load == 0:
             pool=multiprocessing.Pool(processes=1)
@@ -361,16 +478,66 @@ class AdaptiveSampling:
                 val=None
             pool.close()
 
+        return None
+
     def _train_wrapper(self,fake):
         model=QM(self.qm,self.variables,id=self.iter)
         model.train()
         return None
 
+    def _train_overlap(self):
+        ## This function train the new model in the background and run the trajectories with the previous model meanwhile
+        ## One ML cpu is left for the training
+        ## The recorded geometries are screened again with the new model in the md stage, see _rescreen
+
+        pool=multiprocessing.Pool(processes=1)
+        job=pool.apply_async(self._train_wrapper,[None])
+        md_traj=self._run_aimd(model_id=self.iter-1,ncpu=np.amax([1,self.ml_ncpu-1]))
+        job.get()
+        pool.close()
+
+        return md_traj
+
+    def _rescreen(self,md_traj):
+        ## This function predict the recorded geometries of the trajectories again with the current model
+        ## The energies, gradients, nacs, and errors are replaced, thus the screening uses the errors of the current model
+
+        ## wrap variables for multiprocessing
+        variables_wrapper=[[n,x] for n,x in enumerate(md_traj)]
+        ntraj=len(variables_wrapper)
+
+        ## adjust multiprocessing if necessary
+        ncpu = np.amin([ntraj,self.ml_ncpu])
+
+        ## start multiprocessing
+        new_traj=[[] for x in range(ntraj)]
+        pool=multiprocessing.Pool(processes=ncpu)
+        for val in pool.imap_unordered(self._rescreen_wrapper,variables_wrapper):
+            traj_id,md_hist=val
+            new_traj[traj_id]=md_hist
+        pool.close()
+
+        return new_traj
+
+    def _rescreen_wrapper(self,traj):
+        ## predict the recorded geometries of one trajectory
+        traj_id,md_hist=traj
+        qm=QM(self.qm,self.variables,id=self.iter)
+        qm.load()
+        new_hist=[]
+        for step in md_hist:
+            results=qm.evaluate(step[1])
+            new_hist.append([step[0],step[1],results['energy'].tolist(),results['gradient'].tolist(),results['nac'].tolist(),\
+                             results['err_e'],results['err_g'],results['err_n']]+list(step[8:]))
+
+        return traj_id,new_hist
+
     def _checkpoint(self,checkpoint_dict):
         logpath      = os.getcwd()
         last         = checkpoint_dict['last']
         geom         = checkpoint_dict['geom']
         uncertain    = checkpoint_dict['uncertain']
+        selected     = checkpoint_dict['selected']
         new_geom     = checkpoint_dict['new_geom']
         discard_geom = checkpoint_dict['discard_geom']
         err_e        = checkpoint_dict['err_e']
@@ -387,6 +554,7 @@ class AdaptiveSampling:
         converged    = 0
         refinement   = 0
         found        = 0
+        picked       = 0
        	discarded    = 0
         all_geom     = 0
         traj_info='  &adaptive sampling progress\n'
@@ -397,10 +565,11 @@ class AdaptiveSampling:
                 marker='*'
             traj_info+='  Traj %6s: %8s steps found %8s new geometries discard %8s geometries => MaxErr(Energy: %8.4f Gradient: %8.4f NAC: %8.4f) %s\n' % (i+1,last[i][-1],uncertain[i],len(discard_geom[i]),np.amax(err_e[i]),np.amax(err_g[i]),np.amax(err_n[i]),marker)
             found+=uncertain[i]
+            picked+=selected[i]
             discarded+=len(discard_geom[i])
             all_geom+=len(new_geom[i])
 
-        refinement=all_geom+discarded-found
+        refinement=all_geom+discarded-picked
 
         log_info="""
 %s
@@ -438,22 +607,53 @@ class AdaptiveSampling:
 
         #savethis={self.iter:checkpoint_dict} ## This saves too much !!
         savethis={
-        self.iter: {
         'new_geom' : checkpoint_dict['new_geom']
         }
-        }
-        if self.iter == 1:
-            with open('%s/%s.adaptive.json' % (logpath,self.title), 'w') as outfile:
-                json.dump(savethis,outfile)
-        else:
-            with open('%s/%s.adaptive.json' % (logpath,self.title), 'r') as infile:
-                loadthis=json.load(infile)
-            savethis.update(loadthis)
-            with open('%s/%s.adaptive.json' % (logpath,self.title), 'w') as outfile:
-                json.dump(savethis,outfile)
+        AppendAdaptiveLog(self.title,self.iter,savethis)
 
         return converged,refinement
 
+    def _completed(self,stage):
+        ## This function check if a stage of the current iteration has been completed in a previous run
+
+        if self.iter < self.state['iter']:
+            return True
+        elif self.iter == self.state['iter']:
+            return self.stages.index(self.state['stage']) >= self.stages.index(stage)
+        else:
+            return False
+
+    def _save_state(self,stage,**kwargs):
+        ## This function record a completed stage of the current iteration
+
+        self.state.update(kwargs)
+        self.state['iter']  = self.iter
+        self.state['stage'] = stage
+        self._dump_state()
+
+    def _dump_state(self):
+        ## This function serialize the campaign state for restart
+
+        logpath=os.getcwd()
+        with open('%s/%s.adaptive.pkl' % (logpath,self.title),'wb') as outfile:
+            pickle.dump(self.state,outfile)
+
+    def _load_state(self):
+        ## This function read the campaign state and the training data of the last completed stage
+
+        logpath=os.getcwd()
+        with open('%s/%s.adaptive.pkl' % (logpath,self.title),'rb') as infile:
+            self.state.update(pickle.load(infile))
+        self._load_train_set()
+
+        if self.state['selec_geo'] != None:
+            self.selec_geo   = self.state['selec_geo']
+            self.discard_geo = self.state['discard_geo']
+
+        restart_info='  &adaptive sampling restart from iter %s stage %s with %s training data\n' % (self.state['iter'],self.state['stage'],self.state['nentry'])
+
+        return restart_info
+
     def _heading(self):
 
         headline="""
@@ -479,18 +679,40 @@ class AdaptiveSampling:
         logpath=os.getcwd()
         start=time.time()
         heading='Adaptive Sampling Start: %20s\n%s' % (self._whatistime(),self._heading())
+        mode='w'
+        if self.restart == 1 and os.path.exists('%s/%s.adaptive.pkl' % (logpath,self.title)) == True:
+            heading+=self._load_state()
+            mode='a'
         print(heading)
-        mdlog=open('%s/%s.log' % (logpath,self.title),'w')
+        mdlog=open('%s/%s.log' % (logpath,self.title),mode)
         mdlog.write(heading)
         mdlog.close()
 
 
         for iter in range(self.maxiter):
             self.iter=iter+1
-            self._train_model()
-            md_traj=self._run_aimd()
-            checkpoint_dict=self._screen_error(md_traj)
-            converged,refinement=self._checkpoint(checkpoint_dict)
+            if self._completed('merge') == True:
+                continue
+
+            ## with overlap, the trajectories of the previous model are returned from the train stage
+            if self._completed('train') == False:
+                md_traj=self._train_model()
+                self._save_state('train',md_traj=md_traj)
+
+            if self._completed('md') == False:
+                if self.state['md_traj'] == None:
+                    md_traj=self._run_aimd()
+                else:
+                    md_traj=self._rescreen(self.state['md_traj'])
+                self._save_state('md',md_traj=md_traj)
+
+            if self._completed('screen') == False:
+                checkpoint_dict=self._screen_error(self.state['md_traj'])
+                converged,refinement=self._checkpoint(checkpoint_dict)
+                self._save_state('screen',md_traj=None,selec_geo=self.selec_geo,discard_geo=self.discard_geo,converged=converged,refinement=refinement,qc={})
+
+            converged  = self.state['converged']
+            refinement = self.state['refinement']
 
             if self.iter > self.maxiter:
                 break
@@ -499,7 +721,9 @@ class AdaptiveSampling:
                     break
                 else:
                     results=self._run_abinit()
+                    self._save_state('qc')
                     self._update_train_set(results)
+                    self._save_state('merge',qc={})
 
 
         end=time.time()
@@ -1,11 +1,11 @@
 ## The Ab Inito Molecular Dynamics for PyQDynamics
 ## Jingbai Li Jun 9 2020
 
-import time,datetime,os,pickle
+import time,datetime,os,pickle,copy
 import numpy as np
-from periodic_table import Element
+from periodic_table import AtomMass
 from reset_velocity import ResetVelo
-from verlet import NoseHoover, VerletI, VerletII, NVE,NoEnsemble
+from verlet import NoseHoover, VerletI, VerletII, NVE,NoEnsemble,AdaptStep
 from surfacehopping import FSSH,GSH,NOSH
 from tools import Printcoord,NACpairs
 class AIMD:
@@ -110,6 +110,11 @@ class AIMD:
         'err_g'   : None,       ## error of gradient in adaptive sampling
         'err_n'   : None,       ## error of nac in adaptive sampling
         'MD_hist' :[],          ## md history
+        'time'    : 0.,         ## current time in au with adaptive time step
+        'grid'    : 0,          ## number of output time steps with adaptive time step
+        'drift'   : 0.,         ## total energy change in the current step before thermostat
+        'Etot'    : 0.,         ## total energy at the end of the previous step
+        'pending' : None,       ## surface hopping not yet written to output with adaptive time step
                          })
 
         self.traj['old']   = self.traj['root']
@@ -121,6 +126,9 @@ class AIMD:
         self.restart       = self.traj['restart']## turn on/off restart function
         self.addstep       = self.traj['addstep']## continue the trajectory with additional steps
         self.history       = self.traj['history']## length of md_hist
+        self.adapt         = self.traj['adapt']  ## turn on/off adaptive time step
+        self.grid          = self.traj['size']   ## output time step size
+        self.substep       = self.traj['substep']## number of substep in FSSH, 0 is to use delt=0.2 au
 
         ###### obselete variables
         ## self.output_buffer = []                  ## list of buffered output
@@ -144,6 +152,14 @@ class AIMD:
         else:
             self.traj['delt']   = self.traj['size']/self.traj['substep']
 
+        ## the keyword size is the output time step, the internal time step is bounded by minsize and maxsize
+        if self.adapt == 1:
+            self.traj['size']   = float(self.grid)
+            if self.traj['minsize'] == 0:
+                self.traj['minsize'] = self.grid/4
+            if self.traj['maxsize'] == 0:
+                self.traj['maxsize'] = self.grid*2
+
         ## check if it is a restart calculation and if the previous check point pkl file exists
         if self.restart == 1:
             check_log=os.path.exists('%s/%s.log' % (self.traj['logpath'],self.traj['title']))
@@ -193,8 +209,9 @@ class AIMD:
             return None
 
         # end function early if velocity reset step is not 0 but iteration is not the multiple of it 
+        # with adaptive time step, the reset is done when the step reaches the next multiple of the output time steps
         if self.traj['resetstep'] != 0:
-            if self.traj['iter'] % self.traj['resetstep'] != 0:
+            if int(self._clock()/self.traj['resetstep']) == int(self._clock(0)/self.traj['resetstep']):
                 return None
 
         # finally reset velocity here
@@ -228,7 +245,8 @@ class AIMD:
 
 
         ## record trajectories for further analysis if requested
-        if self.record == 1:
+        ## with adaptive time step, the output time steps are recorded by _record_hist instead
+        if self.record == 1 and self.adapt == 0:
             self.traj['MD_hist'].append([self.traj['iter'], xyz,results['energy'].tolist(),results['gradient'].tolist(),results['nac'].tolist(),\
                                                                 results['err_e'],          results['err_g'],            results['err_n']])    # convert all to list
 
@@ -250,8 +268,8 @@ class AIMD:
         ## NVE for excited-state, NoseHoover for ground-state after a certain amount of time
         elif self.traj['thermo'] == 2:
             if self.traj['state'] > 1:
-                self.traj['iter_x'] = self.traj['iter']
-            delay = self.traj['iter'] - self.traj['iter_x']
+                self.traj['iter_x'] = self._clock()
+            delay = self._clock() - self.traj['iter_x']
             if   self.traj['state'] == 1 and delay >= self.traj['thermodelay']:
                 V,Vs,Ekin = NoseHoover(self.traj)
             else:
@@ -283,7 +301,7 @@ class AIMD:
         self.traj['old']   = old_state
         self.traj['state'] = state
 
-        if self.record == 1:
+        if self.record == 1 and self.adapt == 0:
             self.traj['MD_hist'][-1].append(np.diag(np.real(At)).tolist())
 
     def _read_coord(self,xyz):
@@ -291,7 +309,7 @@ class AIMD:
         natom = len(xyz)
         T = xyz[:,0]
         R = xyz[:,1:].astype(float)
-        M = np.array([Element(x).getMass()*1822.8852 for x in T]).reshape([-1,1])
+        M = AtomMass(T).reshape([-1,1])*1822.8852
         return T,R,M
 
     def _write_coord(self,T,R):
@@ -335,11 +353,14 @@ class AIMD:
             if err_e > self.maxerr_e or err_g > self.maxerr_g or err_n > self.maxerr_n:
                 self.stop = 1
 
-    def	_chkpoint(self):
+    def	_chkpoint(self,traj=None):
         ## This function print current information
         ## This function append output to .log, .md.energies and .md.xyz
+        ## This function print the interpolated traj at the output time step if it is given
 
-        Chk       = self.traj.copy()          ## copy the dict in case I will change the data type for saving in the future
+        if traj == None:
+            traj  = self.traj
+        Chk       = traj.copy()               ## copy the dict in case I will change the data type for saving in the future
         title     = Chk['title']              ## title
         logpath   = Chk['logpath']            ## output directory
         temp      = Chk['temp']               ## temperature
@@ -432,7 +453,7 @@ class AIMD:
             print(log_info)
 
         #print(log_info)
-        self._dump_to_disk(Chk,logpath,title,log_info,energy_info,xyz_info)
+        self._dump_to_disk(self.traj.copy(),logpath,title,log_info,energy_info,xyz_info)
 
 ######### I do not use the code below because I don't want to keep the huge data in RAM
 #        if   self.traj['iter'] <= self.direct:
@@ -467,6 +488,136 @@ class AIMD:
         mdxyz.write(xyz_info)
         mdxyz.close()
 
+    def _adapt_substep(self):
+        ## This function re-derive the microiteration of FSSH for the current time step size
+        ## The substeps cover the time step exactly, thus the populations are integrated over the same time as the nuclei
+
+        if self.substep == 0:
+            self.traj['substep']= int(np.ceil(self.traj['size']/0.2-1e-8))
+        self.traj['delt']       = self.traj['size']/self.traj['substep']
+
+    def _interpolate(self,prev,w):
+        ## This function interpolate the traj between the previous step and the current step
+        ## w is the fraction of the current time step, the discrete variables are taken from the current step
+
+        traj=self.traj.copy()
+        if w < 1:
+            for key in prev.keys():
+                traj[key]=(1-w)*prev[key]+w*self.traj[key]
+
+        return traj
+
+    def _clock(self,end=1):
+        ## This function return the number of output time steps reached at the end (end=1) or the start (end=0) of the current step
+        ## It is the iteration with fixed time step, resetstep and thermodelay count the time with it in adaptive mode
+
+        if self.adapt == 0:
+            return self.traj['iter']-1+end
+        if self.traj['iter'] == 1:
+            return end
+
+        return int((self.traj['time']+self.traj['size']*end)/self.grid+1e-8)
+
+    def _record_hist(self,traj):
+        ## This function record an output time step to MD_hist with adaptive time step
+        ## The entries are the same as _compute_properties and _surfacehop, thus the steps in MD_hist are uniform in time
+        ## The geometry and properties are interpolated to the output time, but err_e, err_g and err_n are those at the end of
+        ## the step, because the prediction errors are only evaluated at the real steps
+        ## The step stopping the trajectory is recorded as it is, thus the geometry matches the errors exceeding the thresholds
+
+        xyz=self._write_coord(traj['T'],traj['R'])
+        self.traj['MD_hist'].append([traj['iter'],xyz,np.array(traj['E']).tolist(),np.array(traj['G']).tolist(),np.array(traj['N']).tolist(),\
+                                     traj['err_e'],traj['err_g'],traj['err_n'],np.diag(np.real(traj['At'])).tolist()])
+
+        ## keep the lastest steps of trajectories to save memory if the length is longer than requested
+        if len(self.traj['MD_hist']) > self.history:
+            end=len(self.traj['MD_hist'])
+            start=int(end-self.history)
+            self.traj['MD_hist'] = self.traj['MD_hist'][start:end]
+
+    def _run_adaptive(self):
+        ## This function propagate the trajectory with adaptive time step
+        ## The time step is updated by AdaptStep after each step
+        ## A step exceeding the thresholds is rejected and repeated from the saved traj with the reduced time step
+        ## The outputs are interpolated onto the uniform time grid of the keyword size, thus the analysis tools still work
+        ## The output time follows the fixed time step, where the first output is the initial condition at time size
+
+        warning=''
+        unsaved=None             ## the last output time step skipped by buffering
+        while self.traj['grid'] < self.traj['step']:
+            saved={key:copy.deepcopy(val) for key,val in self.traj.items() if key != 'MD_hist'}
+            prev={key:saved[key] for key in ['R','V','E','G','N','At','Ekin']}
+            self.traj['iter']+=1
+            self._adapt_substep()
+
+            self._propagate()    # update E,G,N,R,V,Ekin
+            if self.traj['iter'] > 1:
+                self.traj['drift']=np.abs(self.traj['E'][self.traj['state']-1]+self.traj['Ekin']-self.traj['Etot'])
+            self._thermostat()   # update Ekin,V,Vs
+            self._surfacehop()   # update A,H,D,V,state
+            self._chkerror()
+
+            ## repeat the step with the reduced time step, unless the errors are too large
+            size,accept=AdaptStep(self.traj)
+            if accept == False and self.stop == 0:
+                self.traj.update(saved)
+                self.traj['size']=size
+                continue
+
+            ## total energy after surface hopping, the velocity might be adjusted
+            self.traj['Ekin']=np.sum(0.5*(self.traj['M']*self.traj['V']**2))
+            self.traj['Etot']=self.traj['E'][self.traj['state']-1]+self.traj['Ekin']
+
+            ## keep the surface hopping until it is written to an output time step
+            if self.traj['hoped'] != 0 and self.traj['pending'] == None:
+                self.traj['pending']=[self.traj['old'],self.traj['hoped']]
+
+            if self.traj['iter'] == 1:
+                self.traj['time'] =self.grid
+            else:
+                self.traj['time']+=self.traj['size']
+
+            ## write all output time steps in this step
+            while self.traj['grid'] < self.traj['step'] and (self.traj['grid']+1)*self.grid <= self.traj['time']+1e-8:
+                self.traj['grid']+=1
+                w=1-(self.traj['time']-self.traj['grid']*self.grid)/self.traj['size']
+                out=self._interpolate(prev,np.amax([w,0]))
+                out['iter']=self.traj['grid']
+                out['size']=self.grid
+                if self.traj['pending'] != None:
+                    out['old'],out['hoped']=self.traj['pending']
+                    self.traj['pending']=None
+                else:
+                    out['old'],out['hoped']=self.traj['state'],0
+
+                if self.record == 1:
+                    self._record_hist(out)
+
+                if   out['iter'] <= self.direct:
+                    self._chkpoint(out)
+                else:
+                    self.skipped+=1
+                    unsaved=out
+                    if  self.skipped == self.buffer or out['iter'] == self.traj['step']:
+                        self._chkpoint(out)
+                        self.skipped = 0
+                        unsaved=None
+
+            self.traj['size']=size
+
+            if self.stop == 1:
+                if self.record == 1:
+                    last=self.traj.copy()
+                    last['iter']=self.traj['grid']
+                    self._record_hist(last)
+                if unsaved != None:
+                    self._chkpoint(unsaved)
+                    self.skipped = 0
+                warning='Errors are too large'
+                break
+
+        return warning
+
     def run(self,xyz,velo):
         ## xyz  : list
         ##        Coordinates list of [atom x y z] in angstrom
@@ -510,6 +661,9 @@ class AIMD:
 
         completed=self.traj['iter']
         self.traj['step']+=self.addstep
+        if self.adapt == 1:
+            warning=self._run_adaptive()
+            completed=self.traj['step']
         for iter in range(self.traj['step']-completed):
             self.traj['iter'] = iter+1+completed
             if self.timing == 1: print('start', time.time())
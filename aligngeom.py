@@ -4,159 +4,143 @@
 import numpy as np
 from numpy import linalg as la
 from scipy.optimize import linear_sum_assignment
-from periodic_table import Element
+from periodic_table import AtomMass
+
+## the 6 axis swaps times 8 reflections as 48 transformation matrices, T = Q[:, s] * diag(r) = Q . M
+swap = np.array([
+    [0, 1, 2],
+    [0, 2, 1],
+    [1, 0, 2],
+    [1, 2, 0],
+    [2, 1, 0],
+    [2, 0, 1]])
+
+reflection = np.array([
+    [1, 1, 1],
+    [-1, 1, 1],
+    [1, -1, 1],
+    [1, 1, -1],
+    [-1, -1, 1],
+    [-1, 1, -1],
+    [1, -1, -1],
+    [-1, -1, -1]])
+
+transform = np.array([np.eye(3)[:, s] * r for s in swap for r in reflection])
 
 def RMSD(atoms,xyz,ref):
     ## This function calculate RMSD between product and reference
-    ## This function call kabsch to reduce RMSD between product and reference
-    ## This function call hungarian to align product and reference
+    ## This function call RMSDBatch with a single reference
+
+    return RMSDBatch(atoms,xyz,[ref])[0]
 
-    P=xyz                     ## product coordinates
-    Q=ref                     ## reference coordinates
-    Patoms=[x for x in atoms]
-    Qatoms=[x for x in atoms]
-    P-=P.mean(axis=0)         ## translate to the centroid
-    Q-=Q.mean(axis=0)         ## translate to the centroid
-
-    swap = np.array([
-        [0, 1, 2],
-        [0, 2, 1],
-        [1, 0, 2],
-        [1, 2, 0],
-        [2, 1, 0],
-        [2, 0, 1]])
-
-    reflection = np.array([
-        [1, 1, 1],
-        [-1, 1, 1],
-        [1, -1, 1],
-        [1, 1, -1],
-        [-1, -1, 1],
-        [-1, 1, -1],
-        [1, -1, -1],
-        [-1, -1, -1]])
-
-    order=[]
-    rmsd=[]
-    for s in swap:
-        for r in reflection:
-            Tatoms=[x for x in Qatoms]
-            T =np.array([x for x in Q])
-            T =T[:, s]
-            T =np.dot(T, np.diag(r))
-            T-=T.mean(axis=0)
-            Ip=inertia(Patoms,P)
-            It=inertia(Tatoms,T)
-            U1=rotate(Ip,It)
-            U2=rotate(Ip,-It)
-            T1=np.dot(T,U1)
-            T2=np.dot(T,U2)
-            order1 = hungarian(Patoms, Tatoms, P, T1)
-            order2 = hungarian(Patoms, Tatoms, P, T2)
-            rmsd1=kabsch(P,T[order1])
-            rmsd2=kabsch(P,T[order2])
-            order+=[order1,order2]
-            rmsd+=[rmsd1,rmsd2]
-    pick=np.argmin(rmsd)
-    order=order[pick]
-    rmsd=rmsd[pick]
-    Q=Q[order]
-
-    return rmsd
+def RMSDBatch(atoms,xyz,refs):
+    ## This function calculate RMSD between product and a list of references with the same atoms
+    ## This function call inertia and rotate to align the 48 swapped and reflected references to the product
+    ## This function call hungarian to align product and reference
+    ## This function call kabsch to reduce RMSD between product and reference for all alignments at once
+
+    atoms=np.array(atoms).astype(str)
+    mass=AtomMass(atoms)
+    P=np.array(xyz,dtype=float)
+    P-=P.mean(axis=0)                                         ## translate to the centroid
+    Q=np.array(refs,dtype=float).reshape((-1,len(P),3))
+    Q-=Q.mean(axis=1,keepdims=True)                           ## translate to the centroid
+    nref=len(Q)
+    ntrans=len(transform)
+
+    T=np.einsum('rax,txy->rtay',Q,transform)                  ## (reference,transform,atom,3)
+    T-=T.mean(axis=2,keepdims=True)
+    Ip=inertia(mass,P)                                        ## the product principal axis is computed once
+    It=inertia(mass,T)
+    U1=rotate(Ip,It)
+    U2=rotate(Ip,-It)
+    T1=np.einsum('rtax,rtxy->rtay',T,U1)
+    T2=np.einsum('rtax,rtxy->rtay',T,U2)
+    order1=hungarian(atoms,P,T1.reshape((-1,len(P),3)))
+    order2=hungarian(atoms,P,T2.reshape((-1,len(P),3)))
+    order=np.stack((order1,order2),axis=1)                    ## (reference*transform,2,atom)
+
+    T=np.repeat(T.reshape((-1,len(P),3)),2,axis=0)
+    order=order.reshape((-1,len(P)))
+    T=np.take_along_axis(T,order[:,:,None],axis=1)
+    rmsd=kabsch(P,T).reshape((nref,ntrans*2))
+
+    return np.amin(rmsd,axis=1)
 
 def kabsch(P,Q):
     ## This function use Kabsch algorithm to reduce RMSD by rotation
+    ## Q is in shape of (atom,3) or (batch,atom,3), all SVD are done at once
 
-    C = np.dot(np.transpose(P), Q)
+    C = np.einsum('ax,...ay->...xy', P, Q)
     V, S, W = np.linalg.svd(C)
     d = (np.linalg.det(V) * np.linalg.det(W)) < 0.0
-    if d:                    # ensure right-hand system
-        S[-1] = -S[-1]
-        V[:, -1] = -V[:, -1]
-    U = np.dot(V, W)
-    P = np.dot(P, U)
+    V[..., :, -1] = np.where(d[..., None], -V[..., :, -1], V[..., :, -1])  # ensure right-hand system
+    U = np.matmul(V, W)
+    P = np.matmul(P, U)
     diff = P-Q
-    N = len(P)
-    return np.sqrt((diff * diff).sum() / N)
+    N = P.shape[-2]
+    return np.sqrt((diff * diff).sum(axis=(-2, -1)) / N)
 
-def inertia(atoms,xyz):
+def inertia(mass,xyz):
     ## This function calculate principal axis
+    ## xyz is in shape of (atom,3) or (...,atom,3)
 
-    xyz=np.array([i for i in xyz])   # copy the array to avoid changing it
-    mass=[]
-    for i in atoms:
-        m=Element(i).getMass()
-        mass.append(m)
-    mass=np.array(mass)
-    xyz-=np.average(xyz,weights=mass,axis=0)
-    xx=0.0
-    yy=0.0
-    zz=0.0
-    xy=0.0
-    xz=0.0
-    yz=0.0
-    for n,i in enumerate(xyz):
-        xx+= mass[n]*(i[1]**2+i[2]**2)
-        yy+= mass[n]*(i[0]**2+i[2]**2)
-        zz+= mass[n]*(i[0]**2+i[1]**2)
-        xy+=-mass[n]*i[0]*i[1]
-        xz+=-mass[n]*i[0]*i[2]
-        yz+=-mass[n]*i[1]*i[2]
-
-    I=np.array([[xx,xy,xz],[xy,yy,yz],[xz,yz,zz]])
+    xyz=xyz-np.einsum('a,...ax->...x',mass,xyz)[..., None, :]/np.sum(mass)
+    r2=np.sum(xyz**2,axis=-1)
+    I=np.einsum('a,...a->...',mass,r2)[..., None, None]*np.eye(3)-np.einsum('a,...ax,...ay->...xy',mass,xyz,xyz)
     eigval,eigvec=np.linalg.eig(I)
+    pick=np.argmax(eigval,axis=-1)
 
-    return eigvec[np.argmax(eigval)]
+    return np.take_along_axis(eigvec,pick[..., None, None],axis=-2)[..., 0, :]
 
 def rotate(p,q):
     ## This function calculate the matrix rotate p onto q
+    ## p is a vector and q is in shape of (3) or (...,3)
+
+    q = np.asarray(q)
+    v = np.cross(p, q)
+    s = np.linalg.norm(v, axis=-1)
+    c = np.einsum('x,...x->...', p, q)
+    zero = np.zeros(s.shape)
+    vx = np.stack([
+        np.stack([zero, -v[..., 2], v[..., 1]], axis=-1),
+        np.stack([v[..., 2], zero, -v[..., 0]], axis=-1),
+        np.stack([-v[..., 1], v[..., 0], zero], axis=-1)], axis=-2)
+    same = np.all(p == q, axis=-1)
+    opposite = np.all(p == -q, axis=-1)
+    scale = np.where(same | opposite, 0., (1.-c)/np.where(same | opposite, 1., s*s))
+    U = np.eye(3) + vx + np.matmul(vx, vx)*scale[..., None, None]
+    U = np.where(same[..., None, None], np.eye(3), U)
+    # return a rotation of pi around the y-axis
+    U = np.where(opposite[..., None, None], np.diag([-1., 1., -1.]), U)
+
+    return U
+
+def hungarian(atoms,P,Q):
+    ## This function use hungarian algorithm to align P onto Q for a batch of Q in shape of (batch,atom,3)
+    ## The assignment is only ambiguous for the elements appear more than once
+    ## If every atom of P picks a different nearest atom in Q, the picks are already the optimal assignment
+    ## Otherwise this function call linear_sum_assignment from scipy to solve hungarian problem
+
+    reorder=np.tile(np.arange(len(atoms)),(len(Q),1))
+    for atom in np.unique(atoms):
+        idx=np.where(atoms == atom)[0]
+        if len(idx) == 1:
+            continue
+        AB=la.norm(P[None, idx, None, :]-Q[:, None, idx, :],axis=-1)
+        Bidx=np.argmin(AB,axis=2)
+        for n in range(len(Q)):
+            if len(np.unique(Bidx[n])) != len(idx):
+                Aidx,Bidx[n] = linear_sum_assignment(AB[n])
+        reorder[:, idx] = idx[Bidx]
 
-    if (p == q).all():
-        return np.eye(3)
-    elif (p == -q).all():
-        # return a rotation of pi around the y-axis
-        return np.array([[-1.,0.,0.],[0.,1.,0.],[0.,0.,-1.]])
-    else:
-        v = np.cross(p, q)
-        s = np.linalg.norm(v)
-        c = np.vdot(p, q)
-        vx = np.array([[0., -v[2], v[1]], [v[2], 0., -v[0]], [-v[1], v[0], 0.]])
-        return np.eye(3) + vx + np.dot(vx,vx)*((1.-c)/(s*s))
-
-def hungarian(Patoms,Qatoms,P,Q):
-    ## This function use hungarian algorithm to align P onto Q
-    ## This function call linear_sum_assignment from scipy to solve hungarian problem
-    ## This function call inertia to find principal axis
-    ## This function call rotate to rotate P onto aligned Q
-
-    unique_atoms=np.unique(Patoms)
-
-    reorder=np.zeros(len(Qatoms),dtype=int)
-    for atom in unique_atoms:
-        Pidx=[]
-        Qidx=[]
-
-        for n,p in enumerate(Patoms):
-            if p == atom:
-                Pidx.append(n)
-        for m,q in enumerate(Qatoms):
-            if q == atom:
-                Qidx.append(m)
-
-        Pidx=np.array(Pidx)
-        Qidx=np.array(Qidx)
-        A=P[Pidx]
-        B=Q[Qidx]
-        AB=np.array([[la.norm(a-b) for b in B] for a in A])
-        Aidx,Bidx = linear_sum_assignment(AB)
-        reorder[Pidx] = Qidx[Bidx]
     return reorder
 
 def AlignGeom(x,geom_pool):
-    ## This function align a geometry with all train data geometries to find most similar one 
+    ## This function align a geometry with all train data geometries to find most similar one
     atoms=np.array(x)[:,0].astype(str)
     xyz=np.array(x)[:,1:4].astype(float)
-    similar=[RMSD(atoms,xyz,np.array(geom)[:,1:4].astype(float)) for geom in geom_pool]
+    refs=[np.array(geom)[:,1:4].astype(float) for geom in geom_pool]
+    similar=RMSDBatch(atoms,xyz,refs)
 
     return np.argmin(similar),np.amin(similar)
-
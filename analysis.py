@@ -0,0 +1,306 @@
+## Ensemble trajectory analysis for PyRAIMD
+## Stream over the trajectory outputs to compute populations, hopping statistics, energy drift and lifetimes
+
+import os,sys,time,glob,pickle
+import multiprocessing
+import numpy as np
+from optparse import OptionParser
+
+def TrajectoryFiles(path):
+    ## This function return the log and energies file of a trajectory directory
+    ## The trajectory directory has the same name as the trajectory title
+
+    title=os.path.basename(os.path.normpath(path))
+
+    return ['%s/%s.log' % (path,title),'%s/%s.md.energies' % (path,title)]
+
+def ReadTrajectory(path):
+    ## This function read the .log and .md.energies files of a trajectory line by line
+    ## Only the per-step populations and states and a few numbers of energies are kept in memory
+    ## This function return the partial results of a trajectory as a dict
+
+    log,energies=TrajectoryFiles(path)
+
+    record={}  # iter : [populations, state]
+    hop={}     # iter : [old state, new state]
+    order=[]   # iter of each step in the order of writing
+    dt=0
+    ci=0
+    iter=0
+    pop=None
+    with open(log,'r') as mdlog:
+        for line in mdlog:
+            if   line.startswith(' Iter:'):
+                iter=int(line.split()[1])
+                dt=float(line.split('dt =')[1].split()[0])
+                order.append(iter)
+            elif line.startswith(' Gnuplot:'):
+                value=line.split()[1:]
+                ci=int((len(value)-1)/2)
+                pop=[float(x) for x in value[0:ci]]
+            elif line.startswith(' At state:'):
+                record[iter]=[pop,int(line.split()[-1])]
+            elif line.startswith(' From state:'):
+                old,new=int(line.split()[2]),int(line.split()[-2])
+                record[iter]=[pop,new]
+                hop[iter]=[old,new]
+
+    ## total energy of the current state in column 4, tracked without storing the whole file
+    ## the time of each step is taken from column 1, because the log prints dt as an integer
+    ## each step writes one line to .log and .md.energies at the same time, thus the n-th lines match
+    energy={'first':None,'last':None,'maxdev':0.0,'t0':0.0,'t1':0.0}
+    steptime={}  # iter : time
+    if os.path.exists(energies) == True:
+        with open(energies,'r') as mdenergy:
+            mdenergy.readline()
+            n=0
+            for line in mdenergy:
+                value=line.split()
+                if len(value) < 4:
+                    continue
+                t,etot=float(value[0]),float(value[3])
+                if n < len(order):
+                    steptime[order[n]]=t
+                n+=1
+                if energy['first'] == None:
+                    energy['first']=etot
+                    energy['t0']=t
+                energy['last']=etot
+                energy['t1']=t
+                energy['maxdev']=np.amax([energy['maxdev'],np.abs(etot-energy['first'])])
+
+    ## a restarted trajectory may write the same step twice, the later one is kept
+    iters=np.array(sorted(record.keys()),dtype=int)
+    times=np.array([steptime.get(i,i*dt) for i in iters])
+    pops=np.array([record[i][0] for i in iters]).reshape((len(iters),ci))
+    states=np.array([record[i][1] for i in iters],dtype=int)
+
+    hops={}
+    for old,new in hop.values():
+        hops[(old,new)]=hops.get((old,new),0)+1
+
+    ## residence time of each visit of a state, the last visit is censored by the end of trajectory
+    ## the trajectory starts at time 0 in the state before the first recorded step
+    visits=[]
+    if len(iters) > 0:
+        begin=0.0
+        last=states[0]
+        if iters[0] in hop.keys():
+            last=hop[iters[0]][0]
+        for t,s in zip(times,states):
+            if s != last:
+                visits.append([last,t-begin,0])
+                begin=t
+                last=s
+        visits.append([last,times[-1]-begin,1])
+
+    result={
+    'path'   : path,
+    'ci'     : ci,
+    'iter'   : iters,
+    'time'   : times,
+    'pop'    : pops,
+    'state'  : states,
+    'hops'   : hops,
+    'visits' : visits,
+    'energy' : energy,
+    }
+
+    return result
+
+def AnalyzeTrajectory(path):
+    ## This function return the partial results of a trajectory
+    ## The partial results are cached in the trajectory directory
+    ## The cache is reused if the size and mtime of the .log and .md.energies files are unchanged
+
+    files=TrajectoryFiles(path)
+    if os.path.exists(files[0]) == False:
+        return None
+
+    stat=[[os.stat(x).st_size,os.stat(x).st_mtime_ns] if os.path.exists(x) else None for x in files]
+    cache='%s.analysis.pkl' % (os.path.splitext(files[0])[0])
+
+    if os.path.exists(cache) == True:
+        try:
+            with open(cache,'rb') as infile:
+                saved=pickle.load(infile)
+            if saved['stat'] == stat:
+                return saved['result']
+        except Exception:
+            pass
+
+    result=ReadTrajectory(path)
+    try:
+        with open(cache,'wb') as outfile:
+            pickle.dump({'stat':stat,'result':result},outfile,protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        pass
+
+    return result
+
+def FindTrajectory(title):
+    ## This function find the trajectory directories <title>-<n> in the current directory
+
+    paths=[]
+    for path in glob.glob('%s-*' % (title)):
+        n=path[len(title)+1:]
+        if n.isdigit() and os.path.isdir(path):
+            paths.append([int(n),os.path.abspath(path)])
+
+    return [x[1] for x in sorted(paths)]
+
+def Analyze(title,paths=None,ncpu=1):
+    ## This function merge the partial results of all trajectories into the ensemble results
+    ## The partial results are reduced into running sums as soon as they are received
+    ## Thus the memory does not grow with the number of trajectories
+    ## This function write the populations to <title>.pop and return the report
+
+    if paths == None:
+        paths=FindTrajectory(title)
+
+    ntraj=len(paths)
+    ci=0
+    times={}       # iter : time
+    pop_sum={}     # iter : sum of populations
+    occupation={}  # iter : number of trajectories in each state
+    count={}       # iter : number of trajectories
+    hops={}
+    visit_sum={}   # state : [total time of finished visits, number of finished visits, number of censored visits]
+    first_exit=[0.0,0,0]  # sum of times leaving the initial state, number of left, number of stayed
+    drift=[]
+    maxdev=[]
+    found=0
+    nstep=0
+
+    ncpu=np.amax([np.amin([ntraj,ncpu]),1])
+    pool=multiprocessing.Pool(processes=ncpu)
+    for result in pool.imap_unordered(AnalyzeTrajectory,paths):
+        if result == None or len(result['iter']) == 0:
+            continue
+        found+=1
+        ci=np.amax([ci,result['ci']])
+        nstep=np.amax([nstep,result['iter'][-1]])
+        for i,t,p,s in zip(result['iter'],result['time'],result['pop'],result['state']):
+            if i not in count.keys():
+                times[i]=t
+                count[i]=0
+                pop_sum[i]=np.zeros(ci)
+                occupation[i]=np.zeros(ci)
+            count[i]+=1
+            pop_sum[i]+=p
+            occupation[i][s-1]+=1
+
+        for pair,n in result['hops'].items():
+            hops[pair]=hops.get(pair,0)+n
+
+        for state,t,censored in result['visits']:
+            if state not in visit_sum.keys():
+                visit_sum[state]=[0.0,0,0]
+            if censored == 0:
+                visit_sum[state][0]+=t
+                visit_sum[state][1]+=1
+            else:
+                visit_sum[state][2]+=1
+
+        initial=result['visits'][0]
+        if initial[2] == 0:
+            first_exit[0]+=initial[1]
+            first_exit[1]+=1
+        else:
+            first_exit[2]+=1
+
+        energy=result['energy']
+        if energy['first'] != None:
+            maxdev.append(energy['maxdev'])
+            if energy['t1'] > energy['t0']:
+                drift.append((energy['last']-energy['first'])/(energy['t1']-energy['t0']))
+    pool.close()
+    pool.join()
+
+    iters=sorted(count.keys())
+    pop_info='%8s%8s%s%s\n' % ('time','ntraj',''.join(['%24s' % ('pop %s' % (n+1)) for n in range(ci)]),''.join(['%12s' % ('state %s' % (n+1)) for n in range(ci)]))
+    for i in iters:
+        pop_info+='%8.2f%8d%s%s\n' % (times[i],count[i],''.join(['%24.16f' % (x) for x in pop_sum[i]/count[i]]),''.join(['%12.4f' % (x) for x in occupation[i]/count[i]]))
+
+    mdpop=open('%s.pop' % (title),'w')
+    mdpop.write(pop_info)
+    mdpop.close()
+
+    hop_info=''
+    for pair in sorted(hops.keys()):
+        hop_info+='  %3d -> %3d                 %-10s\n' % (pair[0],pair[1],hops[pair])
+    if len(hop_info) == 0:
+        hop_info='  no surface hopping\n'
+
+    life_info=''
+    for state in sorted(visit_sum.keys()):
+        t,n,c=visit_sum[state]
+        life_info+='  State %3d:                 %-16s finished %-6s censored %-6s\n' % (state,'%.2f' % (t/n) if n > 0 else 'N/A',n,c)
+    life_info+='  Leaving initial state:     %-16s finished %-6s censored %-6s\n' % ('%.2f' % (first_exit[0]/first_exit[1]) if first_exit[1] > 0 else 'N/A',first_exit[1],first_exit[2])
+
+    if len(maxdev) > 0:
+        energy_info='  Max |Etot-Etot0| (Eh):     mean %-16.8f max %-16.8f\n' % (np.mean(maxdev),np.amax(maxdev))
+    else:
+        energy_info='  Max |Etot-Etot0| (Eh):     N/A\n'
+    if len(drift) > 0:
+        energy_info+='  Drift (Eh/au):             mean %-16.4e max %-16.4e\n' % (np.mean(drift),np.amax(np.abs(drift)))
+
+    report="""
+  &ensemble analysis
+-------------------------------------------------------
+  Trajectories:               %-10s
+  Analyzed:                   %-10s
+  Recorded steps:             %-10s
+  Last step:                  %-10s
+  Populations saved in:       %-10s
+-------------------------------------------------------
+
+  &surface hopping
+-------------------------------------------------------
+%s-------------------------------------------------------
+
+  &lifetime in au (mean of the finished visits)
+-------------------------------------------------------
+%s-------------------------------------------------------
+
+  &energy conservation
+-------------------------------------------------------
+%s-------------------------------------------------------
+""" % (ntraj,found,len(iters),nstep,'%s.pop' % (title),hop_info,life_info,energy_info)
+
+    return report
+
+def main():
+    ## This is the main function
+    ## This function calls Analyze to summarize the trajectories in the current directory
+
+    usage="""
+
+    Ensemble trajectory analysis for PyRAIMD
+
+    Usage:
+      python3 analysis.py -t title -n 4
+      python3 analysis.py -h for help
+
+    """
+    description='Ensemble trajectory analysis for PyRAIMD'
+    parser = OptionParser(usage=usage, description=description)
+    parser.add_option('-t', dest='title',   type=str,   nargs=1, help='Title of the calculation, the trajectories are in title-1, title-2, ...')
+    parser.add_option('-n', dest='ncpu',    type=int,   nargs=1, help='Number of processes. Default is 1.',default=1)
+
+    (options, args) = parser.parse_args()
+    if options.title == None:
+        print (usage)
+        exit()
+
+    start=time.time()
+    report=Analyze(options.title,ncpu=options.ncpu)
+    print(report)
+    print('  Analysis time: %.2f s' % (time.time()-start))
+
+    analysis=open('%s.analysis' % (options.title),'w')
+    analysis.write(report)
+    analysis.close()
+
+if __name__ == '__main__':
+    main()
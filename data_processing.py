@@ -3,64 +3,70 @@
 
 import numpy as np
 import json
-
-def GetInvR(R):
-    ## This functoin convert coordinates to inverse R matrix
-    ## This function is only used for interfacing with PyRAIMD
-
-    invr=[]
-    q=R[1:]
-    for atom1 in R:
-        for atom2 in q:
-            d=np.sum((atom1-atom2)**2)**0.5
-            invr.append(1/d)
-        q=q[1:]
-
-    invr=np.array(invr)
-    return invr
-
-def Prepdata(data,ml_seed,ratio,increment):
+from training_data import TrainingData,LoadTrainData
+from featurizer import GetInvR
+
+class PartitionData(dict):
+    ## This class is the postdata dict, the data arrays are read from the training data on the first request
+    ## coord, invr, energy, gradient and nac are the entries in the order of train, validation, test
+    ## <field>_train, <field>_val and <field>_test are the partitions of each field
+    ## The partitions cached by the previous postdata are kept, thus only the new entries are read from the training data
+
+    fields = ['coord','invr','energy','gradient','nac']
+    parts  = ['train','val','test']
+
+    def __init__(self,data,prevdata=None,**kwargs):
+        dict.__init__(self,**kwargs)
+        self.data = data
+        self.base = {}
+        if isinstance(prevdata,PartitionData):
+            for key in [x for x in prevdata.keys() if x.rsplit('_',1)[-1] in self.parts and x.rsplit('_',1)[0] in self.fields]:
+                self.base[key] = prevdata.pop(key)
+
+    def __missing__(self,key):
+        if key in self.fields:
+            order=np.concatenate([self['index_%s' % (x)] for x in self.parts])
+            value=self.data.take(key,order)
+        elif key.rsplit('_',1)[-1] in self.parts and key.rsplit('_',1)[0] in self.fields:
+            field,part=key.rsplit('_',1)
+            index=self['index_%s' % (part)]
+            prev=self.base.pop(key,np.zeros(0))
+            if len(index) == len(prev):
+                value=prev
+            elif len(prev) == 0:
+                value=self.data.take(field,index)
+            else:
+                value=np.concatenate((prev,self.data.take(field,index[len(prev):])))
+        else:
+            raise KeyError(key)
+
+        self[key]=value
+
+        return value
+
+def Prepdata(data,ml_seed,ratio,increment,prevdata=None):
+    ## data is a TrainingData, the statistics are merged from the chunk statistics
+    ## prevdata is the postdata of the previous call, its partition is kept and only the new entries are partitioned
     data_info=''
-    natom,nstate,xyz,invr,energy,gradient,nac,ci,mo=data
-    xyz=np.array(xyz)
-    invr=np.array(invr)
-    energy=np.array(energy)
-    gradient=np.array(gradient)
-    nac=np.array(nac)
-
-    nmol=len(invr)                    # number of molecule
-    ninvr=len(invr[0])                # number of distance per molecule, which is the input size
-    nenergy=len(energy[0])            # number of energy per molecule, which is the output size
-    ngrad=len(gradient[0])/(natom*3)  # number of gradient matrix per molecule
-    nnac=len(nac[0])/(natom*3)        # number of non-adiabatic matrix per molecule
-
-    max_invr=np.amax(invr)
-    min_invr=np.amin(invr)
+    natom=data.natom
+    nstate=data.nstate
+    atoms=data.atoms
+
+    max_invr,min_invr,avg_invr,std_invr=data.stats('invr')
     mid_invr=(max_invr+min_invr)/2
     dev_invr=(max_invr-min_invr)/2
-    avg_invr=np.mean(invr)
-    std_invr=np.std(invr)
 
-    max_energy=np.amax(energy)
-    min_energy=np.amin(energy)
+    max_energy,min_energy,avg_energy,std_energy=data.stats('energy')
     mid_energy=(max_energy+min_energy)/2
     dev_energy=(max_energy-min_energy)/2
-    avg_energy=np.mean(energy)
-    std_energy=np.std(energy)
 
-    max_gradient=np.amax(gradient)
-    min_gradient=np.amin(gradient)
+    max_gradient,min_gradient,avg_gradient,std_gradient=data.stats('gradient')
     mid_gradient=(max_gradient+min_gradient)/2
     dev_gradient=(max_gradient-min_gradient)/2
-    avg_gradient=np.mean(gradient)
-    std_gradient=np.std(gradient)
 
-    max_nac=np.amax(nac)
-    min_nac=np.amin(nac)
+    max_nac,min_nac,avg_nac,std_nac=data.stats('nac')
     mid_nac=(max_nac+min_nac)/2
     dev_nac=(max_nac-min_nac)/2
-    avg_nac=np.mean(nac)
-    std_nac=np.std(nac)
 
     data_info+="""
   &training data
@@ -81,10 +87,10 @@ def Prepdata(data,ml_seed,ratio,increment):
              avg/std: %16.8f %16.8f
        	     mid/dev: %16.8f %16.8f
 
-""" % (np.amax(invr),     np.amin(invr),     avg_invr,     std_invr,     mid_invr,     dev_invr,    \
-       np.amax(energy),   np.amin(energy),   avg_energy,   std_energy,   mid_energy,   dev_energy,  \
-       np.amax(gradient), np.amin(gradient), avg_gradient, std_gradient, mid_gradient, dev_gradient,\
-       np.amax(nac),      np.amin(nac),      avg_nac,      std_nac,      mid_nac,      dev_nac)
+""" % (max_invr,     min_invr,     avg_invr,     std_invr,     mid_invr,     dev_invr,    \
+       max_energy,   min_energy,   avg_energy,   std_energy,   mid_energy,   dev_energy,  \
+       max_gradient, min_gradient, avg_gradient, std_gradient, mid_gradient, dev_gradient,\
+       max_nac,      min_nac,      avg_nac,      std_nac,      mid_nac,      dev_nac)
 
 #    This will be done by ML models 
 #    # shift input to the averaged value and scaled by standard deviation
@@ -102,10 +108,15 @@ def Prepdata(data,ml_seed,ratio,increment):
 #""" % (np.amax(invr),     np.amin(invr),     np.amax(energy), np.amin(energy),\
 #       np.amax(gradient), np.amin(gradient), np.amax(nac),    np.amin(nac))
 
-    invr_train,invr_val,invr_test=partition(ml_seed,invr,ratio,increment)
-    energy_train,energy_val,energy_test=partition(ml_seed,energy,ratio,increment)
-    gradient_train,gradient_val,gradient_test=partition(ml_seed,gradient,ratio,increment)
-    nac_train,nac_val,nac_test=partition(ml_seed,nac,ratio,increment)
+    ## only the partition index is computed here, the data arrays are read when a model requests them
+    if prevdata == None:
+        index_train,index_val,index_test=partition(ml_seed,0,len(data),ratio,increment)
+    else:
+        index_train,index_val,index_test=partition(ml_seed,prevdata['size'],len(data),ratio,increment)
+        index_train=np.concatenate((prevdata['index_train'],index_train))
+        index_val=np.concatenate((prevdata['index_val'],index_val))
+        index_test=np.concatenate((prevdata['index_test'],index_test))
+    ntrain,nval,ntest=len(index_train),len(index_val),len(index_test)
 
     data_info+="""
   &post data
@@ -117,55 +128,44 @@ def Prepdata(data,ml_seed,ratio,increment):
   gradient   train/validation/test: %5d %5d %5d
   nac        train/validation/test: %5d %5d %5d
 """ % (ml_seed, ratio[0],            ratio[1],          1-ratio[0]-ratio[1],\
-                len(invr_train),     len(invr_val),     len(invr_test),     \
-                len(energy_train),   len(energy_val),   len(energy_test),   \
-                len(gradient_train), len(gradient_val), len(gradient_test), \
-                len(nac_train),len(nac_val),len(nac_test))
-
-    postdata={
-    'natom'          : natom,
-    'nstate'         : nstate,
-    'npair'          : int(nstate*(nstate-1)/2),
-    'xyz'            : xyz,
-    'invr'           : invr,
-    'mean_invr'      : avg_invr,
-    'std_invr'       : std_invr,
-    'mid_invr'       : mid_invr,
-    'dev_invr'       : dev_invr,
-    'invr_train'     : invr_train,
-    'invr_val'       : invr_val,
-    'invr_test'      : invr_test,
-    'energy'         : energy,
-    'mean_energy'    : avg_energy,
-    'std_energy'     : std_energy,
-    'mid_energy'     : mid_energy,
-    'dev_energy'     : dev_energy,
-    'energy_train'   : energy_train,
-    'energy_val'     : energy_val,
-    'energy_test'    : energy_test,
-    'gradient'       : gradient,
-    'mean_gradient'  : avg_gradient,
-    'std_gradient'   : std_gradient,
-    'mid_gradient'   : mid_gradient,
-    'dev_gradient'   : dev_gradient,
-    'gradient_train' : gradient_train,
-    'gradient_val'   : gradient_val,
-    'gradient_test'  : gradient_test,
-    'nac'            : nac,
-    'mean_nac'       : avg_nac,
-    'std_nac'        : std_nac,
-    'mid_nac'        : mid_nac,
-    'dev_nac'        : dev_nac,
-    'nac_train'      : nac_train,
-    'nac_val'        : nac_val,
-    'nac_test'       : nac_test,
-    }
+                ntrain,              nval,              ntest,              \
+                ntrain,              nval,              ntest,              \
+                ntrain,              nval,              ntest,              \
+                ntrain,              nval,              ntest)
+
+    postdata=PartitionData(data,prevdata,
+    natom          = natom,
+    nstate         = nstate,
+    npair          = int(nstate*(nstate-1)/2),
+    size           = len(data),
+    index_train    = index_train,
+    index_val      = index_val,
+    index_test     = index_test,
+    atoms          = atoms,
+    mean_invr      = avg_invr,
+    std_invr       = std_invr,
+    mid_invr       = mid_invr,
+    dev_invr       = dev_invr,
+    mean_energy    = avg_energy,
+    std_energy     = std_energy,
+    mid_energy     = mid_energy,
+    dev_energy     = dev_energy,
+    mean_gradient  = avg_gradient,
+    std_gradient   = std_gradient,
+    mid_gradient   = mid_gradient,
+    dev_gradient   = dev_gradient,
+    mean_nac       = avg_nac,
+    std_nac        = std_nac,
+    mid_nac        = mid_nac,
+    dev_nac        = dev_nac,
+    )
 
     return postdata,data_info
 
-def partition(sd,data,ratio,increment):
+def partition(sd,start,size,ratio,increment):
+    ## This function split the entries from start to size into train, validation and test
+    ## This function return the index of each partition
     np.random.seed(sd)
-    size=len(data)
     pick_train=[]
     pick_validation=[]
     pick_test=[]
@@ -174,25 +174,21 @@ def partition(sd,data,ratio,increment):
 
     if increment == 0:
         block=1
-        increment=size
+        increment=size-start
     else:
-        block=int(size/increment)
+        block=int((size-start)/increment)
 
     for i in range(block):
-        full=np.arange(size)[i*increment:(i+1)*increment]
+        full=np.arange(start,size)[i*increment:(i+1)*increment]
         pick=np.random.choice(full,int(increment*weight_train),replace=False)
         pick_train=np.append(pick_train,pick)
-        remain=[i for i in full if i not in pick_train]
+        remain=full[np.isin(full,pick,invert=True)]
         pick=np.random.choice(remain,int(increment*weight_validation),replace=False)
         pick_validation=np.append(pick_validation,pick)
-        pick=[i for i in remain if i not in pick_validation]
+        pick=remain[np.isin(remain,pick,invert=True)]
         pick_test=np.append(pick_test,pick)
 
-    train=data[pick_train.astype(int),:]
-    validation=data[pick_validation.astype(int),:]
-    test=data[pick_test.astype(int),:]
-
-    return train,validation,test
+    return np.array(pick_train).astype(int),np.array(pick_validation).astype(int),np.array(pick_test).astype(int)
 
 def TrainDataInfo(variables):
     ## This function read train data and compute sgm (std or deviation) and miu (average or middle) and more
@@ -202,8 +198,10 @@ def TrainDataInfo(variables):
     ml_seed=variables['ml_seed']
     ratio=variables['ratio']
     increment=variables['increment']
-    with open('%s' % in_data,'r') as indata:
-        data=json.load(indata)
+    if 'nentry' in variables.keys():
+        data=TrainingData(in_data,size=variables['nentry'])
+    else:
+        data=LoadTrainData(in_data)
     postdata,data_info=Prepdata(data,ml_seed,ratio,increment)
 
     return data,postdata,data_info
@@ -211,24 +209,23 @@ def TrainDataInfo(variables):
 def AddTrainData(variables,newdata,iter):
     ## This function merge train data and new data then compute sgm (std or deviation) and miu (average or middle) and more
     ## This function is only used for interfacing with PyRAIMD
+    ## The new data are appended to the binary training data as a new chunk, the previous data are not rewritten
 
     data=variables['data']
     ml_seed=variables['ml_seed']
     ratio=variables['ratio']
-    natom,nstate,xyz,invr,energy,gradient,nac,ci,mo=data
+    xyz,energy,gradient,nac,ci,mo=[],[],[],[],[],[]
     for new in newdata:
         xyz     += [new[0]]
-        invr    += [GetInvR(np.array(new[0])[:,1:4].astype(float)).tolist()]
         energy  += [new[1]]
         gradient+= [new[2]]
         nac     += [new[3]]
         ci      += [new[4]]
         mo      += [new[5]]
-    data=[natom,nstate,xyz,invr,energy,gradient,nac,ci,mo]
-    postdata,data_info=Prepdata(data,ml_seed,ratio,0)
-
-    with open('New-data%s-%s.json' % (len(invr),iter),'w') as in_data:
-        json.dump(data,in_data)
+    ## no new data when all calculations failed or all geometries were filtered out
+    if len(newdata) > 0:
+        invr=GetInvR(np.array(xyz)[:,:,1:4].astype(float))
+        data.append(xyz,invr,energy,gradient,nac,ci,mo)
+    postdata,data_info=Prepdata(data,ml_seed,ratio,0,prevdata=variables['postdata'])
 
     return data,postdata,data_info
-
@@ -4,167 +4,11 @@
 ### major fix on boltzmann sampling Dec 20 2019 Jingbai Li
 ### support Molcas, G16, BAGEL, ORCA Aug 19 2020 Jingbai Li
 
-import os,sys,random
+import os,sys,pickle,hashlib
 import numpy as np
 from optparse import OptionParser
 from numpy import linalg as la
-
-class Element:
-    ## This class is periodic table
-    ## This class read atom name in various format
-    ## This class return atomic properties
-
-    def __init__(self,name):
-
-        Periodic_Table = {
-             "HYDROGEN":"1","H":"1","1":"1",
-             "HELIUM":"2","He":"2","2":"2","HE":"2",
-             "LITHIUM":"3","Li":"3","3":"3","LI":"3",
-             "BERYLLIUM":"4","Be":"4","4":"4","BE":"4",
-             "BORON":"5","B":"5","5":"5",
-             "CARBON":"6","C":"6","6":"6",
-             "NITROGEN":"7","N":"7","7":"7",
-             "OXYGEN":"8","O":"8","8":"8",
-             "FLUORINE":"9","F":"9","9":"9",
-             "NEON":"10","Ne":"10","10":"10","NE":"10",
-             "SODIUM":"11","Na":"11","11":"11","NA":"11",
-             "MAGNESIUM":"12","Mg":"12","12":"12","MG":"12",
-             "ALUMINUM":"13","Al":"13","13":"13","AL":"12",
-             "SILICON":"14","Si":"14","14":"14","SI":"14",
-             "PHOSPHORUS":"15","P":"15","15":"15",
-             "SULFUR":"16","S":"16","16":"16",
-             "CHLORINE":"17","Cl":"17","17":"17","CL":"17",
-             "ARGON":"18","Ar":"18","18":"18","AG":"18",
-             "POTASSIUM":"19","K":"19","19":"19",
-             "CALCIUM":"20","Ca":"20","20":"20","CA":"20",
-             "SCANDIUM":"21","Sc":"21","21":"21","SC":"21",
-             "TITANIUM":"22","Ti":"22","22":"22","TI":"22",
-             "VANADIUM":"23","V":"23","23":"23",
-             "CHROMIUM":"24","Cr":"24","24":"24","CR":"24",
-             "MANGANESE":"25","Mn":"25","25":"25","MN":"25",
-             "IRON":"26","Fe":"26","26":"26","FE":"26",
-             "COBALT":"27","Co":"27","27":"27","CO":"27",
-             "NICKEL":"28","Ni":"28","28":"28","NI":"28",
-             "COPPER":"29","Cu":"29","29":"29","CU":"29",
-             "ZINC":"30","Zn":"30","30":"30","ZN":"30",
-             "GALLIUM":"31","Ga":"31","31":"31","GA":"31",
-             "GERMANIUM":"32","Ge":"32","32":"32","GE":"32",
-             "ARSENIC":"33","As":"33","33":"33","AS":"33",
-             "SELENIUM":"34","Se":"34","34":"34","SE":"34",
-             "BROMINE":"35","Br":"35","35":"35","BR":"35",
-             "KRYPTON":"36","Kr":"36","36":"36","KR":"36",
-             "RUBIDIUM":"37","Rb":"37","37":"37","RB":"37",
-             "STRONTIUM":"38","Sr":"38","38":"38","SR":"38",
-             "YTTRIUM":"39","Y":"39","39":"39",
-             "ZIRCONIUM":"40","Zr":"40","40":"40","ZR":"40",
-             "NIOBIUM":"41","Nb":"41","41":"41","NB":"41",
-             "MOLYBDENUM":"42","Mo":"42","42":"42","MO":"42",
-             "TECHNETIUM":"43","Tc":"43","43":"43","TC":"43",
-             "RUTHENIUM":"44","Ru":"44","44":"44","RU":"44",
-             "RHODIUM":"45","Rh":"45","45":"45","RH":"45",
-             "PALLADIUM":"46","Pd":"46","46":"46","PD":"46",
-             "SILVER":"47","Ag":"47","47":"47","AG":"47",
-             "CADMIUM":"48","Cd":"48","48":"48","CD":"48",
-             "INDIUM":"49","In":"49","49":"49","IN":"49",
-             "TIN":"50","Sn":"50","50":"50","SN":"50",
-             "ANTIMONY":"51","Sb":"51","51":"51","SB":"51",
-             "TELLURIUM":"52","Te":"52","52":"52","TE":"52",
-             "IODINE":"53","I":"53","53":"53",
-             "XENON":"54","Xe":"54","54":"54","XE":"54",
-             "CESIUM":"55","Cs":"55","55":"55","CS":"55",
-             "BARIUM":"56","Ba":"56","56":"56","BA":"56",
-             "LANTHANUM":"57","La":"57","57":"57","LA":"57",
-             "CERIUM":"58","Ce":"58","58":"58","CE":"58", 
-             "PRASEODYMIUM":"59","Pr":"59","59":"59","PR":"59",
-             "NEODYMIUM":"60","Nd":"60","60":"60","ND":"60", 
-             "PROMETHIUM":"61","Pm":"61","61":"61","PM":"61", 
-             "SAMARIUM":"62","Sm":"62","62":"62","SM":"62",
-             "EUROPIUM":"63","Eu":"63","63":"63","EU":"63", 
-             "GADOLINIUM":"64","Gd":"64","64":"64","GD":"64", 
-             "TERBIUM":"65","Tb":"65","65":"65","TB":"65",
-             "DYSPROSIUM":"66","Dy":"66","66":"66","DY":"66", 
-             "HOLMIUM":"67","Ho":"67","67":"67","HO":"67", 
-             "ERBIUM":"68","Er":"68","68":"68","ER":"68", 
-             "THULIUM":"69","TM":"69","69":"69","TM":"69", 
-             "YTTERBIUM":"70","Yb":"70","70":"70","YB":"70", 
-             "LUTETIUM":"71","Lu":"71","71":"71","LU":"71",
-             "HAFNIUM":"72","Hf":"72","72":"72","HF":"72",
-             "TANTALUM":"73","Ta":"73","73":"73","TA":"73",
-             "TUNGSTEN":"74","W":"74","74":"74",
-             "RHENIUM":"75","Re":"75","75":"75","RE":"75",
-             "OSMIUM":"76","Os":"76","76":"76","OS":"76",
-             "IRIDIUM":"77","Ir":"77","77":"77","IR":"77",
-             "PLATINUM":"78","Pt":"78","78":"78","PT":"78",
-             "GOLD":"79","Au":"79","79":"79","AU":"79",
-             "MERCURY":"80","Hg":"80","80":"80","HG":"80",
-             "THALLIUM":"81","Tl":"81","81":"81","TL":"81",
-             "LEAD":"82","Pb":"82","82":"82","PB":"82",
-             "BISMUTH":"83","Bi":"83","83":"83","BI":"83",
-             "POLONIUM":"84","Po":"84","84":"84","PO":"84",
-             "ASTATINE":"85","At":"85","85":"85","AT":"85",
-             "RADON":"86","Rn":"86","86":"86","RN":"86"}
-
-        FullName=["HYDROGEN", "HELIUM", "LITHIUM", "BERYLLIUM", "BORON", "CARBON", "NITROGEN", "OXYGEN", "FLUORINE", "NEON", 
-              "SODIUM", "MAGNESIUM", "ALUMINUM", "SILICON", "PHOSPHORUS", "SULFUR", "CHLORINE", "ARGON", "POTASSIUM", "CALCIUM", 
-              "SCANDIUM", "TITANIUM", "VANADIUM", "CHROMIUM", "MANGANESE", "IRON", "COBALT", "NICKEL", "COPPER", "ZINC", 
-              "GALLIUM", "GERMANIUM", "ARSENIC", "SELENIUM", "BROMINE", "KRYPTON", "RUBIDIUM", "STRONTIUM", "YTTRIUM", "ZIRCONIUM", 
-              "NIOBIUM", "MOLYBDENUM", "TECHNETIUM", "RUTHENIUM", "RHODIUM", "PALLADIUM", "SILVER", "CADMIUM", "INDIUM", "TIN", 
-              "ANTIMONY", "TELLURIUM", "IODINE", "XENON", "CESIUM", "BARIUM", "LANTHANUM", "CERIUM", "PRASEODYMIUM", "NEODYMIUM", 
-              "PROMETHIUM", "SAMARIUM", "EUROPIUM", "GADOLINIUM", "TERBIUM", "DYSPROSIUM", "HOLMIUM", "ERBIUM", "THULIUM", "YTTERBIUM", 
-              "LUTETIUM", "HAFNIUM", "TANTALUM", "TUNGSTEN", "RHENIUM", "OSMIUM", "IRIDIUM", "PLATINUM", "GOLD", "MERCURY", 
-              "THALLIUM", "LEAD", "BISMUTH", "POLONIUM", "ASTATINE", "RADON"]
-
-        Symbol=[ "H","He","Li","Be","B","C","N","O","F","Ne",
-                "Na","Mg","Al","Si","P","S","Cl","Ar","K","Ca",
-                "Sc","Ti","V","Cr","Mn","Fe","Co","Ni","Cu","Zn",
-                "Ga","Ge","As","Se","Br","Kr","Rb","Sr","Y","Zr",
-                "Nb","Mo","Tc","Ru","Rh","Pd","Ag","Cd","In","Sn",
-                "Sb","Te","I","Xe","Cs","Ba","La","Ce","Pr","Nd",
-                "Pm","Sm","Eu","Gd","Tb","Dy","Ho","Er","TM","Yb",
-                "Lu","Hf","Ta","W","Re","Os","Ir","Pt","Au","Hg",
-                "Tl","Pb","Bi","Po","At","Rn"]
-
-        Mass=[1.008,4.003,6.941,9.012,10.811,12.011,14.007,15.999,18.998,20.180,
-              22.990,24.305,26.982,28.086,30.974,32.065,35.453,39.948,39.098,40.078,
-              44.956,47.867,50.942,51.996,54.938,55.845,58.933,58.693,63.546,65.390,
-              69.723,72.640,74.922,78.960,79.904,83.800,85.468,87.620,88.906,91.224,
-              92.906,95.940,98.000,101.070,102.906,106.420,107.868,112.411,114.818,118.710,
-              121.760,127.600,126.905,131.293,132.906,137.327,138.906,140.116,140.908,144.240,
-              145.000,150.360,151.964,157.250,158.925,162.500,164.930,167.259,168.934,173.040,
-              174.967,178.490,180.948,183.840,186.207,190.230,192.217,195.078,196.967,200.590,
-              204.383,207.200,208.980,209.000,210.000,222.000]
-
-        # Van der Waals Radius, missing data replaced by 2.00
-        Radii=[1.20,1.40,1.82,1.53,1.92,1.70,1.55,1.52,1.47,1.54,
-               2.27,1.73,1.84,2.10,1.80,1.80,1.75,1.88,2.75,2.31,
-               2.11,2.00,2.00,2.00,2.00,2.00,2.00,1.63,1.40,1.39,
-               1.87,2.11,1.85,1.90,1.85,2.02,3.03,2.49,2.00,2.00,
-               2.00,2.00,2.00,2.00,2.00,1.63,1.72,1.58,1.93,2.17,
-               2.00,2.06,1.98,2.16,3.43,2.68,2.00,2.00,2.00,2.00,
-               2.00,2.00,2.00,2.00,2.00,2.00,2.00,2.00,2.00,2.00,
-               2.00,2.00,2.00,2.00,2.00,2.00,2.00,1.75,1.66,1.55,
-               1.96,2.02,2.07,1.97,2.02,2.20]
-
-        self.__name = int(Periodic_Table[name])
-        self.__FullName = FullName[self.__name-1]
-        self.__Symbol = Symbol[self.__name-1]
-        self.__Mass = Mass[self.__name-1]
-        self.__Radii = Radii[self.__name-1]
-
-    def getFullName(self):
-        return self.__FullName
-    def getSymbol(self):
-        return self.__Symbol
-    def getUpperSymbol(self):
-        return self.__Symbol.upper()
-    def getMass(self):
-        return self.__Mass
-    def getNuc(self):
-        return self.__name
-    def getNelectron(self):
-        return self.__name
-    def getRadii(self):
-        return self.__Radii
+from periodic_table import AtomicNumber,AtomMass,AtomSymbol
 
 def ReadMolden(input):
     ## This function read Molcas .freq.molden file and return all data as a dict
@@ -195,10 +39,8 @@ def ReadMolden(input):
                 coord=[i.split() for i in file[n:n+natom]]
                 coord=np.array(coord)
                 atoms,xyz=coord[:,0],coord[:,1:].astype(float)
-                amass=[Element(atm).getMass() for atm in atoms]
-                amass=np.array(amass)
-                achrg=[Element(atm).getNuc() for atm in atoms]
-                achrg=np.array(achrg)
+                amass=AtomMass(atoms)
+                achrg=AtomicNumber(atoms)
             if """ vibration""" in line:
                 vib=[i.split() for i in file[n:n+natom]]
                 vib=np.array(vib).astype(float)
@@ -294,17 +136,12 @@ def ReadG16(input):
             vect_list=fchk[n+1:n+1+vect_line]
 
     atoms=G16format(atom_list,[-1])
-    atoms=np.array([Element(str(int(i))).getSymbol() for i in atoms])
+    atoms=AtomSymbol(atoms.astype(int))
     xyz=G16format(cart_list,[natom,3])
     modes=G16format(vect_list,[nmode,natom,3])
 
-    amass=[Element(i).getMass() for i in atoms]
-    amass=np.array(amass)
-    amass=amass.reshape(natom,1)
-
-    achrg=[Element(i).getNuc()  for i in atoms]
-    achrg=np.array(achrg)
-    achrg=achrg.reshape(natom,1)
+    amass=AtomMass(atoms).reshape(natom,1)
+    achrg=AtomicNumber(atoms).reshape(natom,1)
 
     modes=np.array([i/la.norm(i*amass**0.5) for i in modes]) # convert to unnormalized unmass-weighted
 
@@ -384,13 +221,8 @@ def ReadOrca(input):
     modes=modes[realfreq]
 
     rmass=np.array([0 for i in range(nmode)]).reshape([-1,1])
-    amass=[Element(atm).getMass() for atm in atoms]
-    amass=np.array(amass)
-    amass=amass.reshape(natom,1)
-
-    achrg=[Element(atm).getNuc() for atm in atoms]
-    achrg=np.array(achrg)
-    achrg=achrg.reshape(natom,1)
+    amass=AtomMass(atoms).reshape(natom,1)
+    achrg=AtomicNumber(atoms).reshape(natom,1)
 
     modes=np.array([i/la.norm(i*amass**0.5) for i in modes]) # convert to unnormalized unmass-weighted
 
@@ -470,13 +302,8 @@ def ReadBagel(input):
     modes=modes[realfreq]
 
     rmass=np.array([0 for i in range(nmode)]).reshape([-1,1])
-    amass=[Element(atm).getMass() for atm in atoms]
-    amass=np.array(amass)
-    amass=amass.reshape(natom,1)
-
-    achrg=[Element(atm).getNuc() for atm in atoms]
-    achrg=np.array(achrg)
-    achrg=achrg.reshape(natom,1)
+    amass=AtomMass(atoms).reshape(natom,1)
+    achrg=AtomicNumber(atoms).reshape(natom,1)
 
     modes=np.array([i/amass**0.5 for i in modes]) # convert to unnormalized unmass-weighted
 
@@ -548,21 +375,66 @@ def LoadXYZ(input):
 
     return ensemble
 
-def Gaussian():
-    ## This function generates standard normal distribution variates from a random number in uniform distribution
-    ## This function is used for Boltzmann sampling
-    ## This function returns a coefficient to update structure or velocity
+## source files parsed by each reader, the input name is filled in for %s
+SourceFile={
+'molden' : ['%s.freq.molden'],
+'bagel'  : ['%s.freq.bagel'],
+'g16'    : ['%s.freq.fchk','%s.freq.g16'],
+'orca'   : ['%s.freq.orca'],
+'newtonx': ['%s.init.newtonx'],
+'xyz'    : ['%s.init.xyz'],
+}
+
+def FileHash(file):
+    ## This function return the sha1 hash of a file, read in blocks of 1 MB
+
+    sha=hashlib.sha1()
+    with open(file,'rb') as raw:
+        for block in iter(lambda: raw.read(1048576),b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+def ReadCache(input,format,reader):
+    ## This function calls reader to parse the source files and saves the parsed data in a binary sidecar file
+    ## The sidecar file is reused if the size and mtime of the source files are unchanged
+    ## Otherwise the source files are hashed, the sidecar file is still reused if the hashes are unchanged
+    ## This function returns the same data as reader
+
+    source=[x % (input) for x in SourceFile[format]]
+    cache='%s.%s.sample.pkl' % (input,format)
+    stat=[[os.stat(x).st_size,os.stat(x).st_mtime_ns] for x in source]
+
+    saved=None
+    if os.path.exists(cache):
+        try:
+            with open(cache,'rb') as infile:
+                saved=pickle.load(infile)
+        except Exception:
+            saved=None
+
+    if saved != None and saved['stat'] == stat:
+        return saved['data']
+
+    hash=[FileHash(x) for x in source]
+    if saved != None and saved['hash'] == hash:
+        data=saved['data']
+    else:
+        data=reader(input)
+
+    try:
+        with open(cache,'wb') as outfile:
+            pickle.dump({'stat':stat,'hash':hash,'data':data},outfile,protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        print('Cannot write parsed data to %s' % (cache))
 
-    u1 = random.uniform(0, 1)
-    u2 = random.uniform(0, 1)
-    z = np.sqrt(-2*np.log(u1))*np.sin(2*np.pi*u2) # Box-Muller transformation
-    return float(z)
+    return data
 
-def Boltzmann(sample):
+def Boltzmann(sample,nesmb,rng):
     ## This function is based on Molcas dynamixtool.py
-    ## This function does Boltzmann sampling for structure and velocity
-    ## This function calls Gaussian to find update coefficient
-    ## This function returns initial condition as [[atom x y z v(x) v(y) v(z)],...]
+    ## This function does Boltzmann sampling for structure and velocity of nesmb samples at once
+    ## This function draws the standard normal update coefficients of all modes and samples from rng
+    ## This function returns coordinates in Angstrom and velocities in Bohr/au in shape of (nesmb,natom,3)
 
     temp=sample['temp']
     nfreq=sample['nfreq']
@@ -624,23 +496,19 @@ def Boltzmann(sample):
     ## v = sqrt(kb*T/m) = sqrt(T/(Eh/kb)/sqrt(m/me))*sqrt(Eh/me) = sqrt(T/(Eh/kb)/sqrt(m/me))*vau
     ## v = sqrt(T/(Eh/kb)/sqrt(m/me)) in [Bohr/au]
 
-    amass=np.array([np.ones(3)*i for i in amass]) # expand atoic mass over x y z coordinates
+    amass=amass.reshape((natom,1))*np.ones(3)         # expand atoic mass over x y z coordinates
 
-    sigma_Q=np.sqrt(temp*k_to_au)/np.sqrt(freqs*mu_to_hartree) #standard deviation of mass-weighted position
-    sigma_P=np.sqrt(temp*k_to_au)                              #standard deviation of mass-weighted velocity
-    Q_P=np.array([[Gaussian(),Gaussian()] for i in freqs])     #generates update coordinates and momenta pairs Q and P
+    sigma_Q=np.sqrt(temp*k_to_au)/np.sqrt(freqs.reshape(-1)*mu_to_hartree) #standard deviation of mass-weighted position
+    sigma_P=np.sqrt(temp*k_to_au)                                          #standard deviation of mass-weighted velocity
+    Q_P=rng.standard_normal((2,nesmb,nfreq))          # generates update coordinates and momenta pairs Q and P of all samples
 
-    Q=Q_P[:,0].reshape(nfreq,1)                       # first column is Q
-    Q*=sigma_Q                                        # project standard normal distribution back to position space
-    Qvib=np.array([np.ones((natom,3))*i for i in Q])  # generate identity array to expand Q
-    Qvib=np.sum(vib*Qvib,axis=0)                      # sum mass-weighted position over all modes
+    Q=Q_P[0]*sigma_Q                                  # project standard normal distribution back to position space
+    Qvib=np.einsum('sf,fax->sax',Q,vib)               # sum mass-weighted position over all modes
     Qvib/=np.sqrt(amass*ma_to_amu)                    # un-weight position in Bohr
     newc=(xyz+Qvib)*bohr_to_angstrom                  # cartesian coordinates in Angstrom
 
-    P=Q_P[:,1].reshape(nfreq,1)                       # second column is P
-    P*=sigma_P                                        # convert velocity from m/s to Bohr/au
-    Pvib=np.array([np.ones((natom,3))*i for i in P])  # generate identity array to expand P
-    Pvib=np.sum(vib*Pvib,axis=0)                      # sum mass-weighted velocity over all modes
+    P=Q_P[1]*sigma_P                                  # convert velocity from m/s to Bohr/au
+    Pvib=np.einsum('sf,fax->sax',P,vib)               # sum mass-weighted velocity over all modes
     velo=Pvib/np.sqrt(amass*ma_to_amu)                # un-weight velocity in Bohr/au
                                                       # use velo=1 in &DYNAMIX to read un-weighted velocity
     #These lines are for test
@@ -652,72 +520,79 @@ def Boltzmann(sample):
 
     #velo*=np.sqrt(amass*ma_to_amu)                     # only use for velo=2 in &DYNAMIX convert velocity[Bohr/au] to mass-weighted [Bohr*amu^0.5/au] for Molcas
 
-    inicond=np.concatenate((newc,velo),axis=1)
-    inicond=np.concatenate((atoms.reshape((-1,1)),inicond),axis=1)
-    inicond=np.concatenate((inicond,amass),axis=1)
-    inicond=np.concatenate((inicond,achrg),axis=1)
-    return inicond
+    return newc,velo
 
 def Laguerre(n,x):
     ## This function calculates laguerre polynomial
     ## L = n!/[(n-m)! * (m!)**2] = n*(n-1)*...*(n-m+1)/(m!)**2 = n/1**2 * (n-1)/2**2 *...*(n-m+1)/m**2, 0<=m<=n
-
-    L=1 # L=1 when m=0   
-    for m in range(1,n+1):
-        r=1
-        for mm in range(1,m+1):
-            r*=float(n-mm+1)/mm**2
-        L+=(-1)**m * r * x**m
+    ## The polynomial is evaluated by the recurrence (k+1)*L(k+1) = (2k+1-x)*L(k) - k*L(k-1), L(0) = 1, L(1) = 1-x
+    ## n and x can be arrays in the same shape, each x is evaluated with its own n
+
+    n=np.asarray(n).astype(int)
+    x=np.asarray(x).astype(float)
+    L0=np.ones(x.shape)
+    L1=1-x
+    L=np.where(n == 0,L0,L1)
+    for k in range(1,int(np.amax(n,initial=0))):
+        L0,L1=L1,((2*k+1-x)*L1-k*L0)/(k+1)
+        L=np.where(n == k+1,L1,L)
 
     return L
 
 
-def Wignerfunc(mu,temp):
+def Wignerfunc(mu,temp,nesmb,rng):
     ## This function generates random position Q and momenta P to find uptdate coifficents
+    ## This function draws the vibrational levels, Q, P, and the acceptance tests of all modes and samples at once
+    ## Only the rejected pairs are drawn again until all pairs are accepted
     ## This function calls Laguerre to calculate the polynomial
-    ## This function returns accepted Q and P
+    ## This function returns accepted Q and P in shape of (nesmb,nfreq)
 
-    #print('\nFreq: %s\n' % mu)
+    mu=np.asarray(mu).astype(float).reshape(-1)
+    nfreq=len(mu)
     max_pop=0.9999
     ex=mu/(0.69503*temp) #vibrational temperature: ex=h*c*mu/(kb*T), 0.69503 convert cm-1 to K
-    pop= 0
+
+    ## accumulate the population of levels until every mode reaches max_pop
+    ## the population of a mode stops growing once it reaches max_pop, thus the extra levels are never picked
+    pop=np.zeros(nfreq)
     lvl_pop=[]
-    n = -1
+    n=-1
     while True:
         n+=1
-        pop+=np.exp(-1*ex*n)*(1-np.exp(-1*ex))   
+        pop=np.where(pop >= max_pop,pop,pop+np.exp(-1*ex*n)*(1-np.exp(-1*ex)))
         lvl_pop.append(pop)
         # Here is how I obtained this equation:
         # calculate partion function, fP=np.exp(ex*-0.5) /( 1 - np.exp(ex*-1) )
         # calculate population, pop=np.exp(-1*ex*(n+0.5))/fP
-        #print('wignerfunction:%d %f %f %f %f'%(n,ex,np.exp(-1*ex*n)*(1-np.exp(-1*ex)),pop,max_pop))
-        if pop >= max_pop:
+        if np.all(pop >= max_pop):
             break
-    while True:
-        random_state=random.uniform(0,pop) # random generate a state
-        n=-1
-        for i in lvl_pop:                  # but population is not uniformly distributed over states
-            n+=1
-            if random_state <= i:          # find the lowest state that has more population than the random state
-                break
-        Q=random.uniform(0,1)*10.0-5.0
-        P=random.uniform(0,1)*10.0-5.0
-        rho2=2*(Q**2+P**2)
+    lvl_pop=np.array(lvl_pop)
+
+    Q=np.zeros([nesmb,nfreq])
+    P=np.zeros([nesmb,nfreq])
+    todo=np.ones([nesmb,nfreq],dtype=bool)
+    while np.any(todo):
+        smp,mode=np.nonzero(todo)
+        ntry=len(mode)
+        random_state=rng.uniform(0,1,ntry)*pop[mode]                 # random generate a state
+        n=np.sum(lvl_pop[:,mode] < random_state,axis=0)              # find the lowest state that has more population than the random state
+        q=rng.uniform(0,1,ntry)*10.0-5.0
+        p=rng.uniform(0,1,ntry)*10.0-5.0
+        rho2=2*(q**2+p**2)
         W=(-1)**n * Laguerre(n,rho2) * np.exp(-0.5*rho2)
-        R=random.uniform(0,1)
-        #print('N: %d Q: %f P: %f W: %f R: %f' % (N,Q,P,W,R))
-        if W > R and W < 1:
-            #print('N: %d Q: %f P: %f Rho^2: %f W: %f R: %f' % (N,Q,P,rho2/2,W,R))
+        R=rng.uniform(0,1,ntry)
+        accept=(W > R) & (W < 1)
+        Q[smp[accept],mode[accept]]=q[accept]
+        P[smp[accept],mode[accept]]=p[accept]
+        todo[smp[accept],mode[accept]]=False
 
-            break
-    
-    return float(Q),float(P)
+    return Q,P
 
-def Wigner(sample):
+def Wigner(sample,nesmb,rng):
     ## This function is based on SHARC wigner.py
-    ## This function does Wigner sampling for structure and velocity
+    ## This function does Wigner sampling for structure and velocity of nesmb samples at once
     ## This function calls Wiguerfunc to find update coefficient
-    ## This function returns initial condition as [[atom x y z v(x) v(y) v(z)],...]
+    ## This function returns coordinates in Angstrom and velocities in Bohr/au in shape of (nesmb,natom,3)
 
     temp=sample['temp']
     nfreq=sample['nfreq']
@@ -776,19 +651,15 @@ def Wigner(sample):
     ## v*n = P*sqrt*(mu*(h*c/Eh))/sqrt(ma/(Na*me*1000))*vib*sqrt(m) = P*sqrt(mu*(h*c/Eh))*sqrt(Na*me*1000)*vib
     ## v*n = P*sqrt(mu*mu_to_hartree)*sqrt(1/ma_to_amu)*vib
 
-    Q_P=np.array([Wignerfunc(i,temp) for i in freqs]) # generates update coordinates and momenta pairs Q and P
-
-    Q=Q_P[:,0].reshape(nfreq,1)                       # first column is Q
+    Q,P=Wignerfunc(freqs,temp,nesmb,rng)             # generates update coordinates and momenta pairs Q and P of all samples
+    freqs=freqs.reshape(-1)
 
     Q*=1/np.sqrt(freqs*mu_to_hartree*ma_to_amu)       # convert coordinates from m to Bohr
-    Qvib=np.array([np.ones((natom,3))*i for i in Q])  # generate identity array to expand Q
-    Qvib=np.sum(vib*Qvib,axis=0)                      # sum sampled structure over all modes
+    Qvib=np.einsum('sf,fax->sax',Q,vib)               # sum sampled structure over all modes
     newc=(xyz+Qvib)*bohr_to_angstrom                  # cartesian coordinates in Angstrom
 
-    P=Q_P[:,1].reshape(nfreq,1)                       # second column is P
     P*=  np.sqrt(freqs*mu_to_hartree/ma_to_amu)       # convert velocity from m/s to Bohr/au
-    Pvib=np.array([np.ones((natom,3))*i for i in P])  # generate identity array to expand P
-    velo=np.sum(vib*Pvib,axis=0)                      # sum sampled velocity over all modes in Bohr/au
+    velo=np.einsum('sf,fax->sax',P,vib)               # sum sampled velocity over all modes in Bohr/au
                                                       # use velo=1 in &DYNAMIX to read un-weighted velocity
     #These lines are for test
     #amass=np.array([np.ones(3)*i for i in amass])         # expand atoic mass over x y z coordinates
@@ -799,22 +670,32 @@ def Wigner(sample):
 
     #velo*=np.sqrt(amass*ma_to_amu)                    # only use for velo=2 in &DYNAMIX convert velocity[Bohr/au] to mass-weighted [Bohr*amu^0.5/au] for Molcas
 
-    inicond=np.concatenate((newc,velo),axis=1)
-    inicond=np.concatenate((atoms.reshape((-1,1)),inicond),axis=1)
-    inicond=np.concatenate((inicond,amass),axis=1)
-    inicond=np.concatenate((inicond,achrg),axis=1)
+    return newc,velo
 
-    return inicond
+def Initcond(init):
+    ## This function convert the sampled arrays to a list of initial condition as [[atom x y z v(x) v(y) v(z) m chrg],...]
 
-def Sampling(input,nesmb,iseed,temp,dist,format):
+    ensemble=[]
+    for coord,velo in zip(init['coord'],init['velo']):
+        inicond=np.concatenate((coord,velo),axis=1)
+        inicond=np.concatenate((init['atoms'].reshape((-1,1)),inicond),axis=1)
+        inicond=np.concatenate((inicond,init['amass'].reshape((-1,1))),axis=1)
+        inicond=np.concatenate((inicond,init['achrg'].reshape((-1,1))),axis=1)
+        ensemble.append(inicond)
+
+    return ensemble
+
+def SamplingArray(input,nesmb,iseed,temp,dist,format):
     ## This function recieves input information and does sampling
     ## This function use Readdata to call different functions toextract vibrational frequency and mode
     ## This function calls Boltzmann or Wigner to do sampling
-    ## This function returns a list of initial condition 
-    ## Import this function for external usage
+    ## This function returns a dict of atoms, coordinates in Angstrom and velocities in Bohr/au in shape of (nesmb,natom,3)
+    ## Import this function to pass the initial conditions in memory
 
     if iseed != -1:
-        random.seed(iseed)
+        rng=np.random.default_rng(iseed)
+    else:
+        rng=np.random.default_rng()
 
     callsample=['molden','bagel','g16','orca']  ## these format need to run sampling
     skipsample=['newtonx','xyz']                ## these format read sampled initial conditions
@@ -829,36 +710,45 @@ def Sampling(input,nesmb,iseed,temp,dist,format):
     'xyz'    : LoadXYZ,
     }
 
+    Sampler={
+    'boltzmann' : Boltzmann,
+    'wigner'    : Wigner,
+    }
+
     if format in callsample:
-        sample=Readdata[format](input)
+        sample=ReadCache(input,format,Readdata[format])
         sample['temp']=temp
-        ensemble=[] # a list of sampled  molecules, ready to transfer to external module or print out
-
-        for s in range(nesmb):
-            if   dist == 'boltzmann':
-                intcon=Boltzmann(sample)
-                ensemble.append(intcon)    
-            elif dist == 'wigner':
-                intcon=Wigner(sample)
-                ensemble.append(intcon)
-            sys.stdout.write('Progress: %.2f%%\r' % ((s+1)*100/nesmb))
+        coord,velo=Sampler[dist](sample,nesmb,rng)
+        init={
+        'atoms' : np.array(sample['atoms']),
+        'coord' : coord,
+        'velo'  : velo,
+        'amass' : sample['amass'],
+        'achrg' : sample['achrg'],
+        }
 
     elif format in skipsample:
-        ensemble=Readdata[format](input)
+        ensemble=ReadCache(input,format,Readdata[format])
 
         if   len(ensemble) < nesmb:
             print('Not enough initial conditions!!! %s provided < %s requested.' % (len(ensemble),nesmb))
             exit()
         elif len(ensemble) > nesmb:
             print('More initial conditions received. Skip %s - %s. ' % (nesmb+1,len(ensemble)))
-        ensemble=ensemble[0:nesmb]
-
+        ensemble=np.array(ensemble[0:nesmb])
+        init={
+        'atoms' : ensemble[0,:,0],
+        'coord' : ensemble[:,:,1:4].astype(float),
+        'velo'  : ensemble[:,:,4:7].astype(float),
+        'amass' : ensemble[0,:,7],
+        'achrg' : ensemble[0,:,8],
+        }
 
     q=open('%s-%s-%s.xyz' % (dist,input,temp),'wb')
     p=open('%s-%s-%s.velocity' % (dist,input,temp),'wb')
     pq=open('%s.init' % (input),'wb')
     m=0
-    for mol in ensemble:
+    for mol in Initcond(init):
         m+=1
         geom=mol[:,0:4]   
         velo=mol[:,4:7]
@@ -870,6 +760,14 @@ def Sampling(input,nesmb,iseed,temp,dist,format):
     p.close()
     pq.close()
 
+    return init
+
+def Sampling(input,nesmb,iseed,temp,dist,format):
+    ## This function calls SamplingArray to do sampling
+    ## This function returns a list of initial condition 
+    ## Import this function for external usage
+
+    ensemble=Initcond(SamplingArray(input,nesmb,iseed,temp,dist,format))
 
     return ensemble
 
@@ -892,7 +790,7 @@ def Equilibrium(input,nesmb,iseed,temp,dist,format):
     }
 
     if format in callsample:
-        sample=Readdata[format](input)
+        sample=ReadCache(input,format,Readdata[format])
         atoms=sample['atoms']
         xyz=sample['xyz']*0.529177249
         amass=sample['amass']
@@ -0,0 +1,131 @@
+## Ensemble molecular dynamics for PyRAIMD
+## Run all sampled initial conditions of a md job in a process pool
+
+import time,datetime,os
+import multiprocessing
+import numpy as np
+from aimd import AIMD
+from methods import QM
+from tools import Readcoord
+from dynamixsampling import SamplingArray
+from analysis import Analyze
+
+class Ensemble:
+    ## This class run an ensemble of trajectories from the sampled initial conditions
+    ## This class call AIMD for each trajectory in a separated directory
+    ## This class summarize the populations and hopping statistics when all trajectories are finished
+
+    def __init__(self,variables_all):
+        control           = variables_all['control']
+        md                = variables_all['md']
+        self.variables    = variables_all
+        self.title        = control['title']
+        self.qm           = control['qm']
+        initcond          = md['initcond']
+        nesmb             = md['nesmb']
+        method            = md['method']
+        format            = md['format']
+        gl_seed           = md['gl_seed']
+        temp              = md['temp']
+
+        ## QC methods need a separated calculation folder for each trajectory, ML methods share the same model
+        if self.qm in ['molcas','bagel']:
+            self.ncpu     = control['qc_ncpu']
+            self.qm_id    = True
+        else:
+            self.ncpu     = control['ml_ncpu']
+            self.qm_id    = None
+
+        if initcond == 0:
+            ## load the only initial condition from .xyz and .velo
+            xyz,M=Readcoord(self.title)
+            velo=np.loadtxt('%s.velo' % (self.title))
+            self.initcond=[[xyz,velo]]
+        else:
+            ## sampled coordinates and velocities are passed in memory as (nesmb,natom,3) arrays
+            init=SamplingArray(self.title,nesmb,gl_seed,temp,method,format)
+            atoms=init['atoms'].tolist()
+            self.initcond=[[[[a]+c for a,c in zip(atoms,coord.tolist())],velo] for coord,velo in zip(init['coord'],init['velo'])]
+
+        self.ntraj=len(self.initcond)
+
+    def _run_aimd(self):
+        ## wrap variables for multiprocessing
+        variables_wrapper=[[n,x[0],x[1]] for n,x in enumerate(self.initcond)]
+
+        ## adjust multiprocessing if necessary
+        ncpu = np.amin([self.ntraj,self.ncpu])
+
+        ## start multiprocessing
+        ## the trajectories are sent one by one, thus a free worker picks up the next trajectory
+        finished=0
+        pool=multiprocessing.Pool(processes=ncpu)
+        for val in pool.imap_unordered(self._aimd_wrapper,variables_wrapper,chunksize=1):
+            traj_id,walltime=val
+            finished+=1
+            print('  Traj %6s finished in %20s   %6s of %6s completed' % (traj_id+1,walltime,finished,self.ntraj))
+        pool.close()
+        pool.join()
+
+    def _aimd_wrapper(self,initial_condition):
+        ## run AIMD in its own directory
+        ## multiprocessing doesn't support shared-memory
+        ## load method in each worker process here
+        traj_id,xyz,velo=initial_condition
+        start=time.time()
+        qm_id=traj_id+1 if self.qm_id != None else None
+        qm=QM(self.qm,self.variables,id=qm_id)
+        qm.load()
+        traj=AIMD(self.variables,QM=qm,id=traj_id+1,dir=True)
+        traj.run(xyz,velo)
+        end=time.time()
+        return traj_id,self._howlong(start,end)
+
+    def _summary(self):
+        ## This function call Analyze to average the populations and collect the hopping statistics of all trajectories
+        ## The trajectories stopped early only contribute to the steps they have reached
+        paths=['%s/%s-%s' % (os.getcwd(),self.title,n+1) for n in range(self.ntraj)]
+
+        return Analyze(self.title,paths,self.ncpu)
+
+    def _heading(self):
+
+        headline="""
+%s
+ *---------------------------------------------------*
+ |                                                   |
+ |          Ensemble Nonadiabatic Dynamics           |
+ |                                                   |
+ *---------------------------------------------------*
+
+""" % (self.variables['version'])
+
+        return headline
+
+    def _whatistime(self):
+        return datetime.datetime.strftime(datetime.datetime.now(), '%Y-%m-%d %H:%M:%S')
+
+    def _howlong(self,start,end):
+        walltime=end-start
+        walltime='%5d days %5d hours %5d minutes %5d seconds' % (int(walltime/86400),int((walltime%86400)/3600),int(((walltime%86400)%3600)/60),int(((walltime%86400)%3600)%60))
+        return walltime
+
+    def run(self):
+        logpath=os.getcwd()
+        start=time.time()
+        heading='Ensemble Dynamics Start: %20s\n%s' % (self._whatistime(),self._heading())
+        print(heading)
+        mdlog=open('%s/%s.log' % (logpath,self.title),'w')
+        mdlog.write(heading)
+        mdlog.close()
+
+        self._run_aimd()
+        summary=self._summary()
+
+        end=time.time()
+        walltime=self._howlong(start,end)
+        tailing='%s\nEnsemble Dynamics End: %20s Total: %20s\n' % (summary,self._whatistime(),walltime)
+        print(tailing)
+        mdlog=open('%s/%s.log' % (logpath,self.title),'a')
+        mdlog.write(tailing)
+        mdlog.close()
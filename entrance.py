@@ -49,12 +49,20 @@ def read_control(keywords,values):
             keywords[key] = float(val[0])
         elif key == 'neighbor':
             keywords[key] = int(val[0])
+        elif key == 'selection':
+            keywords[key] = val[0].lower()
+        elif key == 'maxbatch':
+            keywords[key] = int(val[0])
         elif key == 'load':
             keywords[key] = int(val[0])
         elif key == 'transfer':
             keywords[key] = int(val[0])
         elif key == 'pop_step':
             keywords[key] = int(val[0])
+        elif key == 'restart':
+            keywords[key] = int(val[0])
+        elif key == 'overlap':
+            keywords[key] = int(val[0])
 
 
     return keywords
@@ -152,6 +160,8 @@ def read_md(keywords,values):
             keywords[key] = int(val[0])
         elif key == 'nesmb':
             keywords[key] = int(val[0])
+        elif key == 'ensemble':
+            keywords[key] = int(val[0])
        	elif key == 'method':
             keywords[key] = val[0]
        	elif key == 'format':
@@ -172,6 +182,18 @@ def read_md(keywords,values):
             keywords[key] = float(val[0])
         elif key == 'substep':
             keywords[key] = int(val[0])
+        elif key == 'adapt':
+            keywords[key] = int(val[0])
+        elif key == 'minsize':
+            keywords[key] = float(val[0])
+        elif key == 'maxsize':
+            keywords[key] = float(val[0])
+        elif key == 'maxdrift':
+            keywords[key] = float(val[0])
+        elif key == 'maxdgrad':
+            keywords[key] = float(val[0])
+        elif key == 'mingap':
+            keywords[key] = float(val[0])
         elif key == 'deco':
             keywords[key] = val[0]        # Caution! deco must be a string for surfacehopping.py! 
         elif key == 'integrate':
@@ -226,6 +248,14 @@ def read_gp(keywords,values):
             keywords[key] = int(val[0])
         elif key == 'modelfile':
             keywords[key] = val[0]
+        elif key == 'sparse':
+            keywords[key] = int(val[0])
+        elif key == 'refit':
+            keywords[key] = int(val[0])
+        elif key == 'analytic_grad':
+            keywords[key] = int(val[0])
+        elif key == 'refit_error':
+            keywords[key] = float(val[0])
         elif key == 'target' :
             keywords[key] = val[0]
         elif key == 'ratio':
@@ -278,6 +308,14 @@ def read_nn(keywords,values):
             keywords[key] = str(val[0])
         elif key == 'gpu':
             keywords[key] = int(val[0])
+        elif key == 'fused':
+            keywords[key] = int(val[0])
+        elif key == 'precision':
+            keywords[key] = str(val[0]).lower()
+        elif key == 'stream':
+            keywords[key] = int(val[0])
+        elif key == 'shuffle_buffer':
+            keywords[key] = int(val[0])
 
     keywords['data'],keywords['postdata'],keywords['data_info']=TrainDataInfo(keywords)
 
@@ -364,9 +402,13 @@ def ReadInput(input):
     'maxnac'      : 0.05,
     'minnac'      : 0.02,
     'neighbor'    : 1,
+    'selection'   :'all',
+    'maxbatch'    : 0,
     'load'        : 1,
     'transfer'    : 0,
     'pop_step'    : 200,
+    'restart'     : 0,
+    'overlap'     : 0,
     }
 
     variables_molcas={
@@ -422,6 +464,7 @@ def ReadInput(input):
     'reset'       : 1,
     'resetstep'   : 0,
     'nesmb'       : 20,
+    'ensemble'    : 0,
     'method'      :'wigner',
     'format'      :'molden',
     'temp'        : 300,
@@ -432,6 +475,12 @@ def ReadInput(input):
     'sfhp'        :'nosh',
     'gap'         : 0.5,
     'substep'     : 0,
+    'adapt'       : 0,
+    'minsize'     : 0,
+    'maxsize'     : 0,
+    'maxdrift'    : 5e-5,
+    'maxdgrad'    : 0.01,
+    'mingap'      : 0.3,
     'integrate'   : 0,
     'deco'        : '0.1',
     'adjust'      : 1,
@@ -461,6 +510,10 @@ def ReadInput(input):
     'ratio'      :[0.9, 0.1],
     'increment'  : 0,
     'model'      : None,
+    'sparse'     : 0,     # number of inducing points, 0 uses the exact GP
+    'analytic_grad': 0,   # compute the gradient from the energy model instead of training a gradient model
+    'refit'      : 1,     # fit hyperparameters every refit trainings, the other trainings extend the previous model
+    'refit_error': 0,     # fit hyperparameters if the energy validation error exceeds refit_error times of the last fit, 0 to disable
     'modelfile'  : None,  # Caution! This value will be updated by read_gp. Not allow user to set.
     'ml_seed'    : 1,     # Caution! This value will be updated by variables_control['gl_seed']. Not allow user to set.
     'data'	 : None,  # Caution! This value will be updated by TrainDataInfo. Not allow user to set.
@@ -492,6 +545,10 @@ def ReadInput(input):
     'nac2'       : None,  # Caution! This value will be updated later. Not allow user to set.
     'permute_map':'No',
     'gpu'        : 0,
+    'fused'      : 0,
+    'precision'  :'float64',
+    'stream'     : 0,
+    'shuffle_buffer': 10000,
     }
 
     variables_eg={
@@ -688,26 +745,34 @@ def StartInfo(variables_all):
   Ab initio:                  %-10s
   Load model:                 %-10s
   Transfer learning:          %-10s
+  Restart:                    %-10s
+  Overlap training and MD:    %-10s
   Maxiter:                    %-10s
   Refine crossing:            %-10s
   Refine points/range: 	      %-10s %-10s %-10s
   Max/Min energy:             %-10s %-10s
   Max/Min gradient:           %-10s %-10s
   Max/Min nac:                %-10s %-10s
+  Selection:                  %-10s
+  Max sample/batch:           %-10s %-10s
 -------------------------------------------------------
 """ % (variables_control['abinit'],       variables_control['load'],\
-       variables_control['transfer'],     variables_control['maxiter'],\
+       variables_control['transfer'],     variables_control['restart'],\
+       variables_control['overlap'],      variables_control['maxiter'],\
        variables_control['refine'],       variables_control['refine_num'],\
        variables_control['refine_start'], variables_control['refine_end'],\
        variables_control['maxenergy'],    variables_control['minenergy'],\
        variables_control['maxgradient'],  variables_control['mingradient'],\
-       variables_control['maxnac'],       variables_control['minnac'])
+       variables_control['maxnac'],       variables_control['minnac'],\
+       variables_control['selection'],    variables_control['maxsample'],\
+       variables_control['maxbatch'])
 
     md_info="""
   &initial condition
 -------------------------------------------------------
   Generate initial condition: %-10s
   Number:                     %-10s
+  Run all as ensemble:        %-10s
   Method:                     %-10s 
   Format:                     %-10s
 -------------------------------------------------------
@@ -721,6 +786,11 @@ def StartInfo(variables_all):
   Dt (au):                    %-10s
   Surface hopping:            %-10s
   Substep:                    %-10s
+  Adaptive time step:         %-10s
+  Min/Max Dt (au):            %-10s %-10s
+  Max energy drift (Eh):      %-10s
+  Max gradient change:        %-10s
+  Min state gap (eV):         %-10s
   Integrate probability       %-10s
   Decoherance:                %-10s
   Adjust velocity:            %-10s
@@ -745,9 +815,11 @@ def StartInfo(variables_all):
   Reset step:                 %-10s
 -------------------------------------------------------
 
-""" % (variables_md['initcond'], variables_md['nesmb'],        variables_md['method'],  variables_md['format'], \
+""" % (variables_md['initcond'], variables_md['nesmb'],        variables_md['ensemble'],variables_md['method'],  variables_md['format'], \
        variables_md['ci'],       variables_md['root'],         variables_md['temp'],    variables_md['step'],   \
-       variables_md['size'],     variables_md['sfhp'],         variables_md['substep'], variables_md['integrate'], \
+       variables_md['size'],     variables_md['sfhp'],         variables_md['substep'], \
+       variables_md['adapt'],    variables_md['minsize'],      variables_md['maxsize'], variables_md['maxdrift'],\
+       variables_md['maxdgrad'], variables_md['mingap'],       variables_md['integrate'], \
        variables_md['deco'],     variables_md['adjust'],       variables_md['reflect'], variables_md['maxh'],\
        variables_md['thermo'],   variables_md['thermodelay'],  variables_md['verbose'], variables_md['direct'],\
        variables_md['buffer'],   variables_md['record'],       variables_md['restart'], variables_md['addstep'],\
@@ -772,8 +844,12 @@ def StartInfo(variables_all):
   Predition data:             %-10s
   Silent mode:                %-10s
   Model file:                 %-10s
+  Inducing points:            %-10s
+  Refit/error:                %-10s %-10s
+  Analytic gradient:          %-10s
 -------------------------------------------------------
-""" % (variables_gp['data_info'], variables_gp['train_data'], variables_gp['pred_data'], variables_gp['silent'], variables_gp['model'])
+""" % (variables_gp['data_info'], variables_gp['train_data'], variables_gp['pred_data'], variables_gp['silent'], variables_gp['model'],\
+       variables_gp['sparse'], variables_gp['refit'], variables_gp['refit_error'], variables_gp['analytic_grad'])
  
     nn_info="""
 %s
@@ -790,6 +866,9 @@ def StartInfo(variables_all):
   EG unit:                    %-10s
   NAC unit:                   %-10s
   Data permutation            %-10s
+  Fused inference:            %-10s
+  Inference precision:        %-10s
+  Stream data/buffer:         %-10s %-10s
 -------------------------------------------------------
 
   &hyperparameters            Energy+Gradient    Nonadiabatic couplings Energy+Gradient(2) Nonadiabatic couplings(2)
@@ -828,6 +907,7 @@ def StartInfo(variables_all):
 """ % (variables_nn['data_info'],          variables_nn['train_data'],          variables_nn['pred_data'],           variables_nn['train_mode'],\
        variables_nn['silent'],             variables_nn['nn_eg_type'],          variables_nn['nn_nac_type'],         variables_nn['shuffle'],\
        variables_nn['eg_unit'],            variables_nn['nac_unit'],            variables_nn['permute_map'],\
+       variables_nn['fused'],              variables_nn['precision'],           variables_nn['stream'],              variables_nn['shuffle_buffer'],\
        len(variables_eg['angle_index']),   len(variables_nac['angle_index']),   len(variables_eg['angle_index']),    len(variables_nac2['angle_index']),\
        len(variables_eg['dihyd_index']),   len(variables_nac['dihyd_index']),  	len(variables_eg['dihyd_index']),    len(variables_nac2['dihyd_index']),\
        variables_eg['activ'],              variables_nac['activ'],              variables_eg2['activ'],              variables_nac2['activ'],\
@@ -0,0 +1,105 @@
+## Inverse distance featurizer for PyRAIMD
+## Vectorized inverse distances and their derivatives shared by data processing and ML models
+
+import sys,time
+from functools import lru_cache
+import numpy as np
+
+@lru_cache(maxsize=None)
+def PairIndex(natom):
+    ## This function return the atom indices of all pairs in the upper triangle
+    ## The order is (0,1),(0,2)...(0,n-1),(1,2)... as in the original double loop
+
+    i,j=np.triu_indices(natom,1)
+    i.setflags(write=False)
+    j.setflags(write=False)
+
+    return i,j
+
+def GetInvR(R):
+    ## This function convert coordinates to inverse distances
+    ## R is in shape of (atom,3) or (batch,atom,3)
+    ## This function return an array in shape of (pair) or (batch,pair)
+
+    R=np.asarray(R,dtype=float)
+    i,j=PairIndex(R.shape[-2])
+    rij=R[...,i,:]-R[...,j,:]
+    invr=1/np.sqrt(np.sum(rij**2,axis=-1))
+
+    return invr
+
+def GetInvRGrad(R,W):
+    ## This function contract the derivatives of inverse distances with respect to the coordinates with W
+    ## R is in shape of (atom,3) or (batch,atom,3), W is dE/dinvr in shape of (...,pair) or (batch,...,pair)
+    ## d(1/rij)/dRi = -rij/rij^3 and d(1/rij)/dRj = rij/rij^3, thus each pair is added to its two atoms
+    ## The Jacobian is never built, the memory is linear to the number of pairs
+    ## This function return an array in shape of (...,atom,3) or (batch,...,atom,3)
+
+    R=np.asarray(R,dtype=float)
+    W=np.asarray(W,dtype=float)
+    single=R.ndim == 2
+    R=R.reshape([-1]+list(R.shape[-2:]))
+    W=W.reshape([len(R),-1,W.shape[-1]])
+    natom=R.shape[1]
+    i,j=PairIndex(natom)
+    rij=R[:,i,:]-R[:,j,:]
+    rij/=np.sum(rij**2,axis=2,keepdims=True)**1.5
+    t=W[...,None]*rij[:,None,:,:]
+    grad=np.zeros([len(R),W.shape[1],natom,3])
+    np.add.at(grad,(slice(None),slice(None),i),-t)
+    np.add.at(grad,(slice(None),slice(None),j),t)
+
+    if single:
+        grad=grad[0]
+
+    return grad
+
+def _loop_invr(R):
+    ## the original double loop, only kept for benchmark
+
+    invr=[]
+    q=R[1:]
+    for atom1 in R:
+        for atom2 in q:
+            d=np.sum((atom1-atom2)**2)**0.5
+            invr.append(1/d)
+        q=q[1:]
+
+    invr=np.array(invr)
+    return invr
+
+def Benchmark(natom=20,nmol=1000):
+    ## This function compare the vectorized featurizer with the original loop
+
+    R=np.random.uniform(-5,5,[nmol,natom,3])
+
+    start=time.time()
+    loop=np.array([_loop_invr(x) for x in R])
+    t_loop=time.time()-start
+
+    start=time.time()
+    single=np.array([GetInvR(x) for x in R])
+    t_single=time.time()-start
+
+    start=time.time()
+    batch=GetInvR(R)
+    t_batch=time.time()-start
+
+    info="""
+  &inverse distance benchmark
+-------------------------------------------------------
+  atoms/molecules:            %-10s %-10s
+  loop:                       %10.6f s
+  vectorized per molecule:    %10.6f s  %8.1f x
+  vectorized batch:           %10.6f s  %8.1f x
+  max difference:             %10.2e
+-------------------------------------------------------
+""" % (natom,nmol,t_loop,t_single,t_loop/t_single,t_batch,t_loop/t_batch,np.amax(np.abs(loop-batch))+np.amax(np.abs(loop-single)))
+
+    print(info)
+
+    return info
+
+if __name__ == '__main__':
+    ## usage: python featurizer.py [natom] [nmol]
+    Benchmark(*[int(x) for x in sys.argv[1:3]])
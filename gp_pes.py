@@ -12,6 +12,7 @@ import time
 from multiprocessing import Pool
 from sklearn.gaussian_process import GaussianProcessRegressor
 from sklearn.gaussian_process.kernels import RBF, ConstantKernel, WhiteKernel
+from scipy.linalg import cholesky, cho_solve, solve_triangular
 
 
 #def get_logger(file):
@@ -43,7 +44,7 @@ class GaussianProcessPes:
         model: GaussianProcessRegressor = self._models[model_name]
         model.fit(x, y)
         model.kernel = model.kernel_
-        return model_name, model
+        return model_name, self._compact(model)
 
     def _fit_models(self, x, y_dict,n_processes):
         models_available = sorted(list(self._models.keys()))
@@ -62,27 +63,90 @@ class GaussianProcessPes:
         #self._logger.debug(f"successfully fitted models {models_to_train}")
 
     def fit(self, x, y,n_processes=1) -> "GaussianProcessPes":
-        if self._models is None:
-            self._models = self._create_models(y)
+        self._models = self._create_models(y)
 
         self._fit_models(x,y,n_processes)
 
         return self
 
-    def save(self,filename) -> "GaussianProcessPes":
+    @staticmethod
+    def _compact(model: GaussianProcessRegressor) -> dict:
+        ## arrays of a fitted model, the sklearn estimator is only needed to fit the hyperparameters
+        ## the Cholesky factor L of the kernel matrix is kept for the variance and for the incremental update
+        n = len(model.X_train_)
+        if model.normalize_y:
+            y_mean, y_std = model._y_train_mean, model._y_train_std
+        else:
+            y_mean, y_std = np.zeros(1), np.ones(1)
+
+        return {
+            'z': model.X_train_,
+            'y': model.y_train_.reshape([n, -1]),
+            'L': model.L_,
+            'alpha': model.alpha_.reshape([n, -1]),
+            'y_mean': np.asarray(y_mean, dtype=float).reshape(-1),
+            'y_std': np.asarray(y_std, dtype=float).reshape(-1),
+            'length_scale': float(model.kernel_.k1.k1.length_scale),
+            'constant': float(model.kernel_.k1.k2.constant_value),
+            'noise': float(model.kernel_.k2.noise_level),
+            'reg': float(model.alpha),
+        }
+
+    def _update_model(self, model_name, x, y):
+        ## rank-k extension of the Cholesky factor with the fitted kernel, the hyperparameters are kept
+        ## the cost is O(n^2 k) instead of O(n^3) for refactorizing the kernel matrix
+        model = self._models[model_name]
+        y = ((y - model['y_mean']) / model['y_std']).reshape([len(x), -1])
+
+        k12 = SparseGaussianProcessPes._rbf(model['z'], x, model['length_scale'], model['constant'])
+        k22 = SparseGaussianProcessPes._rbf(x, x, model['length_scale'], model['constant']) + np.eye(len(x)) * (model['noise'] + model['reg'])
+        l21 = solve_triangular(model['L'], k12, lower=True, check_finite=False).T
+        l22 = cholesky(k22 - l21 @ l21.T, lower=True)
+        n = len(model['z'])
+        k = len(x)
+        l = np.zeros([n + k, n + k])
+        l[0:n, 0:n] = model['L']
+        l[n:, 0:n] = l21
+        l[n:, n:] = l22
+
+        model = dict(model)
+        model['z'] = np.concatenate((model['z'], x))
+        model['y'] = np.concatenate((model['y'], y))
+        model['L'] = l
+        model['alpha'] = cho_solve((l, True), model['y'], check_finite=False)
+
+        return model_name, model
+
+    def update(self, x, y, n_processes=1) -> "GaussianProcessPes":
+        if self._models is None:
+            raise TypeError("Cannot update model before fit.")
+
+        if len(x) == 0:
+            return self
+
+        params = [(model_name, x, y[model_name]) for model_name in self._models.keys()]
+        with Pool(n_processes) as p:
+            updated_models = p.starmap(self._update_model, params)
+
+        self._models = {model_name: model_object for model_name, model_object in updated_models}
+
+        return self
+
+    def save(self, filename, sgm_list, miu_list) -> str:
         if self._models is None:
             raise TypeError("Cannot save model before init.")
 
         #self._logger.debug(f"saving model to {filename}")
-        with open(f"{filename}.pkl", "wb") as file:
-            pickle.dump(self._models, file, protocol=pickle.HIGHEST_PROTOCOL)
-
-        return self._models
+        return write_compact(filename, self._models, sgm_list, miu_list)
 
     def load(self, filename) -> "GaussianProcessPes":
         #self._logger.debug(f"loading fitted model")
-        with open(f"{filename}", "rb") as file:
-            self._models = pickle.load(file)
+        ## a pickled dict of sklearn estimators from the older versions is converted to arrays
+        if os.path.isdir(filename):
+            self._models, sgm_list, miu_list = read_compact(filename)
+        else:
+            with open(f"{filename}", "rb") as file:
+                self._models = {key: self._compact(model) for key, model in pickle.load(file).items()}
 
         return self
 
@@ -91,20 +155,289 @@ class GaussianProcessPes:
 
         return self
 
-    def _predictions(self,model_name,model,x):
-        results=model.predict(x,return_std=True)
-        return model_name,results
+    def predict_gradient(self, x, model_name='e'):
+        ## derivative of the predicted mean with respect to x for the RBF*Constant+White kernel
+        ## the white noise does not contribute to the prediction, thus only k1 = RBF*Constant is used
+        ## return an array in shape of (batch,output,feature)
+        return compact_gradient(self._models[model_name], x)
+
+    def predict_gradient_std(self, x, jac, model_name='e'):
+        ## standard deviation of the derivative of the predicted mean, projected on the columns of jac
+        ## return an array in shape of (batch,output,direction)
+        return compact_gradient_std(self._models[model_name], x, jac)
 
     def predict(self, x,n_processes=1) -> dict:
+        ## the prediction is a few matrix products, thus no process pool is used
+        predictions = [(model_name, compact_predictions(model, x)) for model_name, model in self._models.items()]
+
+        result = {name:results for name, results in predictions}
+
+        y_pred = {key: result[key][0] for key in result.keys()}
+        y_std = {key: result[key][1] for key in result.keys()}
+
+        return y_pred, y_std
+
+
+
+class SparseGaussianProcessPes:
+    ## Sparse Gaussian process with inducing points (SGPR/DTC)
+    ## The inducing points are selected from the training descriptors by farthest point sampling
+    ## The kernel hyperparameters are fitted by an exact GP on the inducing points only
+    ## Fitting is O(n m^2) and prediction is O(m) for the mean and O(m^2) for the variance
+    def __init__(self, n_inducing=500, seed=1):
+        # noinspection PyTypeChecker
+        self._models: dict = None
+        self.n_inducing = n_inducing
+        self.seed = seed
+
+    def _select_inducing(self, x):
+        ## greedy farthest point sampling, start from a random descriptor
+        m = np.amin([self.n_inducing, len(x)])
+        np.random.seed(self.seed)
+        pick = [np.random.randint(len(x))]
+        dist = np.sum((x - x[pick[0]]) ** 2, axis=1)
+        for i in range(m - 1):
+            new = np.argmax(dist)
+            pick.append(new)
+            dist = np.minimum(dist, np.sum((x - x[new]) ** 2, axis=1))
+
+        return np.array(pick)
+
+    @staticmethod
+    def _rbf(x1, x2, length_scale, constant):
+        d2 = np.sum(x1 ** 2, axis=1)[:, None] + np.sum(x2 ** 2, axis=1)[None, :] - 2 * x1 @ x2.T
+        return constant * np.exp(-0.5 * np.maximum(d2, 0) / length_scale ** 2)
+
+    def _fit_model(self, model_name, x, y):
+        pick = self._select_inducing(x)
+        z = x[pick]
+        y_mean = np.mean(y, axis=0)
+
+        ## hyperparameters from an exact GP on the inducing points
+        kernel = RBF() * ConstantKernel() + WhiteKernel()
+        gpr = GaussianProcessRegressor(kernel=kernel).fit(z, y[pick] - y_mean)
+        length_scale = gpr.kernel_.k1.k1.length_scale
+        constant = gpr.kernel_.k1.k2.constant_value
+        noise = gpr.kernel_.k2.noise_level
 
-        params = [(model_name,model,x) for model_name, model in self._models.items()]
+        ## Woodbury form: mean = Kxm alpha, var = kxx - |W Kmx|^2 with W^T W = Kmm^-1 - (Kmm + Kmn Knm / noise)^-1
+        kmm = self._rbf(z, z, length_scale, constant) + 1e-6 * constant * np.eye(len(z))
+        kmn = self._rbf(z, x, length_scale, constant)
+        ## whiten with the Cholesky factor of Kmm, B = I + A A^T is well conditioned
+        l = np.linalg.cholesky(kmm)
+        a = np.linalg.solve(l, kmn) / noise ** 0.5
+        b = np.eye(len(z)) + a @ a.T
+        l_inv = np.linalg.inv(l)
+        alpha = l_inv.T @ np.linalg.solve(b, a @ (y - y_mean)) / noise ** 0.5
+        eigval, eigvec = np.linalg.eigh(b)
+        w = np.sqrt(np.maximum(1 - 1 / eigval, 0))[:, None] * (eigvec.T @ l_inv)
+
+        model = {
+            'z': z,
+            'alpha': alpha,
+            'w': w,
+            'y_mean': y_mean,
+            'length_scale': length_scale,
+            'constant': constant,
+            'noise': noise,
+        }
+
+        return model_name, model
+
+    def _fit_models(self, x, y_dict, n_processes):
+        params = [(model_name, x, y) for model_name, y in y_dict.items()]
         with Pool(n_processes) as p:
-            predictions = p.starmap(self._predictions, params)
+            trained_models = p.starmap(self._fit_model, params)
 
-        result = {name:results for name, results in predictions}
+        self._models = {model_name: model_object for model_name, model_object in trained_models}
+
+    def fit(self, x, y, n_processes=1) -> "SparseGaussianProcessPes":
+        self._fit_models(x, y, n_processes)
+
+        return self
+
+    def save(self, filename, sgm_list, miu_list) -> str:
+        if self._models is None:
+            raise TypeError("Cannot save model before init.")
+
+        models = {}
+        for key, model in self._models.items():
+            models[key] = {name: model[name] for name in ['z', 'alpha', 'w', 'length_scale', 'constant', 'noise']}
+            models[key]['y_mean'] = np.asarray(model['y_mean'], dtype=float).reshape(-1)
+            models[key]['y_std'] = np.ones(1)
+
+        return write_compact(filename, models, sgm_list, miu_list)
+
+    def load(self, filename) -> "SparseGaussianProcessPes":
+        ## a pickled dict from the older versions is also accepted
+        if os.path.isdir(filename):
+            self._models, sgm_list, miu_list = read_compact(filename)
+        else:
+            with open(f"{filename}", "rb") as file:
+                self._models = pickle.load(file)
+
+        return self
+
+    def retrieve(self, modelfile) -> "SparseGaussianProcessPes":
+        self._models = modelfile
+
+        return self
+
+    def _predictions(self, model_name, model, x):
+        kxm = self._rbf(x, model['z'], model['length_scale'], model['constant'])
+        mean = kxm @ model['alpha'] + model['y_mean']
+        var = model['constant'] + model['noise'] - np.sum((kxm @ model['w'].T) ** 2, axis=1)
+        std = np.sqrt(np.maximum(var, 0))
+        return model_name, (mean, std)
+
+    def predict_gradient(self, x, model_name='e'):
+        ## derivative of the predicted mean with respect to x
+        ## return an array in shape of (batch,output,feature)
+        model = self._models[model_name]
+        kxm = self._rbf(x, model['z'], model['length_scale'], model['constant'])
+        ka = kxm @ model['alpha']
+        kaz = np.einsum('bm,mo,mf->bof', kxm, model['alpha'], model['z'], optimize=True)
+        grad = -(x[:, None, :] * ka[:, :, None] - kaz) / model['length_scale'] ** 2
+
+        return grad
+
+    def predict_gradient_std(self, x, jac, model_name='e'):
+        ## standard deviation of the derivative of the predicted mean, projected on the columns of jac
+        ## return an array in shape of (batch,output,direction)
+        return compact_gradient_std(self._models[model_name], x, jac)
+
+    def predict(self, x, n_processes=1) -> dict:
+        ## the prediction is cheap, thus no process pool is used
+        predictions = [self._predictions(model_name, model, x) for model_name, model in self._models.items()]
+
+        result = {name: results for name, results in predictions}
 
         y_pred = {key: result[key][0] for key in result.keys()}
         y_std = {key: result[key][1] for key in result.keys()}
 
         return y_pred, y_std
 
+
+def write_compact(filename, models, sgm_list, miu_list) -> str:
+    ## write the arrays of each model as .npy files in filename.gp and the scalars in index.json
+    ## the exact GP saves the Cholesky factor L and its training targets y, the sparse GP saves the variance factor w
+    path = f"{filename}.gp"
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    index = {
+        'sgm_list': {key: float(value) for key, value in sgm_list.items()},
+        'miu_list': {key: float(value) for key, value in miu_list.items()},
+        'models': {},
+    }
+    for key, model in models.items():
+        arrays = [name for name in ['z', 'y', 'L', 'w', 'alpha', 'y_mean', 'y_std'] if name in model.keys()]
+        for name in arrays:
+            np.save(f"{path}/{key}-{name}.npy", np.ascontiguousarray(model[name], dtype=float))
+        index['models'][key] = {name: float(model[name]) for name in ['length_scale', 'constant', 'noise', 'reg'] if name in model.keys()}
+        index['models'][key]['arrays'] = arrays
+
+    with open(f"{path}/index.json", "w") as file:
+        json.dump(index, file)
+
+    return path
+
+
+def read_compact(filename):
+    ## read the models written by write_compact, the arrays are memory-mapped
+    ## return the models, sgm_list and miu_list
+    with open(f"{filename}/index.json", "r") as file:
+        index = json.load(file)
+
+    models = {}
+    for key, hyper in index['models'].items():
+        hyper = dict(hyper)
+        arrays = hyper.pop('arrays', ['z', 'alpha', 'w', 'y_mean', 'y_std'])
+        model = {name: np.load(f"{filename}/{key}-{name}.npy", mmap_mode='r') for name in arrays}
+        model.update(hyper)
+        models[key] = model
+
+    return models, index['sgm_list'], index['miu_list']
+
+
+def compact_predictions(model, x):
+    ## mean = k(x,z) alpha * y_std + y_mean
+    ## var  = constant + noise - |L^-1 k(z,x)|^2 for the exact GP or - |w k(z,x)|^2 for the sparse GP
+    kxm = SparseGaussianProcessPes._rbf(x, model['z'], model['length_scale'], model['constant'])
+    mean = (kxm @ model['alpha']) * model['y_std'] + model['y_mean']
+    if 'L' in model.keys():
+        v = solve_triangular(model['L'], kxm.T, lower=True, check_finite=False)
+        var = model['constant'] + model['noise'] - np.sum(v ** 2, axis=0)
+    else:
+        var = model['constant'] + model['noise'] - np.sum((kxm @ model['w'].T) ** 2, axis=1)
+    std = np.sqrt(np.maximum(var, 0))
+    if len(model['y_std']) > 1:
+        std = std[:, None] * model['y_std'][None, :]
+    else:
+        std = std * model['y_std'][0]
+
+    return mean, std
+
+
+def compact_gradient(model, x):
+    ## derivative of the predicted mean with respect to x
+    ## return an array in shape of (batch,output,feature)
+    kxm = SparseGaussianProcessPes._rbf(x, model['z'], model['length_scale'], model['constant'])
+    ka = kxm @ model['alpha']
+    kaz = np.einsum('bm,mo,mf->bof', kxm, model['alpha'], model['z'], optimize=True)
+    grad = -(x[:, None, :] * ka[:, :, None] - kaz) / model['length_scale'] ** 2
+
+    return grad * np.asarray(model['y_std']).reshape([1, -1, 1])
+
+
+def compact_gradient_std(model, x, jac):
+    ## standard deviation of the derivative of the predicted mean, projected on the columns of jac
+    ## the derivative of a GP is a GP, its covariance is k''(x,x) - dk(x,z) K^-1 dk(z,x) and the white noise is not differentiated
+    ## for the RBF kernel k''(x,x) = constant / length_scale^2 and dk(x,z)/dx = (z - x) k(x,z) / length_scale^2
+    ## jac is in shape of (batch,feature,direction), return an array in shape of (batch,output,direction)
+    kxm = SparseGaussianProcessPes._rbf(x, model['z'], model['length_scale'], model['constant'])
+    ls2 = model['length_scale'] ** 2
+    std = np.zeros([len(x), jac.shape[2]])
+    for b in range(len(x)):
+        dk = (kxm[b][:, None] / ls2) * ((model['z'] - x[b]) @ jac[b])
+        if 'L' in model.keys():
+            v = solve_triangular(model['L'], dk, lower=True, check_finite=False)
+        else:
+            v = model['w'] @ dk
+        var = model['constant'] / ls2 * np.sum(jac[b] ** 2, axis=0) - np.sum(v ** 2, axis=0)
+        std[b] = np.sqrt(np.maximum(var, 0))
+    nout = model['alpha'].shape[1]
+    y_std = np.asarray(model.get('y_std', np.ones(1))).reshape([1, -1, 1])
+
+    return np.repeat(std[:, None, :], nout, axis=1) * y_std
+
+
+class CompactGaussianProcessPes:
+    ## Pure numpy predictor for the models saved by GaussianProcessPes.save or SparseGaussianProcessPes.save
+    ## The arrays are memory-mapped, thus the worker processes share the same pages
+    def __init__(self):
+        # noinspection PyTypeChecker
+        self._models: dict = None
+        self.sgm_list: dict = None
+        self.miu_list: dict = None
+
+    def load(self, filename) -> "CompactGaussianProcessPes":
+        self._models, self.sgm_list, self.miu_list = read_compact(filename)
+
+        return self
+
+    def predict_gradient(self, x, model_name='e'):
+        return compact_gradient(self._models[model_name], x)
+
+    def predict_gradient_std(self, x, jac, model_name='e'):
+        return compact_gradient_std(self._models[model_name], x, jac)
+
+    def predict(self, x, n_processes=1) -> dict:
+        predictions = [(model_name, compact_predictions(model, x)) for model_name, model in self._models.items()]
+
+        result = {name: results for name, results in predictions}
+
+        y_pred = {key: result[key][0] for key in result.keys()}
+        y_std = {key: result[key][1] for key in result.keys()}
+
+        return y_pred, y_std
@@ -4,7 +4,7 @@
 import time,datetime,os,pickle
 import numpy as np
 from reset_velocity import ResetVelo
-from periodic_table import Element
+from periodic_table import AtomMass
 from verlet import NoseHoover, VerletI, VerletII
 from surfacehopping import FSSH,GSH,NOSH
 from tools import Printcoord,NACpairs
@@ -288,7 +288,7 @@ class MIXAIMD:
         natom = len(xyz)
         T = xyz[:,0]
         R = xyz[:,1:].astype(float)
-        M = np.array([Element(x).getMass()*1822.8852 for x in T]).reshape([-1,1])
+        M = AtomMass(T).reshape([-1,1])*1822.8852
         return T,R,M
 
     def _write_coord(self,T,R):
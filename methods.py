@@ -1,23 +1,36 @@
 ## QM and ML methods for PyRAIMD
-## Jingbai Li Jul 11 2020 
+## Jingbai Li Jul 11 2020
 
-from qc_molcas import MOLCAS
-from qc_bagel import BAGEL
-from model_NN import DNN
-from model_GP import GPR
+import sys,os,subprocess
+import importlib
+
+## The backends are imported on first use, thus the jobs not using ML never import TensorFlow or sklearn
+## method name : (module, class)
+qm_list  = {
+'molcas' : ('qc_molcas', 'MOLCAS'),
+'bagel'  : ('qc_bagel',  'BAGEL'),
+'nn'     : ('model_NN',  'DNN'),
+'gp'     : ('model_GP',  'GPR'),
+}
+
+def LoadMethod(qm):
+    ## This function import the backend module of a method by name and return the class
+    ## The imported modules are cached by python, thus this function only pays the import time once
+
+    if qm not in qm_list.keys():
+        print('Method %s is not found. Available methods are: %s' % (qm,' '.join(qm_list.keys())))
+        exit()
+
+    module,name=qm_list[qm]
+
+    return getattr(importlib.import_module(module),name)
 
 class QM:
     ## This class recieve method name (qm) and variables (method_variables)
     ## This class identify the method that will be used in MD
 
     def __init__(self,qm,variables_all,id=None):
-        qm_list  = {
-        'molcas' : MOLCAS, ## this will be classes
-        'bagel'  : BAGEL,
-        'nn'     : DNN,
-        'gp'     : GPR,
-        }
-        self.method=qm_list[qm](variables_all,id=id) # This should pass hypers
+        self.method=LoadMethod(qm)(variables_all,id=id) # This should pass hypers
 
     def train(self):
         self.method.train()
@@ -32,3 +45,42 @@ class QM:
 
     def evaluate(self,x):
         return self.method.evaluate(x)
+
+def Benchmark(modules=None):
+    ## This function measure the import time and memory of the PyRAIMD modules and backends
+    ## Each module is imported in a fresh python process, otherwise the cached modules hide the cost
+
+    if modules == None:
+        modules=['methods','aimd','adaptive_sampling']+[x[0] for x in qm_list.values()]
+
+    code="""
+import sys,time,resource
+start=time.time()
+try:
+    import %s
+    status='ok'
+except Exception as error:
+    status=type(error).__name__
+print(time.time()-start,resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024,status,'tensorflow' in sys.modules)
+"""
+
+    info="""
+  &import benchmark
+-------------------------------------------------------
+  %-20s %10s %10s %12s %6s
+""" % ('module','time/s','RSS/MB','status','TF')
+
+    for module in modules:
+        out=subprocess.run([sys.executable,'-c',code % (module)],cwd=os.path.dirname(os.path.abspath(__file__)),capture_output=True,text=True)
+        walltime,rss,status,tf=out.stdout.split()
+        info+='  %-20s %10.3f %10.1f %12s %6s\n' % (module,float(walltime),float(rss),status,tf)
+
+    info+='-------------------------------------------------------\n'
+
+    print(info)
+
+    return info
+
+if __name__ == '__main__':
+    ## usage: python methods.py [module1 module2 ...]
+    Benchmark(sys.argv[1:] if len(sys.argv) > 1 else None)
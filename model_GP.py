@@ -1,9 +1,11 @@
 ## Gaussian Process Regression interface for PyRAIMD
 ## Jingbai Li Jul 8 2020
 
-import time,datetime,json
+import time,datetime,json,os
 import numpy as np
-from gp_pes import GaussianProcessPes 
+from gp_pes import GaussianProcessPes,SparseGaussianProcessPes,CompactGaussianProcessPes
+from training_data import LoadTrainData
+from featurizer import GetInvR,GetInvRGrad
 
 class GPR:
     ## This is the interface to GP
@@ -23,7 +25,11 @@ class GPR:
         data            = variables['postdata']
         self.version    = variables_all['version']
         self.pred_data  = variables['pred_data']
-        self.model	= GaussianProcessPes()
+        self.sparse     = variables['sparse']
+        if self.sparse > 0:
+            self.model  = SparseGaussianProcessPes(n_inducing=self.sparse,seed=variables['ml_seed'])
+        else:
+            self.model	= GaussianProcessPes()
         if id == None or id == 1:
             self.name   = f"GP-{title}"
         else:
@@ -36,18 +42,17 @@ class GPR:
         self.size_train = len(data['energy_train'])
         self.size_val   = len(data['energy_val'])
         self.npair      = data['npair']
-        self.x          = (data['invr_train'] -data['mid_invr'])/data['dev_invr']
-        self.x_val      = (data['invr_val']   -data['mid_invr'])/data['dev_invr']
-        self.y_dict={
-        'e'  : (data['energy_train'].reshape([self.size_train,-1])  -data['mid_energy']  )/data['dev_energy'],
-        'g'  : (data['gradient_train'].reshape([self.size_train,-1])-data['mid_gradient'])/data['dev_gradient'],
-        'n'  : (data['nac_train'].reshape([self.size_train,-1])     -data['mid_nac'])     /data['dev_nac'],
-        }
-        self.y_val_dict={
-        'e'  : (data['energy_val'].reshape([self.size_val,-1])   -data['mid_energy']  )/data['dev_energy'],
-        'g'  : (data['gradient_val'].reshape([self.size_val,-1]) -data['mid_gradient'])/data['dev_gradient'],
-        'n'  : (data['nac_val'].reshape([self.size_val,-1])      -data['mid_nac'])     /data['dev_nac'],
-        }
+        self.data       = data
+        self.analytic   = variables['analytic_grad']
+        self.refit      = variables['refit']
+        self.refit_error= variables['refit_error']
+        if id == None or id == 1:
+            self.prev   = None
+        elif id == 2:
+            self.prev   = f"GP-{title}"
+        else:
+            self.prev   = f"GP-{title}-{id-1}"
+        self.id         = id if id != None else 1
         self.sgm_list={
         'invr': data['dev_invr'],
         'e'   : data['dev_energy'],
@@ -60,6 +65,98 @@ class GPR:
         'g'   : data['mid_gradient'],
         'n'   : data['mid_nac'],
         }
+        self._normalize()
+
+    def _normalize(self):
+        ## This function scale the training and validation data with sgm_list and miu_list
+        data            = self.data
+        self.x          = (data['invr_train'] -self.miu_list['invr'])/self.sgm_list['invr']
+        self.x_val      = (data['invr_val']   -self.miu_list['invr'])/self.sgm_list['invr']
+        self.y_dict={
+        'e'  : (data['energy_train'].reshape([self.size_train,-1])  -self.miu_list['e'])/self.sgm_list['e'],
+        'g'  : (data['gradient_train'].reshape([self.size_train,-1])-self.miu_list['g'])/self.sgm_list['g'],
+        'n'  : (data['nac_train'].reshape([self.size_train,-1])     -self.miu_list['n'])/self.sgm_list['n'],
+        }
+        self.y_val_dict={
+        'e'  : (data['energy_val'].reshape([self.size_val,-1])   -self.miu_list['e'])/self.sgm_list['e'],
+        'g'  : (data['gradient_val'].reshape([self.size_val,-1]) -self.miu_list['g'])/self.sgm_list['g'],
+        'n'  : (data['nac_val'].reshape([self.size_val,-1])      -self.miu_list['n'])/self.sgm_list['n'],
+        }
+        self.coord_val  = data['coord_val']
+
+        ## the gradient is the derivative of the energy model, thus no gradient model is trained
+        if self.analytic == 1:
+            del self.y_dict['g']
+
+    def _read_fit_info(self,modelfile):
+        ## This function read the scaling and fitting history saved next to a model file
+        try:
+            with open('%s.json' % (os.path.splitext(modelfile)[0] if modelfile.endswith('.pkl') or modelfile.endswith('.gp') else modelfile),'r') as infile:
+                info=json.load(infile)
+        except FileNotFoundError:
+            info=None
+
+        return info
+
+    def _update_model(self):
+        ## This function extend the previous model with the new training data at fixed hyperparameters
+        ## This function return the fitting history if the update is accepted, otherwise None and a full fit is needed
+        if self.sparse > 0 or self.refit <= 1 or self.prev == None:
+            return None
+
+        info=self._read_fit_info(f"fitted-{self.prev}.gp")
+        if info == None:
+            return None
+
+        ## a full fit is due after refit trainings
+        if self.id - info['refit_id'] >= self.refit:
+            return None
+
+        ## the previous training data must be the first part of the current training data
+        nprev=info['size']
+        if nprev > self.size_train or np.array_equal(self.data['index_train'][0:nprev],info['index_train']) == False:
+            return None
+
+        ## use the scaling of the previous model, otherwise the kernel matrix is not reusable
+        sgm_list,miu_list=self.sgm_list,self.miu_list
+        self.sgm_list=info['sgm_list']
+        self.miu_list=info['miu_list']
+        self._normalize()
+
+        if os.path.isdir(f"fitted-{self.prev}.gp") == False:
+            return None
+        self.model.load(f"fitted-{self.prev}.gp")
+        self.model.update(self.x[nprev:],{key:value[nprev:] for key,value in self.y_dict.items()},n_processes=self.ncpu)
+
+        ## check the validation error of energy against the last full fit
+        if self.refit_error > 0:
+            y_pred,y_std=self._predict(self.x_val,self.coord_val,n_processes=self.ncpu)
+            e_dev_rmsd=np.mean(((y_pred['e']-self.y_val_dict['e'].reshape(y_pred['e'].shape))*self.sgm_list['e'])**2)**0.5
+            if e_dev_rmsd > self.refit_error*info['val_rmsd']:
+                self.sgm_list,self.miu_list=sgm_list,miu_list
+                self._normalize()
+                return None
+
+        return info
+
+    def _predict(self,x,coord,n_processes=1):
+        ## This function predict the scaled values of all models
+        ## In analytic gradient mode, the gradient is computed from the energy model by the chain rule
+        ## dE/dR = dE/dx * dx/d(invr) * d(invr)/dR, R is in Angstrom and the gradient is converted to Eh/Bohr
+        y_pred,y_std=self.model.predict(x,n_processes=n_processes)
+        ## The std of the gradient is the std of the derivative of the energy model, projected on the same chain rule
+        if self.analytic == 1:
+            size=len(x)
+            coord=np.array(coord).reshape([size,self.natom,3])
+            de_dx=self.model.predict_gradient(x,'e')*self.sgm_list['e']
+            grad=GetInvRGrad(coord,de_dx/self.sgm_list['invr'])*0.52917721090380
+            y_pred['g']=(grad.reshape([size,-1])-self.miu_list['g'])/self.sgm_list['g']
+            npair=x.shape[1]
+            jac=np.array([GetInvRGrad(c,np.eye(npair)/self.sgm_list['invr']).reshape([npair,-1]) for c in coord])
+            g_std=self.model.predict_gradient_std(x,jac,'e')*self.sgm_list['e']*0.52917721090380
+            y_std['g']=g_std.reshape([size,-1])/self.sgm_list['g']
+
+        return y_pred,y_std
 
     def _heading(self):
 
@@ -83,37 +180,38 @@ class GPR:
         walltime='%5d days %5d hours %5d minutes %5d seconds' % (int(walltime/86400),int((walltime%86400)/3600),int(((walltime%86400)%3600)/60),int(((walltime%86400)%3600)%60))
         return walltime
 
-    def _getinvr(self,x):
-        x=np.array(x)
-        x=np.array(x[:,1:],dtype=np.float) 
-        invr=[]
-        q=x[1:]
-        for atom1 in x:
-            for atom2 in q:
-                d=np.sum((atom1-atom2)**2)**0.5
-                invr.append(1/d)
-            q=q[1:]
-        invr=np.array(invr)
-        return invr
-
     def train(self):
 
         start=time.time()
         topline='Gaussian Process Start: %20s\n%s' % (self._whatistime(),self._heading())
         runinfo="""\n  &gp fitting with %d threads\n""" % (self.ncpu)
+        if self.sparse > 0:
+            runinfo+="""  sparse gp with %d inducing points\n""" % (self.sparse)
+        if self.analytic == 1:
+            runinfo+="""  gradient from the derivative of the energy model\n"""
 
         if self.silent == 0:
             print(topline)
             print(runinfo)
 
+        ## extend the previous model if possible, otherwise fit the hyperparameters again
+        info=self._update_model()
+        if info == None:
+            self.model.fit(self.x,self.y_dict,n_processes=self.ncpu)
+            fitinfo="""  full fit with %d training data\n""" % (self.size_train)
+        else:
+            fitinfo="""  update %s with %d new training data\n""" % (self.prev,self.size_train-info['size'])
+
+        if self.silent == 0:
+            print(fitinfo)
+
         log=open('%s.log' % (self.name),'w')
         log.write(topline)
         log.write(runinfo)
+        log.write(fitinfo)
         log.close()
 
-        self.model.fit(self.x,self.y_dict,n_processes=self.ncpu)
-        self.model.save(f"fitted-{self.name}")
-        y_pred,y_std=self.model.predict(self.x_val,n_processes=self.ncpu)
+        y_pred,y_std=self._predict(self.x_val,self.coord_val,n_processes=self.ncpu)
         length=len(self.x_val)
 
         ## todo make a loop later
@@ -137,6 +235,19 @@ class GPR:
         n_dev_min=np.amin(np.abs(n_dev))
         n_dev_rmsd=np.mean(n_dev**2)**0.5
 
+        ## save the scaling and fitting history for the next update
+        if info == None:
+            info={'refit_id':self.id,'val_rmsd':e_dev_rmsd}
+        info['size']=self.size_train
+        info['index_train']=np.array(self.data['index_train']).tolist()
+        info['sgm_list']={key:float(value) for key,value in self.sgm_list.items()}
+        info['miu_list']={key:float(value) for key,value in self.miu_list.items()}
+        with open(f"fitted-{self.name}.json",'w') as outfile:
+            json.dump(info,outfile)
+
+        ## the model arrays are saved in one memory-mappable format for prediction and the next update
+        self.model.save(f"fitted-{self.name}",self.sgm_list,self.miu_list)
+
         e_std=y_std['e']   *self.sgm_list['e']
         g_std=y_std['g']   *self.sgm_list['g']
         n_std=y_std['n']   *self.sgm_list['n']
@@ -199,8 +310,25 @@ class GPR:
         return self
 
     def load(self):
+        ## the saved model is memory-mapped and does not need sklearn to predict
+        ## a .pkl model from the older versions can still be given as modelfile
+        if self.modelfile == None:
+            self.modelfile = f"fitted-{self.name}.gp"
+
+        if os.path.isdir(self.modelfile) == True:
+            self.model=CompactGaussianProcessPes().load(self.modelfile)
+            self.sgm_list=self.model.sgm_list
+            self.miu_list=self.model.miu_list
+            return self
+
         self.model.load(self.modelfile)
 
+        ## use the scaling saved with the model
+        info=self._read_fit_info(self.modelfile)
+        if info != None:
+            self.sgm_list=info['sgm_list']
+            self.miu_list=info['miu_list']
+
         return self
 
     def appendix(self,addons):
@@ -210,15 +338,15 @@ class GPR:
 
     def evaluate(self,x):
         if x == None:
-            with open('%s' % self.pred_data,'r') as preddata:
-                pred=json.load(preddata)
-            pred_natom,pred_nstate,pred_xyz,pred_invr,pred_energy,pred_gradient,pred_nac,pred_ci,pred_mo=pred
-            x=pred_invr
+            pred=LoadTrainData(self.pred_data)
+            coord=pred.get('coord')
+            x=pred.get('invr')
         else:
-            x=np.array([self._getinvr(x)])
+            coord=np.array(x)[:,1:4].astype(float)
+            x=GetInvR(coord)[None]
         size=len(x)
         x=(x-self.miu_list['invr'])/self.sgm_list['invr']
-        y_pred,y_std=self.model.predict(x)
+        y_pred,y_std=self._predict(x,coord)
        # print(x[0])
        # print(y_pred['g'][0])
         e_pred=y_pred['e'] *self.sgm_list['e']+self.miu_list['e']
@@ -249,7 +377,7 @@ class GPR:
                 'nac'      : n_pred.reshape([size,self.npair,self.natom,3])[0],
                 'civec'    : None,
                 'movec'    : None,
-                'err_e'    : e_std,
-       	       	'err_g'	   : g_std,
-       	       	'err_n'	   : n_std,
+                'err_e'    : np.amax(e_std[0]),
+       	       	'err_g'	   : np.amax(g_std[0]),
+       	       	'err_n'	   : np.amax(n_std[0]),
                 }
@@ -10,9 +10,12 @@
 ### May 15 2020 Jingbai Li adapt this to PyRAIMD
 
 from optparse import OptionParser
-import time,datetime,os,sys,json
+import time,datetime,os,sys,json,itertools
+import multiprocessing
 import numpy as np
 from data_processing import Prepdata
+from training_data import LoadTrainData
+from featurizer import GetInvR
 import tensorflow as tf
 import tensorflow.keras as ks
 import tensorflow.keras.backend as K
@@ -22,9 +25,6 @@ from tensorflow.keras.models import Sequential,Model
 from tensorflow.keras.layers import Dense, Activation,Input,BatchNormalization
 from tensorflow.keras.callbacks import LearningRateScheduler
 
-import talos as ta
-from talos import Scan
-
 def J2LA(L):
     ## This function load json file and convert to a list of numpy array
     ## This function is used to import weights for neural network
@@ -48,21 +48,6 @@ def L2A(M):
 
     return E,G,N
 
-def GetInvR(R):
-    ## This functoin convert coordinates to inverse R matrix
-    ## This function is only used for interfacing with PyRAIMD
-
-    invr=[]
-    q=R[1:]
-    for atom1 in R:
-        for atom2 in q:
-            d=np.sum((atom1-atom2)**2)**0.5
-            invr.append(1/d)
-        q=q[1:]
-
-    invr=np.array(invr)
-    return invr
-
 def whatistime():
     return datetime.datetime.strftime(datetime.datetime.now(), '%Y-%m-%d %H:%M:%S')
 
@@ -76,7 +61,7 @@ def params_space(space,var,par):
 
     start=np.amin(space[0:2])
     end=np.amax(space[0:2])
-    step=space[2]
+    step=int(space[2])
     params=[]
 
     if   step == 0:
@@ -328,6 +313,164 @@ def NN(feat_train,target_train,feat_val,target_val,params):
     return history, model
 
 
+def SearchCandidates(p,nsample,seed):
+    ## This function sample the candidates from the product of the hyperparameter space
+    ## The epoch is not sampled, it is the training budget of the successive halving
+
+    keys=['batch','layer','nodes','wl2','lr','flr','flrstep']
+    space=list(itertools.product(*[p[key] for key in keys]))
+    np.random.seed(seed)
+    nchoose=int(np.amax([1,np.amin([len(space),int(nsample*len(space))])]))
+    choose=np.random.choice(len(space),nchoose,replace=False)
+    candidates=[{key:np.array(val).item() for key,val in zip(keys,space[i])} for i in sorted(choose)]
+
+    return candidates
+
+def SearchBudget(space_epoch,eta):
+    ## This function compute the epochs of each rung from the epoch space
+    ## The last rung trains the full epochs, each rung below has eta times fewer epochs
+
+    emin=int(np.amax([1,np.amin(space_epoch[0:2])]))
+    emax=int(np.amax([emin,np.amax(space_epoch[0:2])]))
+    budget=[emax]
+    while int(budget[0]/eta) >= emin and eta > 1:
+        budget=[int(budget[0]/eta)]+budget
+
+    return budget
+
+_search_cache={}
+
+def _search_features(path):
+    ## This function load the cached features once per worker process
+
+    if path not in _search_cache.keys():
+        _search_cache[path]={key.split('.npy')[0]:np.load('%s/%s' % (path,key),mmap_mode='r') for key in os.listdir(path) if key.endswith('.npy')}
+
+    return _search_cache[path]
+
+def _search_init(nthread):
+    ## This function limit the threads of each worker, thus the parallel trials share the cpus
+
+    tf.config.threading.set_intra_op_parallelism_threads(nthread)
+    tf.config.threading.set_inter_op_parallelism_threads(nthread)
+
+def _search_trial(trial):
+    ## This function train one candidate for one rung
+    ## The weights of the previous rung are loaded, thus each rung only trains the additional epochs
+    ## The learning rate continues from its decay over the epochs trained before
+
+    global flr,flrstep
+    path,model_name,cid,rung,start,epochs,params,prev_weights=trial
+    feat=_search_features(path)
+
+    if model_name == 'eg':
+        y_train,y_val=[feat['y_train_e'],feat['y_train_g']],[feat['y_val_e'],feat['y_val_g']]
+    else:
+        y_train,y_val=feat['y_train'],feat['y_val']
+
+    params=params.copy()
+    params['epoch']=epochs
+    params['silent']=1
+    params['import_weights']=J2LA(prev_weights)
+    params['in_weight']=int(prev_weights != None)
+    params['lr']=params['lr']*params['flr']**int(start/params['flrstep'])
+    flr=params['flr']
+    flrstep=params['flrstep']
+
+    model_list={
+    'eg' : NNEG,
+    'e'  : NN,
+    'g'  : NN,
+    'nac': NN,
+    }
+    history,model=model_list[model_name](np.array(feat['x_train']),y_train,np.array(feat['x_val']),y_val,params)
+    val_loss=float(history.history['val_loss'][-1])
+
+    weights='%s/trial-%d-%d.json' % (path,cid,rung)
+    with open(weights,'w') as export_weights:
+        json.dump([i.tolist() for i in model.get_weights()],export_weights)
+
+    return cid,rung,val_loss,weights
+
+def HyperSearch(chkname,model_name,p,features,nsample,space_epoch,eta,s_win,ncpu,seed):
+    ## This function run a successive halving search of the hyperparameters
+    ## All candidates start with a few epochs, the best 1/eta of each rung are promoted to the next rung with more epochs
+    ## The candidates of a rung are trained in a process pool, the features are written once and memory mapped by all workers
+    ## Every finished trial is saved in chkname.trials.json, a restarted search skips the finished trials
+
+    path='%s.search' % (chkname)
+    dbfile='%s.trials.json' % (chkname)
+    if os.path.exists(path) == False:
+        os.makedirs(path)
+    for key,val in features.items():
+        np.save('%s/%s.npy' % (path,key),val)
+
+    if os.path.exists(dbfile) == True:
+        with open(dbfile,'r') as infile:
+            db=json.load(infile)
+    else:
+        db={'candidates':SearchCandidates(p,nsample,seed),'budget':SearchBudget(space_epoch,eta),'trials':{}}
+
+    def dump_db():
+        with open(dbfile,'w') as outfile:
+            json.dump(db,outfile)
+
+    dump_db()
+    candidates=db['candidates']
+    budget=db['budget']
+    alive=list(range(len(candidates)))
+
+    for rung,epoch in enumerate(budget):
+        trials=[]
+        for cid in alive:
+            if '%s-%s' % (cid,rung) in db['trials'].keys():
+                continue
+            if rung == 0:
+                prev_weights,start=None,0
+            else:
+                prev_weights,start=db['trials']['%s-%s' % (cid,rung-1)]['weights'],budget[rung-1]
+            trials.append([path,model_name,cid,rung,start,epoch-start,candidates[cid],prev_weights])
+
+        ## start multiprocessing
+        if len(trials) > 0:
+            nproc=int(np.amax([1,np.amin([len(trials),ncpu])]))
+            pool=multiprocessing.Pool(processes=nproc,initializer=_search_init,initargs=(int(np.amax([1,multiprocessing.cpu_count()/nproc])),))
+            for val in pool.imap_unordered(_search_trial,trials):
+                cid,n,val_loss,weights=val
+                db['trials']['%s-%s' % (cid,n)]={'val_loss':val_loss,'weights':weights}
+                dump_db()
+            pool.close()
+
+        ## rank the candidates of this rung and promote the best ones
+        alive=sorted(alive,key=lambda cid: db['trials']['%s-%s' % (cid,rung)]['val_loss'])
+        if rung < len(budget)-1:
+            alive=alive[0:int(np.amax([s_win,np.ceil(len(alive)/eta)]))]
+
+        search_info="""
+  &successive halving rung %d
+-------------------------------------------------------
+  Epoch: %6d Trained: %6d Promoted: %6d
+  %5s%6s%6s%6s%20s%20s%6s%20s%16s
+""" % (rung+1,epoch,len(trials),len(alive),'No.','batch','layer','nodes','rate','decay','wait','L2reg','val_loss')
+        for j,cid in enumerate(alive):
+            c=candidates[cid]
+            search_info+='  %5d%6d%6d%6d%20.16f%20.16f%6d%20.16f%16.8f\n' % (j+1,c['batch'],c['layer'],c['nodes'],c['lr'],c['flr'],c['flrstep'],c['wl2'],db['trials']['%s-%s' % (cid,rung)]['val_loss'])
+        search_info+='\n'
+
+        log=open('%s.log' % (chkname),'a')
+        log.write(search_info)
+        log.close()
+
+    best=[]
+    for cid in alive[0:s_win]:
+        c=candidates[cid].copy()
+        c['epoch']=budget[-1]
+        c['val_loss']=db['trials']['%s-%s' % (cid,len(budget)-1)]['val_loss']
+        c['weights']=db['trials']['%s-%s' % (cid,len(budget)-1)]['weights']
+        best.append(c)
+
+    return best
+
 def RunNN(title,T,invR,variables,in_weight,group):
     ## This function run NNs
     return_data=''
@@ -410,41 +553,47 @@ def RunNN(title,T,invR,variables,in_weight,group):
     'nac': NN,
     }
 
-    invr_train=postdata['invr_train']
-    invr_val=postdata['invr_val']
-
-    y_list={
-    'eg' :[postdata['energy_train'],postdata['gradient_train']],
-    'e'  : postdata['energy_train'],
-    'g'  : postdata['gradient_train'],
-    'nac': postdata['nac_train']
+    sgm_list={
+    'invr': postdata['std_invr'],
+    'e'   : postdata['std_energy'],
+    'g'   : postdata['std_gradient'],
+    'nac' : postdata['std_nac'],
     }
 
-    y_val_list={
-    'eg' :[postdata['energy_val'],postdata['gradient_val']],
-    'e'  : postdata['energy_val'],
-    'g'  : postdata['gradient_val'],
-    'nac': postdata['nac_val'],
+    miu_list={
+    'invr': postdata['mean_invr'],
+    'e'   : postdata['mean_energy'],
+    'g'   : postdata['mean_gradient'],
+    'nac' : postdata['mean_nac'],
     }
 
-    sgm_list={
-    'invr': postdata['sgm_invr'],
-    'e'   : postdata['sgm_energy'],
-    'g'   : postdata['sgm_gradient'],
-    'nac' : postdata['sgm_nac'],
+    ## the inputs and targets are standardized as the predictions are scaled back, gradient and nac are flattened for the dense output
+    def standardize(key,field,part):
+        value=postdata['%s_%s' % (field,part)]
+        return ((value-miu_list[key])/sgm_list[key]).reshape([len(value),-1])
+
+    invr_train=standardize('invr','invr','train')
+    invr_val=standardize('invr','invr','val')
+
+    y_list={
+    'eg' :[standardize('e','energy','train'),standardize('g','gradient','train')],
+    'e'  : standardize('e','energy','train'),
+    'g'  : standardize('g','gradient','train'),
+    'nac': standardize('nac','nac','train'),
     }
 
-    miu_list={
-    'invr': postdata['miu_invr'],
-    'e'   : postdata['miu_energy'],
-    'g'   : postdata['miu_gradient'],
-    'nac' : postdata['miu_nac'],
+    y_val_list={
+    'eg' :[standardize('e','energy','val'),standardize('g','gradient','val')],
+    'e'  : standardize('e','energy','val'),
+    'g'  : standardize('g','gradient','val'),
+    'nac': standardize('nac','nac','val'),
     }
 
     ## print and save output before run NN
     run_info="""
   &nn run mode %d
 -------------------------------------------------------
+   -3 Successive halving    |
    -2 Hyperparameter search |   0 New train
    -1 Prediction            |  >0 Load weights
 """ % (in_weight)
@@ -535,6 +684,7 @@ def RunNN(title,T,invR,variables,in_weight,group):
             return_data=[e]
 
     elif in_weight == -2: # Hyperparameter search
+        import talos as ta
 
         ## wrap hyperparameter space into a dictionory. p must have the same keys as params!
         p={
@@ -645,6 +795,45 @@ def RunNN(title,T,invR,variables,in_weight,group):
             'silent'        :[silent]
             }
 
+    elif in_weight == -3: # Successive halving search
+        p={
+        'batch'         : params_space(space_batch,batch,'batch'),
+        'layer'         : params_space(space_layer,layer,'layer'),
+        'nodes'         : params_space(space_nodes,nodes,'nodes'),
+        'wl2'           : params_space(space_wl2,wl2,'wl2'),
+        'lr'            : params_space(space_lr,lr,'lr'),
+        'flr'           : params_space(space_flr,flr,'flr'),
+        'flrstep'       : params_space(space_flrstep,flrstep,'flrstep'),
+        }
+
+        ## the features are prepared once and shared by all candidates
+        features={'x_train':invr_train,'x_val':invr_val}
+        if model_name == 'eg':
+            features['y_train_e'],features['y_train_g']=y_list[model_name]
+            features['y_val_e'],features['y_val_g']=y_val_list[model_name]
+        else:
+            features['y_train']=y_list[model_name]
+            features['y_val']=y_val_list[model_name]
+
+        best=HyperSearch(chkname,model_name,p,features,nsample,space_epoch,variables[target]['s_eta'],s_win,variables['ml_ncpu'],ml_seed)
+
+        search_info="""
+  &search results
+-------------------------------------------------------
+  %5s%6s%6s%6s%6s%20s%20s%6s%20s%16s
+""" % ('No.','epoch','batch','layer','nodes','rate','decay','wait','L2reg','val_loss')
+        for j,c in enumerate(best):
+            search_info+='  %5d%6d%6d%6d%6d%20.16f%20.16f%6d%20.16f%16.8f\n' % (j+1,c['epoch'],c['batch'],c['layer'],c['nodes'],c['lr'],c['flr'],c['flrstep'],c['wl2'],c['val_loss'])
+        search_info+='\n'
+
+        log=open('%s.log' % (chkname),'a')
+        log.write(search_info)
+        log.close()
+
+        if silent == 0:
+            print(search_info)
+
+        return_data=best
 
     end=time.time()
     walltime=howlong(start,end)
@@ -759,6 +948,7 @@ def NNMODEL(variables_all,in_weight):
     T=[]
     invR=None
     title=variables_all['control']['title']
+    variables_all['nn']['ml_ncpu']=variables_all['control']['ml_ncpu']
     prediction=RunNN(title,T,invR,variables_all['nn'],in_weight=in_weight,group=None)
 
 def main():
@@ -784,7 +974,7 @@ Usage:
     parser.add_option('--mr', dest='selc_energy', type=int,   nargs=1, help='Select energy. 0 all; 1 casscf; 2 caspt2. Default is 0.',default=0)
     parser.add_option('--sl', dest='silent',    type=int,   nargs=1, help='=0 silent mode; =1 print verbose information; Default=0',default=0)
     parser.add_option('--gs', dest='ml_seed',   type=int,   nargs=1, help='Global random seed; Defualt=0',default=0)
-    parser.add_option('--iw', dest='in_weight', type=int,   nargs=1, help='Neural Network modes: -2 hyper parameter search, requres Talos; -1 predict properties; 0 new train; >0 load trained weights',default=0)
+    parser.add_option('--iw', dest='in_weight', type=int,   nargs=1, help='Neural Network modes: -3 successive halving search; -2 hyper parameter search, requres Talos; -1 predict properties; 0 new train; >0 load trained weights',default=0)
     parser.add_option('--ip', dest='import_weights', type=str,   nargs=1, help='Import weights',default=None) 
     parser.add_option('--st', dest='stat',      type=int,   nargs=1, help='Plot statistics of in_data, requres matplotlib; Defualt=0',default=0)
     parser.add_option('--nn', dest='model_name',type=str,   nargs=1, help='Type of neural network; eg - energy+gradient; nac - non-adiabatic coupling; e - energy; g - gradient', default='eg')
@@ -807,6 +997,8 @@ Usage:
     parser.add_option('--DS', dest='s_flrstep', type=int,   nargs=3, help='Random search learning rate decay waiting step, requires inital, last, and steps; Default=1 1 0',default=[1,1,0])
     parser.add_option('--NI', dest='s_iter',    type=int,   nargs=1, help='Random search iteractions; Default=1',default=1)
     parser.add_option('--WN', dest='s_win',     type=int,   nargs=1, help='Random search candidates; Defualt=4',default=4)
+    parser.add_option('--ET', dest='s_eta',     type=int,   nargs=1, help='Successive halving reduction factor; Default=3',default=3)
+    parser.add_option('--NC', dest='ml_ncpu',   type=int,   nargs=1, help='Number of parallel trials in successive halving; Default=1',default=1)
 
     (options, args) = parser.parse_args()
     if options.in_data == None:
@@ -842,12 +1034,13 @@ Usage:
     space_flrstep=options.s_flrstep
     s_iter=options.s_iter
     s_win=options.s_win
+    s_eta=options.s_eta
+    ml_ncpu=options.ml_ncpu
 
 
-    with open('%s' % in_data,'r') as indata:
-        data=json.load(indata)
+    data=LoadTrainData(in_data)
     ratio=[0.9,0.1]
-    postdata,data_info=Prepdata(data,ml_seed,ratio)
+    postdata,data_info=Prepdata(data,ml_seed,ratio,0)
 
     
     variables_nn={
@@ -856,6 +1049,7 @@ Usage:
     'data_info'   :data_info,
     'silent'      :silent,
     'ml_seed'     :ml_seed,
+    'ml_ncpu'     :ml_ncpu,
     }
 
     variables={
@@ -878,6 +1072,7 @@ Usage:
     's_flrstep'   :space_flrstep,
     's_iter'	  :s_iter,
     's_win'	  :s_win,
+    's_eta'       :s_eta,
     'weights'     :import_weights,
     'weights_list':J2LA(import_weights),
     'nn_info'     :variables_nn,
@@ -886,7 +1081,11 @@ Usage:
     T=[]
     invR=None
 
-    prediction=RunNN(title,T,invR,variables,in_weight,model_name,group=None)
+    ## RunNN reads the model variables of the target, the first model of the given type is used
+    variables_nn['target']='%s1' % (model_name)
+    variables_nn['%s1' % (model_name)]=variables
+
+    prediction=RunNN(title,T,invR,variables_nn,in_weight,group=None)
 
 if __name__ == '__main__':
-    main(usage,options)
+    main()
@@ -1,11 +1,56 @@
 ## Neural Networks interface for PyRAIMD
 ## Jingbai Li Jul 0 2020
 
-import time,datetime,json
+import time,datetime,json,os,glob,shutil,tempfile
 import numpy as np
-from tools import PermuteMap
+import tensorflow as tf
+from tools import PermuteMap,ReadPermuteMap,ReadModelParent
+from training_data import LoadTrainData,TrainingStream
 from pyNNsMD.nn_pes import NeuralNetPes
 from pyNNsMD.nn_pes_src.device import set_gpu
+from pyNNsMD.nn_pes_src.selection import get_default_scaler
+from pyNNsMD.utils.callbacks import EarlyStopping,lr_lin_reduction,lr_exp_reduction,lr_step_reduction
+
+def StoredAsDelta(path):
+    ## This function check if a model version stores its weights as the arrays changed against its parent
+    ## The full weights written by pyNNsMD are used if they are present, e.g. a retraining stopped before storing the changes
+
+    return len(glob.glob('%s/*/weights_v*.npz' % (path))) > 0 and len(glob.glob('%s/*/weights_v*.h5' % (path))) == 0
+
+def ReadModelWeights(path):
+    ## This function return the weights of a model version as {name:[list of arrays of each replica]}
+    ## A version stored as changes is resolved against its parent, the first version has the full weights
+
+    parent=ReadModelParent(path)
+    if parent == None or StoredAsDelta(path) == False:
+        models=NeuralNetPes(path).load()
+        return {name:[model.get_weights() for model in models[name]] for name in models.keys()}
+
+    weights=ReadModelWeights(parent)
+    for name in weights.keys():
+        for i in range(len(weights[name])):
+            with np.load('%s/%s/weights_v%i.npz' % (path,name,i)) as delta:
+                for key in delta.files:
+                    weights[name][i][int(key)]=delta[key]
+
+    return weights
+
+def MergeMoments(moments,value,axis):
+    ## This function merge the count, mean and sum of squared deviations of a new block into the running moments
+    ## The blocks are merged pairwise, thus the std is as accurate as computed from the whole data set
+    ## This function return [count,mean,m2], the std is sqrt(m2/count)
+
+    n=np.prod([value.shape[x] for x in axis])
+    mean=np.mean(value,axis=axis,keepdims=True)
+    m2=np.sum((value-mean)**2,axis=axis,keepdims=True)
+    if moments == None:
+        return [n,mean,m2]
+
+    n0,mean0,m20=moments
+    total=n0+n
+    delta=mean-mean0
+
+    return [total,mean0+delta*n/total,m20+m2+delta**2*n0*n/total]
 
 class DNN:
     ## This is the interface to GP
@@ -401,6 +446,9 @@ class DNN:
         self.shuffle    = variables['shuffle']
         self.eg_unit    = variables['eg_unit']
         self.nac_unit   = variables['nac_unit']
+        self.fused      = variables['fused']
+        self.precision  = variables['precision']
+        self.stream     = variables['stream']
 
         ## retraining has some bug at the moment, do not use
         if self.train_mode not in ['training','retraining','resample']:
@@ -411,7 +459,6 @@ class DNN:
         else:
             self.name   = f"NN-{title}-{id}"
         self.silent     = variables['silent']
-        self.x          = data['xyz'][:,:,1:].astype(float)
 
         ## convert unit of energy and force. au or si. data are in au.
         if self.eg_unit == 'si':
@@ -437,16 +484,28 @@ class DNN:
 
         ## combine y_dict
         self.y_dict = {}
-        if nn_eg_type > 0:
-            y_energy = data['energy']*self.H_to_eV
-            y_grad   = data['gradient']*self.H_Bohr_to_eV_A
-            self.y_dict['energy_gradient'] = [y_energy,y_grad]
-        if nn_nac_type > 0:
-            y_nac    = data['nac']/self.Bohr_to_A
-            self.y_dict['nac'] = y_nac
+        if self.stream == 1 and self.train_mode != 'resample':
+            ## the training data are read from the storage in batches when the training starts
+            ## resampling is done by pyNNsMD on the whole data set, thus it loads the data as usual
+            self.x              = None
+            self.stream_data    = variables['data']
+            self.stream_index   = np.concatenate((data['index_train'],data['index_val'],data['index_test']))
+            self.stream_keys    = [key for key,nn_type in zip(['energy_gradient','nac'],[nn_eg_type,nn_nac_type]) if nn_type > 0]
+            self.stream_permute = ReadPermuteMap(permute)
+            self.stream_buffer  = variables['shuffle_buffer']
+            self.stream_seed    = seed
+        else:
+            self.x = np.array(data['coord'])
+            if nn_eg_type > 0:
+                y_energy = data['energy']*self.H_to_eV
+                y_grad   = data['gradient']*self.H_Bohr_to_eV_A
+                self.y_dict['energy_gradient'] = [y_energy,y_grad]
+            if nn_nac_type > 0:
+                y_nac    = data['nac']/self.Bohr_to_A
+                self.y_dict['nac'] = y_nac
 
-        ## check permuation map
-        self.x,self.y_dict = PermuteMap(self.x,self.y_dict,permute,seed)
+            ## check permuation map
+            self.x,self.y_dict = PermuteMap(self.x,self.y_dict,permute,seed)
 
         ## combine hypers
         self.hyper = {}
@@ -476,9 +535,10 @@ class DNN:
 
         ## initialize model
         if   modeldir == None or id not in [None,1]:
-            self.model = NeuralNetPes(self.name)
+            self.modeldir = self.name
         else:
-            self.model = NeuralNetPes(modeldir)
+            self.modeldir = modeldir
+        self.model = NeuralNetPes(self.modeldir)
 
     def _heading(self):
 
@@ -508,7 +568,10 @@ class DNN:
 
         start=time.time()
 
-        self.model.create(self.hyper)
+        models=self.model.create(self.hyper)
+
+        if self.train_mode == 'retraining':
+            self._load_parent(models)
 
         topline='Neural Networks Start: %20s\n%s' % (self._whatistime(),self._heading())
         runinfo="""\n  &nn fitting \n"""
@@ -525,7 +588,10 @@ class DNN:
         if self.train_mode == 'resample':
             out_index,out_errr,out_fiterr,out_testerr=self.model.resample(self.x,self.y_dict,gpu_dist=self.gpu_list,proc_async=self.ncpu>=4)
         else:
-            ferr=self.model.fit(self.x,self.y_dict,gpu_dist=self.gpu_list,proc_async=self.ncpu>=4,fitmode=self.train_mode,random_shuffle=self.shuffle)
+            if self.stream == 1:
+                ferr=self._train_stream(models)
+            else:
+                ferr=self.model.fit(self.x,self.y_dict,gpu_dist=self.gpu_list,proc_async=self.ncpu>=4,fitmode=self.train_mode,random_shuffle=self.shuffle)
             print(ferr)
             #self.model.save()
             err_eg1=ferr['energy_gradient'][0]
@@ -545,6 +611,9 @@ class DNN:
 
 """ % (err_eg1[0]*self.keep_eV, err_eg1[1]*self.keep_eVA, err_n[0]/self.keep_A ,err_eg2[0]*self.keep_eV, err_eg2[1]*self.keep_eVA, err_n[1]/self.keep_A)
 
+            if self.train_mode == 'retraining':
+                self._store_delta()
+
         end=time.time()
         walltime=self._howlong(start,end)
         endline='Neural Networks End: %20s Total: %20s\n' % (self._whatistime(),walltime)
@@ -560,11 +629,353 @@ class DNN:
 
         return self
 
+    def _train_stream(self,models):
+        ## This function train the models on batches read from the training data storage
+        ## pyNNsMD fits each replica in a subprocess on the whole data set, here the replicas are fitted in turn from the data stream
+        ## The scalers, feature normalization, losses and callbacks follow the pyNNsMD fit scripts
+        ## This function return the validation mean absolute errors in the same format as pyNNsMD fit
+
+        mode=self.train_mode
+        scale={'energy':self.H_to_eV,'gradient':self.H_Bohr_to_eV_A,'nac':1/self.Bohr_to_A}
+        scalers={}
+        ferr={}
+        for key in self.stream_keys:
+            hyper=self.hyper[key]
+            if isinstance(hyper,list) == False:
+                hyper=[hyper for x in models[key]]
+            scalers[key]=[]
+            ferr[key]=[]
+            for i,model in enumerate(models[key]):
+                hyp=hyper[i][mode]
+
+                ## the validation entries are picked before the permutation, thus no permuted copy of them is trained
+                index=np.random.default_rng([self.stream_seed,i]).permutation(self.stream_index)
+                nval=int(len(index)*hyp['val_split'])
+                train=TrainingStream(self.stream_data,index[nval:],self.stream_permute,scale,self.stream_buffer,self.stream_seed+i)
+                val=TrainingStream(self.stream_data,index[0:nval],None,scale,self.stream_buffer,self.stream_seed+i)
+
+                scaler=self._stream_scaler(train,key,hyper[i])
+                self._stream_feature(model,train,scaler,hyp)
+                val_data=None
+                if nval > 0:
+                    val_data=self._stream_dataset(val,key,scaler,hyp['batch_size'])
+
+                callbacks=[]
+                if hyp['early_callback']['use'] == True:
+                    callbacks.append(EarlyStopping(**hyp['early_callback']))
+                if hyp['linear_callback']['use'] == True:
+                    callbacks.append(tf.keras.callbacks.LearningRateScheduler(lr_lin_reduction(**hyp['linear_callback'])))
+                if hyp['exp_callback']['use'] == True:
+                    callbacks.append(tf.keras.callbacks.LearningRateScheduler(lr_exp_reduction(**hyp['exp_callback'])))
+                if hyp['step_callback']['use'] == True:
+                    callbacks.append(tf.keras.callbacks.LearningRateScheduler(lr_step_reduction(**hyp['step_callback'])))
+
+                if key == 'energy_gradient':
+                    loss=['mean_squared_error','mean_squared_error']
+                    model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=hyp['learning_rate']),loss=loss,loss_weights=hyp['loss_weights'])
+                else:
+                    loss='mean_squared_error'
+                    model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=hyp['learning_rate']),loss=loss)
+
+                    ## the phase-less loss starts from a fit with the plain loss as in pyNNsMD
+                    if hyp['phase_less_loss'] == True:
+                        from pyNNsMD.utils.loss import NACphaselessLoss
+                        if hyp['pre_epo'] > 0:
+                            model.fit(self._stream_dataset(train,key,scaler,hyp['batch_size']),epochs=hyp['pre_epo'],verbose=0)
+                        loss=NACphaselessLoss(number_state=hyper[i]['model']['states'],shape_nac=(self.stream_data.natom,3))
+                        model.compile(optimizer=model.optimizer,loss=loss)
+
+                model.fit(self._stream_dataset(train,key,scaler,hyp['batch_size']),epochs=hyp['epo'],callbacks=callbacks,
+                    validation_data=val_data,validation_freq=hyp['epostep'],verbose=0)
+
+                scalers[key].append(scaler)
+                ferr[key].append(self._stream_error(model,val,key,scaler,hyp['batch_size']))
+
+        ## pyNNsMD writes the default scalers, they are replaced by the fitted ones
+        self.model.save()
+        for key in scalers.keys():
+            for i,scaler in enumerate(scalers[key]):
+                scaler.save('%s/%s/scaler_v%i.json' % (self.modeldir,key,i))
+
+        return ferr
+
+    def _stream_scaler(self,stream,key,hyper):
+        ## This function fit the scaler of a model to the training data stream
+        ## The moments are merged block by block, the parameters are the same as pyNNsMD fits to the whole data set
+
+        auto_scale=hyper[self.train_mode]['auto_scaling']
+        npeps=np.finfo(float).eps
+        if key == 'energy_gradient':
+            fields={'coord':(0,1,2),'energy':(0,)}
+        else:
+            fields={'coord':(0,1,2),'nac':(0,3)}
+
+        moments={x:None for x in fields.keys()}
+        for block in stream:
+            for field,axis in fields.items():
+                moments[field]=MergeMoments(moments[field],block[field],axis)
+
+        std={field:np.sqrt(m2/n) for field,(n,mean,m2) in moments.items()}
+        scaler=get_default_scaler(hyper['general']['model_type'])
+        if auto_scale['x_mean'] == True:
+            scaler.x_mean=moments['coord'][1]
+        if auto_scale['x_std'] == True:
+            scaler.x_std=std['coord']+npeps
+
+        if key == 'energy_gradient':
+            if auto_scale['energy_mean'] == True:
+                scaler.energy_mean=moments['energy'][1]
+            if auto_scale['energy_std'] == True:
+                scaler.energy_std=std['energy']+npeps
+            scaler.gradient_std=scaler.energy_std[...,np.newaxis,np.newaxis]/scaler.x_std+npeps
+            scaler.gradient_mean=np.zeros_like(scaler.gradient_std)
+        elif auto_scale['nac_std'] == True:
+            scaler.nac_std=std['nac']+npeps
+            scaler.nac_mean=np.zeros_like(scaler.nac_std)
+
+        return scaler
+
+    def _stream_feature(self,model,stream,scaler,hyper):
+        ## This function set the feature normalization of a model from the features of the training data stream
+        ## mode 1 normalizes each feature, mode 2 each type of feature, other modes keep the current normalization
+
+        normalization_mode=int(hyper['normalization_mode'])
+        if normalization_mode not in [1,2]:
+            return self
+
+        moments=None
+        for block in stream:
+            x,y=scaler.transform(x=block['coord'])
+            feat=model.get_layer('feat_geo')(tf.constant(x,dtype=tf.keras.backend.floatx())).numpy()
+            moments=MergeMoments(moments,feat.astype(float),(0,))
+
+        n,feat_mean,feat_m2=moments
+        if normalization_mode == 2:
+            segment=np.cumsum([0]+model.get_layer('feat_geo').get_feature_type_segmentation())
+            for a,b in zip(segment[:-1],segment[1:]):
+                mean=np.mean(feat_mean[:,a:b])
+                feat_m2[:,a:b]=np.sum(feat_m2[:,a:b])+n*np.sum((feat_mean[:,a:b]-mean)**2)
+                feat_m2[:,a:b]/=b-a
+                feat_mean[:,a:b]=mean
+
+        model.get_layer('feat_std').set_weights([feat_mean,np.sqrt(feat_m2/n)])
+
+        return self
+
+    def _stream_dataset(self,stream,key,scaler,batch_size):
+        ## This function return a dataset yielding the scaled batches of a model from the training data stream
+        ## Each epoch starts a new pass over the stream, thus the entries are shuffled differently in every epoch
+
+        natom=self.stream_data.natom
+        nstate=self.stream_data.nstate
+        npair=int(nstate*(nstate-1)/2)
+        dtype=tf.keras.backend.floatx()
+
+        if key == 'energy_gradient':
+            signature=(tf.TensorSpec((None,natom,3),dtype),(tf.TensorSpec((None,nstate),dtype),tf.TensorSpec((None,nstate,natom,3),dtype)))
+        else:
+            signature=(tf.TensorSpec((None,natom,3),dtype),tf.TensorSpec((None,npair,natom,3),dtype))
+
+        def batches():
+            for batch in stream.batches(batch_size):
+                if key == 'energy_gradient':
+                    x,y=scaler.transform(x=batch['coord'],y=[batch['energy'],batch['gradient']])
+                    yield x.astype(dtype),(y[0].astype(dtype),y[1].astype(dtype))
+                else:
+                    x,y=scaler.transform(x=batch['coord'],y=batch['nac'])
+                    yield x.astype(dtype),y.astype(dtype)
+
+        return tf.data.Dataset.from_generator(batches,output_signature=signature).prefetch(1)
+
+    def _stream_error(self,model,stream,key,scaler,batch_size):
+        ## This function compute the mean absolute error of a model on the validation stream in the unit of the training data
+        ## This function return [energy,gradient] or nac as pyNNsMD fit
+
+        err=np.zeros(2)
+        size=np.zeros(2)
+        for batch in stream.batches(batch_size):
+            x,y=scaler.transform(x=batch['coord'])
+            y_pred=model(tf.constant(x,dtype=tf.keras.backend.floatx()))
+            if key == 'energy_gradient':
+                x,y_pred=scaler.inverse_transform(y=[np.array(y_pred[0]),np.array(y_pred[1])])
+                err+=[np.sum(np.abs(y_pred[0]-batch['energy'])),np.sum(np.abs(y_pred[1]-batch['gradient']))]
+                size+=[batch['energy'].size,batch['gradient'].size]
+            else:
+                x,y_pred=scaler.inverse_transform(y=np.array(y_pred))
+                err+=[np.sum(np.abs(y_pred-batch['nac'])),0]
+                size+=[batch['nac'].size,1]
+
+        err=err/np.amax([size,np.ones(2)],axis=0)
+        if key == 'energy_gradient':
+            return err.tolist()
+        else:
+            return err[0]
+
+    def _load_parent(self,models):
+        ## This function initialize the weights from the parent version of the model as a warm start
+        ## pyNNsMD saves the models before fitting, thus the parent weights become the initial guess of retraining
+        ## the scalers are refitted to the new training data by pyNNsMD
+
+        parent=ReadModelParent(self.modeldir)
+        if parent == None:
+            return self
+
+        parent_weights=ReadModelWeights(parent)
+        for name in models.keys():
+            for i,model in enumerate(models[name]):
+                model.set_weights(parent_weights[name][i])
+
+        return self
+
+    def _store_delta(self):
+        ## This function replace the weights of a retrained version with the arrays changed against its parent
+        ## The unchanged arrays are resolved from the parent on load, the hyperparameters and scalers are kept as they are
+        ## A version with a different architecture than its parent keeps the full weights
+
+        parent=ReadModelParent(self.modeldir)
+        if parent == None:
+            return self
+
+        parent_weights=ReadModelWeights(parent)
+        weights=ReadModelWeights(self.modeldir)
+        for name in weights.keys():
+            for i,new in enumerate(weights[name]):
+                old=parent_weights[name][i]
+                if len(new) != len(old) or np.any([x.shape != y.shape for x,y in zip(new,old)]):
+                    return self
+
+        for name in weights.keys():
+            for i,new in enumerate(weights[name]):
+                old=parent_weights[name][i]
+                changed={'%s' % (n):x for n,(x,y) in enumerate(zip(new,old)) if np.array_equal(x,y) == False}
+                np.savez('%s/%s/weights_v%i.npz' % (self.modeldir,name,i),**changed)
+        for name in weights.keys():
+            for i in range(len(weights[name])):
+                os.remove('%s/%s/weights_v%i.h5' % (self.modeldir,name,i))
+
+        return self
+
+    def _load_delta(self):
+        ## This function restore the full weights of a version stored as changes in a temporary directory and load it
+        ## The hyperparameters and scalers are copied from the version, the temporary directory is removed after loading
+
+        weights=ReadModelWeights(self.modeldir)
+        tmpdir=tempfile.mkdtemp(prefix='%s-' % (os.path.basename(os.path.abspath(self.modeldir))))
+        model=NeuralNetPes(tmpdir)
+        for name,models in model.create(self.hyper).items():
+            for i,replica in enumerate(models):
+                replica.set_weights(weights[name][i])
+        model.save()
+        for name in weights.keys():
+            for i in range(len(weights[name])):
+                for file in ['hyper_v%i.json' % (i),'scaler_v%i.json' % (i)]:
+                    shutil.copyfile('%s/%s/%s' % (self.modeldir,name,file),'%s/%s/%s' % (tmpdir,name,file))
+
+        self.model=NeuralNetPes(tmpdir)
+        models=self.model.load()
+        shutil.rmtree(tmpdir)
+
+        return models
+
     def load(self):
-        self.model.load()
+        ## a version stored as changes against its parent is restored before loading
+        if StoredAsDelta(self.modeldir) == True:
+            models=self._load_delta()
+        else:
+            models=self.model.load()
+
+        if self.fused == 1:
+            self._build_fused(models)
+
+        return self
+
+    def _build_fused(self,models):
+        ## This function trace all replicas of all models into one graph for single geometry prediction
+        ## The scalers and unit conversions are folded into constants, the ensemble mean and std are computed in the graph
+        ## The coordinates are copied to a preallocated buffer, thus an MD step only assigns the buffer and runs the graph
+        ## The models are returned by load and the scalers are read from their files with the scaler of each model type
+
+        dtype=tf.float32 if self.precision == 'float32' else tf.float64
+        unit={
+            'energy_gradient' : [1/self.H_to_eV,1/self.H_Bohr_to_eV_A],
+            'nac'             : [self.Bohr_to_A],
+            }
+
+        graph={}
+        for name in models.keys():
+            graph[name]=[]
+            hyper=self.hyper[name]
+            if isinstance(hyper,list) == False:
+                hyper=[hyper for x in models[name]]
+            for i,model in enumerate(models[name]):
+                scaler=get_default_scaler(hyper[i]['general']['model_type'])
+                scaler.load('%s/%s/scaler_v%i.json' % (self.modeldir,name,i))
+                param=scaler.get_params()
+                if name == 'nac':
+                    scale,shift=[param['nac_std']],[param['nac_mean']]
+                else:
+                    scale,shift=[param['energy_std'],param['gradient_std']],[param['energy_mean'],0]
+                graph[name].append([
+                    model,
+                    tf.constant(np.array(param['x_mean']),dtype=dtype),
+                    tf.constant(np.array(param['x_std']),dtype=dtype),
+                    [tf.constant(np.array(x)*u,dtype=dtype) for x,u in zip(scale,unit[name])],
+                    [tf.constant(np.array(x)*u,dtype=dtype) for x,u in zip(shift,unit[name])],
+                    ])
+
+        self._xbuf=np.zeros([1,self.natom,3],dtype=dtype.as_numpy_dtype)
+        self._xvar=tf.Variable(self._xbuf,trainable=False)
+        self._nac_zero=np.zeros([1,int(self.nstate*(self.nstate-1)/2),self.natom,3])
+
+        @tf.function
+        def fused():
+            y_pred,y_std={},{}
+            for name,replicas in graph.items():
+                out=[]
+                for model,x_mean,x_std,scale,shift in replicas:
+                    y=model(tf.cast((self._xvar-x_mean)/x_std,model.dtype),training=False)
+                    if isinstance(y,(list,tuple)) == False:
+                        y=[y]
+                    out.append([tf.cast(v,dtype)*a+b for v,a,b in zip(y,scale,shift)])
+
+                ## same as pyNNsMD, the std of the replicas uses ddof=1
+                y_pred[name],y_std[name]=[],[]
+                for v in zip(*out):
+                    v=tf.stack(v)
+                    mean=tf.reduce_mean(v,axis=0)
+                    if len(out) > 1:
+                        std=tf.sqrt(tf.reduce_sum((v-mean)**2,axis=0)/(len(out)-1))
+                    else:
+                        std=tf.zeros_like(mean)
+                    y_pred[name].append(tf.cast(mean,tf.float64))
+                    y_std[name].append(tf.cast(std,tf.float64))
+
+            return y_pred,y_std
+
+        self._fused=fused
+
+        ## trace the graph once, the first MD step does not pay for it
+        self._fused()
 
         return self
 
+    def _convert(self,y_pred,y_std):
+        ## This function convert the predictions of pyNNsMD to atomic unit
+
+        e_pred=y_pred['energy_gradient'][0]/self.H_to_eV
+        g_pred=y_pred['energy_gradient'][1]/self.H_Bohr_to_eV_A
+        e_std=y_std['energy_gradient'][0]/self.H_to_eV 
+        g_std=y_std['energy_gradient'][1]/self.H_Bohr_to_eV_A
+        if 'nac' in y_pred.keys():
+            n_pred=y_pred['nac']*self.Bohr_to_A
+            n_std=y_std['nac']*self.Bohr_to_A
+        else:
+            entry=len(e_pred)
+            n_pred=np.zeros([entry,int(self.nstate*(self.nstate-1)/2),self.natom,3])
+            n_std=np.zeros([entry,int(self.nstate*(self.nstate-1)/2),self.natom,3])
+
+        return e_pred,g_pred,n_pred,e_std,g_std,n_std
+
     def	appendix(self,addons):
        	## fake	function does nothing
 
@@ -576,29 +987,33 @@ class DNN:
         ##            Prediction and std, share the same keys as y_dict
 
         if x == None:
-            with open('%s' % self.pred_data,'r') as preddata:
-                pred=json.load(preddata)
-            pred_natom,pred_nstate,pred_xyz,pred_invr,pred_energy,pred_gradient,pred_nac,pred_ci,pred_mo=pred
-            x=np.array(pred_xyz)[:,:,1:].astype(float)
+            pred=LoadTrainData(self.pred_data)
+            pred_energy=pred.get('energy')
+            pred_gradient=pred.get('gradient')
+            pred_nac=pred.get('nac')
+            x=np.array(pred.get('coord'))
             y_pred,y_std=self.model.predict(x)
+            e_pred,g_pred,n_pred,e_std,g_std,n_std=self._convert(y_pred,y_std)
             entry=len(x)
+        elif self.fused == 1:
+            self._xbuf[0]=np.array(x)[:,1:4]
+            self._xvar.assign(self._xbuf)
+            y_pred,y_std=self._fused()
+            e_pred,g_pred=[v.numpy() for v in y_pred['energy_gradient']]
+            e_std,g_std=[v.numpy() for v in y_std['energy_gradient']]
+            if 'nac' in y_pred.keys():
+                n_pred,n_std=y_pred['nac'][0].numpy(),y_std['nac'][0].numpy()
+            else:
+                n_pred,n_std=self._nac_zero,self._nac_zero
+            x=self._xbuf
+            entry=1
         else:
             atoms=len(x)
             x=np.array(x)[:,1:4].reshape([1,atoms,3]).astype(float)
             y_pred,y_std=self.model.call(x)
+            e_pred,g_pred,n_pred,e_std,g_std,n_std=self._convert(y_pred,y_std)
             entry=1
 
-        e_pred=y_pred['energy_gradient'][0]/self.H_to_eV
-        g_pred=y_pred['energy_gradient'][1]/self.H_Bohr_to_eV_A
-        e_std=y_std['energy_gradient'][0]/self.H_to_eV 
-        g_std=y_std['energy_gradient'][1]/self.H_Bohr_to_eV_A
-        if 'nac' in y_pred.keys():
-            n_pred=y_pred['nac']*self.Bohr_to_A
-            n_std=y_std['nac']*self.Bohr_to_A
-        else:
-            n_pred=np.zeros([entry,int(self.nstate*(self.nstate-1)/2),self.natom,3])
-            n_std=np.zeros([entry,int(self.nstate*(self.nstate-1)/2),self.natom,3])
-
         if entry > 1 and self.silent == 0:
             de=np.abs(np.array(pred_energy)   - e_pred)
             dg=np.abs(np.array(pred_gradient) - g_pred)
@@ -1,167 +1,88 @@
 ## Velocity rest tool for PyRAIMD
 ## Feb 21 2021 Jingbai Li
+## All functions take a single geometry in shape of (natom,3) or an ensemble in shape of (ntraj,natom,3)
+## The masses are in shape of (natom,1) or (ntraj,natom,1), the ensemble can share the masses in shape of (natom,1)
 
 import numpy as np
 from numpy import linalg as la
 
-def kabsch(P,Q):
-    ## This function use Kabsch algorithm to reduce RMSD by rotation
-
-    C = np.dot(np.transpose(P), Q)
-    V, S, W = np.linalg.svd(C)
-    d = (np.linalg.det(V) * np.linalg.det(W)) < 0.0
-    if d:                    # ensure right-hand system
-        S[-1] = -S[-1]
-        V[:, -1] = -V[:, -1]
-    U = np.dot(V, W)
-    P = np.dot(P, U)
-    diff = P-Q
-    N = len(P)
-    return np.sqrt((diff * diff).sum() / N)
-
-def CheckMirror(coord,I):
-    coord1=np.dot(coord,I)
-    coord2=np.dot(coord,-I)
-    rmsd1=kabsch(coord,coord1)
-    rmsd2=kabsch(coord,coord2)
-
-    if rmsd1 <= rmsd2:
-        Im=I
-    else:
-        Im=-I
-
-    return Im
-
-def Inertia(xyz,M):
-    ## this function compute momentum of intertia as principal axis
-
-    natom=len(xyz)
-    com=np.sum(M*xyz,axis=0)/np.sum(M)
-    body=xyz-com
-
-    ## initialize momentum of inertia (3x3)
-    I=np.zeros([3,3])
-
-    ## compute momentum of inertia
-    for n,i in enumerate(body):
-        I+=M[n][0]*(np.sum(i**2)*np.diag(np.ones(3))-np.outer(i,i))
-
-    ## compute principal axis
-    eigval,eigvec=np.linalg.eig(I)
-    prin_axis=CheckMirror(xyz,eigvec)
-    cart_axis=la.inv(prin_axis)
-
-    return com,prin_axis,cart_axis
-
 def GetCOM(xyz,M):
-    ## This function compute velocity center of mass
+    ## This function compute center of mass
 
-    ccom=np.sum(M*xyz,axis=0)/np.sum(M)
+    com=np.sum(M*xyz,axis=-2)/np.sum(M,axis=-2)
 
     return com
 
 def GetVCOM(velo,M):
     ## This function compute velocity at center of mass
 
-    vcom=np.sum(M*velo,axis=0)/np.sum(M)
+    vcom=np.sum(M*velo,axis=-2)/np.sum(M,axis=-2)
 
     return vcom
 
 def RmVCOM(velo,vcom):
     ## This function remove velocity at center of mass from velocity on each atom
 
-    new_velo=velo-vcom
+    new_velo=velo-vcom[..., None, :]
 
     return new_velo
 
-def GetWCOM(xyz,velo,M):
-    ## This function compute angular velocity about momentum of inertia as principal axis
-    ## xyz and velo are projected to principal axis
+def Inertia(body,M):
+    ## This function compute momentum of intertia tensor of the coordinates relative to center of mass
 
-    ## inital average angular velocity matrix and average momentum of inertia
-    wcom=np.zeros(3)
-    J=np.zeros([3,3])
+    r2=np.sum(M*body**2,axis=(-2,-1))
+    I=r2[..., None, None]*np.eye(3)-np.einsum('...ax,...ay->...xy',M*body,body)
 
-    ## compute angular velocity and momentum of inertia
-    for n,i in enumerate(xyz):
-        w=np.cross(i,velo[n])/np.sum(i**2)
-        j=M[n][0]*(np.sum(i**2)*np.diag(np.ones(3))-np.outer(i,i))
-        wcom+=np.dot(j,w)
-        J+=j
+    return I
 
-    wcom=np.dot(la.inv(J),wcom)
+def GetWCOM(body,velo,M):
+    ## This function compute angular velocity at center of mass
+    ## The angular velocity is solved from angular momentum L = I w
+    ## The pseudo inverse of I also covers the linear molecules
 
-    return wcom
+    L=np.sum(M*np.cross(body,velo),axis=-2)
+    I=Inertia(body,M)
+    wcom=np.einsum('...xy,...y->...x',la.pinv(I),L)
 
-def RmWCOM(xyz,velo,wcom,cart_axis):
-    ## This function removes angular velocity about momentum of inertia as principal axis from velocity on each atom
-    ## xyz and velo are	projected to principal axis
-    ## new_vele is projected back to reference axis
+    return wcom
 
-    new_velo=[]
-    for n,i in enumerate(velo):
-        linear=np.cross(wcom,xyz[n])
-        radial=i-linear
-        new_velo.append(radial)
+def RmWCOM(body,velo,wcom):
+    ## This function removes angular velocity at center of mass from velocity on each atom
 
-    new_velo=np.array(new_velo)
-    new_velo=np.dot(new_velo,cart_axis)
+    new_velo=velo-np.cross(wcom[..., None, :],body)
 
     return new_velo
 
-def ResetVelo(traj):
+def ResetVeloBatch(xyz,velo,M,test=0):
     ## This function remove translation and rotation velocity at center of mass
+    ## The new velocity is scaled to conserve kinetic energy of each geometry
 
-    iter = traj['iter']     # current MD step
-    xyz  = traj['R']        # cartesian coordiante in angstrom (Nx3)
-    velo = traj['V']        # velocity in Eh/Bohr (Nx3)
-    M    = traj['M']        # mass matrix in ams unit (Nx1)
-    GD   = traj['graddesc'] # gradient descent
-    test = 0                # debug mode
-
-    ## in gradient descent, do not reset velocity since they are zero
-    if GD == 1:
-        return velo
-
-    ## find center of mass and momentum of inertia as principal axis
-    ## then project velocity and position vector to principal axis system
-    com,paxis,caxis=Inertia(xyz,M)
-    pvelo=np.dot(velo,paxis)
-    pxyz=np.dot(xyz-com,paxis)
+    xyz =np.asarray(xyz,dtype=float)
+    velo=np.asarray(velo,dtype=float)
+    M   =np.asarray(M,dtype=float).reshape((-1,1)) if np.ndim(M) == 1 else np.asarray(M,dtype=float)
 
     ## find the translation and augular velocity at center of mass
+    body=xyz-GetCOM(xyz,M)[..., None, :]
     vcom=GetVCOM(velo,M)
-    wcom=GetWCOM(pxyz,pvelo,M)
 
-    ## first remove the translation with un-projected velocity
+    ## first remove the translation, then remove the rotation of the new velocity
     velo1=RmVCOM(velo,vcom)
-    vcom1=GetVCOM(velo1,M)
-
-    ## then project the new velocity to principal axis system
-    ## find the angular velocity then remove it
-    pvel1=np.dot(velo1,paxis)
-    wcom1=GetWCOM(pxyz,pvel1,M)
-    velo2=RmWCOM(pxyz,pvel1,wcom1,caxis)
+    wcom1=GetWCOM(body,velo1,M)
+    velo2=RmWCOM(body,velo1,wcom1)
 
     ## compute kinetic energy for original, translation removed, and translation/rotation removed velocity
-    K1=0.5*np.sum(M*velo**2)
-    K2=0.5*np.sum(M*velo1**2)
-    K3=0.5*np.sum(M*velo2**2)
+    K1=0.5*np.sum(M*velo**2,axis=(-2,-1))
+    K2=0.5*np.sum(M*velo1**2,axis=(-2,-1))
+    K3=0.5*np.sum(M*velo2**2,axis=(-2,-1))
 
     ## scale the new velocty to conserve kinetic energy
-    velo_noTR=velo2*(K1/K3)**0.5
+    velo_noTR=velo2*np.sqrt(K1/K3)[..., None, None]
 
     if test == 1:
+        wcom=GetWCOM(body,velo,M)
+        vcom1=GetVCOM(velo1,M)
         vcom2=GetVCOM(velo2,M)
-        pvel2=np.dot(velo2,paxis)
-        wcom2=GetWCOM(pxyz,pvel2,M)
-
-        #print('Original')
-        #print('Principla axis')
-        #print(paxis)
-        #print('Cartesian axis')
-        #print(caxis)
-        print('Iter: ', iter)
+        wcom2=GetWCOM(body,velo2,M)
         print('Original: VCOM ',vcom, 'WCOM ', wcom,  'K ', K1)
         print('Rm Trans: VCOM ',vcom1,'WCOM ', wcom1, 'K ', K2)
         print('Rm Tr\Rr: VCOM ',vcom2,'WCOM ', wcom2, 'K ', K3)
@@ -169,3 +90,23 @@ def ResetVelo(traj):
 
     return velo_noTR
 
+def ResetVelo(traj):
+    ## This function remove translation and rotation velocity at center of mass
+
+    iter = traj['iter']     # current MD step
+    xyz  = traj['R']        # cartesian coordiante in angstrom (Nx3)
+    velo = traj['V']        # velocity in Eh/Bohr (Nx3)
+    M    = traj['M']        # mass matrix in ams unit (Nx1)
+    GD   = traj['graddesc'] # gradient descent
+    test = 0                # debug mode
+
+    ## in gradient descent, do not reset velocity since they are zero
+    if GD == 1:
+        return velo
+
+    if test == 1:
+        print('Iter: ', iter)
+
+    velo_noTR=ResetVeloBatch(xyz,velo,M,test=test)
+
+    return velo_noTR
@@ -4,7 +4,8 @@
 
 import os
 import time,datetime,json
-from periodic_table import Element
+from periodic_table import AtomMass
+from featurizer import GetInvR
 import numpy as np
 
 def whatistime():
@@ -60,12 +61,10 @@ def Readcoord(title):
     file=open('%s.xyz'% (title)).read().splitlines()
     natom=int(file[0])
     xyz=[]
-    mass=np.zeros((natom,1))
     for i,line in enumerate(file[2:2+natom]):
         e,x,y,z=line.split()
         xyz.append([e,x,y,z])
-        m=Element(e).getMass()
-        mass[i,0:1]=m*1822.8852
+    mass=AtomMass([x[0] for x in xyz]).reshape((natom,1))*1822.8852
 
     return xyz,mass
 
@@ -78,13 +77,11 @@ def Readinitcond(trvm):
     natom=len(trvm)
     xyz=[]
     velo=np.zeros((natom,3))
-    mass=np.zeros((natom,1))
     for i,line in enumerate(trvm):
         e,x,y,z,vx,vy,vz,m,chrg=line
         xyz.append([e,x,y,z])
-        m=Element(e).getMass()
         velo[i,0:3]=float(vx),float(vy),float(vz)
-        mass[i,0:1]=float(m)*1822.8852
+    mass=AtomMass([x[0] for x in xyz]).reshape((natom,1))*1822.8852
     
     return xyz,mass,velo    
 
@@ -110,21 +107,6 @@ def Markatom(xyz,marks,prog):
 
     return new_xyz
 
-def GetInvR(R):
-    ## This functoin convert coordinates to inverse R matrix
-    ## This function is only used for interfacing with PyRAIMD
-
-    invr=[]
-    q=R[1:]
-    for atom1 in R:
-        for atom2 in q:
-            d=np.sum((atom1-atom2)**2)**0.5
-            invr.append(1/d)
-        q=q[1:]
-
-    invr=np.array(invr)
-    return invr
-
 def Read_angle_index(var,n):
     ## This function read angle index from input or a file
 
@@ -144,6 +126,58 @@ def Read_angle_index(var,n):
 
     return angle_list.tolist()
 
+def AppendAdaptiveLog(title,iter,record):
+    ## This function append the record of one adaptive sampling iteration to title.adaptive.jsonl
+    ## Each iteration is written as one line of json, the previous iterations are never read back
+    ## The first iteration starts a new file
+    ## A line left incomplete by a crash is closed first, thus the new record stays on its own line
+
+    logpath=os.getcwd()
+    logfile='%s/%s.adaptive.jsonl' % (logpath,title)
+    if iter == 1:
+        mode='w'
+    else:
+        mode='a'
+    newline=''
+    if mode == 'a' and os.path.exists(logfile) == True and os.path.getsize(logfile) > 0:
+        with open(logfile,'rb') as infile:
+            infile.seek(-1,os.SEEK_END)
+            if infile.read(1) != b'\n':
+                newline='\n'
+    line=json.dumps({'iter':iter,**record})
+    with open(logfile,mode) as outfile:
+        outfile.write('%s%s\n' % (newline,line))
+
+def ReadAdaptiveLog(title,iter=None):
+    ## This function read the adaptive sampling history back from title.adaptive.jsonl
+    ## This function yield one record per iteration as a dict, or only the record of iter if given
+    ## An iteration rerun after a restart is appended again, thus only the last record of each iteration is kept
+    ## The old title.adaptive.json is read as a fallback
+
+    logpath=os.getcwd()
+    if os.path.exists('%s/%s.adaptive.jsonl' % (logpath,title)) == True:
+        history={}
+        with open('%s/%s.adaptive.jsonl' % (logpath,title),'r') as infile:
+            for line in infile:
+                line=line.strip()
+                if len(line) == 0:
+                    continue
+                try:
+                    record=json.loads(line)
+                except json.decoder.JSONDecodeError:
+                    continue  # the line was not completely written
+                if iter == None or record['iter'] == iter:
+                    history[record['iter']]=record
+        for key in sorted(history.keys()):
+            yield history[key]
+
+    elif os.path.exists('%s/%s.adaptive.json' % (logpath,title)) == True:
+        with open('%s/%s.adaptive.json' % (logpath,title),'r') as infile:
+            history=json.load(infile)
+        for key in sorted(history.keys(),key=int):
+            if iter == None or int(key) == iter:
+                yield {'iter':int(key),**history[key]}
+
 def Checkpoint(traj):
     ## obsolete
 
@@ -266,6 +300,41 @@ def Checkpoint(traj):
 #    with open('%s/%s.chk.json' % (logpath,title),'w') as chk_file:
 #        json.dump(Chk,chk_file)
 
+def WriteModelParent(path,parent):
+    ## This function create a new version of a model that starts from the weights of the parent version
+    ## Only the reference to the parent is written, nothing of the parent is copied
+
+    if os.path.exists(path) == False:
+        os.makedirs(path)
+
+    with open('%s/parent.json' % (path),'w') as outfile:
+        json.dump({'parent':parent},outfile)
+
+def ReadModelParent(path):
+    ## This function return the parent version of a model or None if the model has no parent
+
+    if os.path.exists('%s/parent.json' % (path)) == False:
+        return None
+
+    with open('%s/parent.json' % (path),'r') as infile:
+        parent=json.load(infile)['parent']
+
+    return parent
+
+def ReadPermuteMap(permute_map):
+    ## This function read the permutation map file
+    ## This function return the atom permutations in shape of (map,atom) or None if no map is used
+
+    if permute_map == 'No' or os.path.exists(permute_map) == False:
+        return None
+
+    P = np.loadtxt(permute_map)-1
+    P = P.astype(int)
+    if len(P.shape) == 1:
+        P = P.reshape([1,-1])
+
+    return P
+
 def PermuteMap(x,y_dict,permute_map,seed):
     ## This function permute data following the map P.
     ## x is M x N x 3, M entries, N atoms, x,y,z
@@ -0,0 +1,333 @@
+## Training data storage for PyRAIMD
+## Columnar binary storage of the training data in typed numpy arrays
+
+import os,sys,json
+import numpy as np
+
+class TrainingData:
+    ## This class store the training data in a directory of numpy binary files
+    ## Each field is saved as one .npy file per chunk, every append writes a new chunk
+    ## The numeric fields are read through memory maps, nothing is loaded until requested
+    ## The ci and mo fields are irregular, thus each entry is kept as a json string
+
+    float_fields = ['coord','invr','energy','gradient','nac']
+    text_fields  = ['ci','mo']
+    stat_fields  = ['invr','energy','gradient','nac']
+
+    def __init__(self,path,size=None):
+        ## path      : str
+        ##             Directory of the training data
+        ## size      : int
+        ##             Number of entries to use, the chunks beyond size are ignored and will be replaced by the next append
+
+        self.path       = path
+        self.info       = self._read_index()
+        self.natom      = self.info['natom']
+        self.nstate     = self.info['nstate']
+        self.atoms      = np.array(self.info['atoms'])
+        self.chunks     = self.info['chunks']
+
+        if size != None:
+            nchunk=np.argwhere(np.cumsum([0]+self.chunks) == size)
+            if len(nchunk) == 0:
+                sys.exit('\n  ValueError\n  PyRAI2MD: training data %s has no chunk boundary at %s entries' % (path,size))
+            self.chunks = self.chunks[0:int(nchunk[0][0])]
+
+    def __len__(self):
+        return int(np.sum(self.chunks))
+
+    def _read_index(self):
+        with open('%s/index.json' % (self.path),'r') as infile:
+            info=json.load(infile)
+
+        return info
+
+    def _write_index(self):
+        self.info['chunks'] = self.chunks
+        with open('%s/index.json' % (self.path),'w') as outfile:
+            json.dump(self.info,outfile)
+
+    def _chunkfile(self,field,n):
+        return '%s/%s-%04d.npy' % (self.path,field,n)
+
+    def _read_chunk(self,field,n):
+        if field in self.text_fields:
+            return np.load(self._chunkfile(field,n))
+
+        return np.load(self._chunkfile(field,n),mmap_mode='r')
+
+    def _chunk_stats(self,value):
+        ## This function compute [size,mean,sum of squared deviation,max,min] of one chunk
+
+        value=np.asarray(value,dtype=float)
+        if value.size == 0:
+            return [0,0.0,0.0,0.0,0.0]
+
+        mean=np.mean(value)
+
+        return [int(value.size),float(mean),float(np.sum((value-mean)**2)),float(np.amax(value)),float(np.amin(value))]
+
+    def stats(self,field):
+        ## This function merge the statistics of the chunks with the Welford/Chan update
+        ## Only the chunks in the current size are merged, the data are not read unless a chunk has no statistics
+        ## This function return max, min, mean and std
+
+        if 'stats' not in self.info.keys():
+            self.info['stats'] = {}
+        chunk_stats=self.info['stats'].setdefault(field,[])
+        while len(chunk_stats) < len(self.chunks):
+            chunk_stats.append(self._chunk_stats(self._read_chunk(field,len(chunk_stats))))
+
+        size,mean,m2,vmax,vmin=0,0.0,0.0,None,None
+        for n_b,mean_b,m2_b,max_b,min_b in chunk_stats[0:len(self.chunks)]:
+            if n_b == 0:
+                continue
+            delta=mean_b-mean
+            total=size+n_b
+            mean+=delta*n_b/total
+            m2+=m2_b+delta**2*size*n_b/total
+            size=total
+            vmax=max_b if vmax == None else np.amax([vmax,max_b])
+            vmin=min_b if vmin == None else np.amin([vmin,min_b])
+
+        if size == 0:
+            return 0.0,0.0,0.0,0.0
+
+        return vmax,vmin,mean,(m2/size)**0.5
+
+    def get(self,field):
+        ## This function return a field of all entries as one array
+        ## The text fields return a list of decoded entries
+
+        if len(self.chunks) == 0:
+            return np.zeros(0)
+
+        value=np.concatenate([self._read_chunk(field,n) for n in range(len(self.chunks))])
+
+        if field in self.text_fields:
+            value=[json.loads(x) for x in value]
+
+        return value
+
+    def take(self,field,index):
+        ## This function return the selected entries of a field without reading the other chunks
+
+        index=np.array(index).astype(int).reshape(-1)
+        uniq,inverse=np.unique(index,return_inverse=True)
+        bound=np.cumsum([0]+self.chunks)
+        value=[]
+        for n in range(len(self.chunks)):
+            pick=uniq[(uniq >= bound[n]) & (uniq < bound[n+1])]
+            if len(pick) == 0:
+                continue
+            value.append(self._read_chunk(field,n)[pick-bound[n]])
+
+        ## chunks are visited in order, thus the unique indices are restored by the inverse map
+        value=np.concatenate(value)[inverse]
+
+        if field in self.text_fields:
+            value=[json.loads(x) for x in value]
+
+        return value
+
+    def xyz(self,index):
+        ## This function return the selected geometries in the [[atom,x,y,z],...] format
+
+        return [[[a]+c for a,c in zip(self.atoms.tolist(),coord.tolist())] for coord in self.take('coord',index)]
+
+    def append(self,xyz,invr,energy,gradient,nac,ci,mo):
+        ## This function write the new entries as a new chunk
+        ## The chunks beyond the current size are removed first
+        ## An empty chunk is not written
+
+        if len(xyz) == 0:
+            return self
+
+        nchunk=len(self.chunks)
+        while os.path.exists(self._chunkfile('coord',nchunk)) == True:
+            for field in self.float_fields+self.text_fields:
+                if os.path.exists(self._chunkfile(field,nchunk)) == True:
+                    os.remove(self._chunkfile(field,nchunk))
+            nchunk+=1
+
+        n=len(self.chunks)
+        value={
+        'coord'    : np.array(xyz)[:,:,1:4].astype(float).reshape([-1,self.natom,3]),
+        'invr'     : np.array(invr).astype(float),
+        'energy'   : np.array(energy).astype(float),
+        'gradient' : np.array(gradient).astype(float),
+        'nac'      : np.array(nac).astype(float),
+        'ci'       : np.array([json.dumps(x) for x in ci]),
+        'mo'       : np.array([json.dumps(x) for x in mo]),
+        }
+        for field in self.float_fields+self.text_fields:
+            np.save(self._chunkfile(field,n),value[field])
+
+        ## statistics of the new chunk, the previous chunks are not touched
+        if 'stats' not in self.info.keys():
+            self.info['stats'] = {}
+        for field in self.stat_fields:
+            chunk_stats=self.info['stats'].setdefault(field,[])
+            if len(chunk_stats) < n:
+                self.stats(field)
+            self.info['stats'][field]=chunk_stats[0:n]+[self._chunk_stats(value[field])]
+
+        self.chunks=self.chunks+[len(value['coord'])]
+        self._write_index()
+
+        return self
+
+    def to_list(self):
+        ## This function return the training data in the json list format
+
+        return [self.natom,self.nstate,self.xyz(np.arange(len(self))),
+                self.get('invr').tolist(),self.get('energy').tolist(),self.get('gradient').tolist(),self.get('nac').tolist(),
+                self.get('ci'),self.get('mo')]
+
+    def export(self,filename):
+        ## This function write the training data to a json file
+
+        with open(filename,'w') as outfile:
+            json.dump(self.to_list(),outfile)
+
+class TrainingStream:
+    ## This class stream the training data from the binary storage in shuffled blocks
+    ## The atom permutations are applied on the fly to each block, the augmented data are never held together
+    ## The rows are shuffled through a bounded buffer, thus the memory does not grow with the data size or the permutations
+
+    def __init__(self,data,index,permute=None,scale=None,buffer_size=10000,seed=1):
+        ## data        : TrainingData
+        ##               Training data storage
+        ## index       : list
+        ##               Entries to stream
+        ## permute     : np.array
+        ##               Atom permutations in shape of (map,atom), the identity is always included
+        ## scale       : dict
+        ##               Factors multiplied to energy, gradient and nac
+        ## buffer_size : int
+        ##               Number of rows kept in the shuffle buffer
+        ## seed        : int
+        ##               Random seed of the shuffle, each pass over the data is shuffled differently
+
+        self.data        = data
+        self.index       = np.array(index).astype(int).reshape(-1)
+        self.permute     = np.arange(data.natom).reshape([1,-1])
+        self.scale       = {'energy':1,'gradient':1,'nac':1}
+        self.buffer_size = int(buffer_size)
+        self.seed        = seed
+        self.npass       = 0
+
+        if permute is not None:
+            self.permute = np.concatenate((self.permute,np.array(permute).astype(int).reshape([-1,data.natom])))
+
+        if scale is not None:
+            self.scale.update(scale)
+
+    def __len__(self):
+        return len(self.index)*len(self.permute)
+
+    def _read_block(self,index):
+        ## This function read one block of entries and expand it by all permutations
+
+        coord=self.data.take('coord',index)
+        energy=self.data.take('energy',index)*self.scale['energy']
+        gradient=self.data.take('gradient',index)*self.scale['gradient']
+        nac=self.data.take('nac',index)*self.scale['nac']
+
+        ## permutation does not change energy
+        block={
+        'coord'    : np.concatenate([coord[:,p,:] for p in self.permute]),
+        'energy'   : np.concatenate([energy for p in self.permute]),
+        'gradient' : np.concatenate([gradient[:,:,p,:] for p in self.permute]),
+        'nac'      : np.concatenate([nac[:,:,p,:] for p in self.permute]),
+        }
+
+        return block
+
+    def __iter__(self):
+        ## This function yield shuffled blocks of rows as dict of arrays
+        ## The entries are read in a random order, the shuffle buffer then mixes the permuted copies
+        ## At most twice the buffer size of rows is kept in memory
+
+        rng=np.random.default_rng([self.seed,self.npass])
+        self.npass+=1
+        index=rng.permutation(self.index)
+        nread=max(1,int(self.buffer_size/len(self.permute)))
+        buffer=None
+
+        for n in range(0,len(index),nread):
+            block=self._read_block(index[n:n+nread])
+            if buffer is None:
+                buffer=block
+            else:
+                buffer={key:np.concatenate((buffer[key],val)) for key,val in block.items()}
+
+            size=len(buffer['coord'])
+            if size <= self.buffer_size:
+                continue
+
+            order=rng.permutation(size)
+            out,keep=order[0:size-self.buffer_size],order[size-self.buffer_size:]
+            yield {key:val[out] for key,val in buffer.items()}
+            buffer={key:val[keep] for key,val in buffer.items()}
+
+        if buffer is not None:
+            order=rng.permutation(len(buffer['coord']))
+            yield {key:val[order] for key,val in buffer.items()}
+
+    def batches(self,batch_size):
+        ## This function yield shuffled batches of a fixed size, the last batch may be smaller
+
+        rest=None
+        for block in self:
+            if rest is not None:
+                block={key:np.concatenate((rest[key],val)) for key,val in block.items()}
+            size=len(block['coord'])
+            full=size-size%batch_size
+            for n in range(0,full,batch_size):
+                yield {key:val[n:n+batch_size] for key,val in block.items()}
+            rest={key:val[full:] for key,val in block.items()}
+
+        if rest is not None and len(rest['coord']) > 0:
+            yield rest
+
+def ImportTrainData(filename,path):
+    ## This function convert a json training data file to the binary format
+
+    with open(filename,'r') as infile:
+        natom,nstate,xyz,invr,energy,gradient,nac,ci,mo=json.load(infile)
+
+    if os.path.exists(path) == False:
+        os.makedirs(path)
+
+    info={
+    'natom'  : natom,
+    'nstate' : nstate,
+    'atoms'  : [x[0] for x in xyz[0]],
+    'chunks' : [],
+    'source' : {'file':os.path.abspath(filename),'size':os.path.getsize(filename),'mtime':os.path.getmtime(filename),'entry':len(xyz)},
+    }
+    with open('%s/index.json' % (path),'w') as outfile:
+        json.dump(info,outfile)
+
+    data=TrainingData(path)
+    data.append(xyz,invr,energy,gradient,nac,ci,mo)
+
+    return data
+
+def LoadTrainData(filename):
+    ## This function open the training data from a binary directory or a json file
+    ## A json file is converted once to filename.store and reused as long as the json file is unchanged
+    ## Only the entries of the json file are used, the appended chunks of a previous run are ignored
+
+    if os.path.isdir(filename) == True:
+        return TrainingData(filename)
+
+    path='%s.store' % (os.path.splitext(filename)[0])
+    if os.path.exists('%s/index.json' % (path)) == True:
+        with open('%s/index.json' % (path),'r') as infile:
+            source=json.load(infile)['source']
+        if source['size'] == os.path.getsize(filename) and source['mtime'] == os.path.getmtime(filename):
+            return TrainingData(path,size=source['entry'])
+
+    return ImportTrainData(filename,path)
@@ -129,3 +129,41 @@ def VerletII(traj):
        	V = np.zeros(V.shape)
     return V
 
+
+def AdaptStep(traj):
+    ## This function update the time step size and check if the current step is accepted
+    ## The step is rejected and the time step is halved if the total energy drift, the gradient change, or the gap to other states exceed the thresholds
+    ## A step at minsize is always accepted
+    ## The step is increased by 25% if all of them are well below the thresholds
+    ## The step is kept within minsize and maxsize
+
+    iter     = traj['iter']
+    size     = traj['size']
+    minsize  = traj['minsize']
+    maxsize  = traj['maxsize']
+    maxdrift = traj['maxdrift']
+    maxdgrad = traj['maxdgrad']
+    mingap   = traj['mingap']/27.211396132 # eV to Eh
+    drift    = traj['drift']               # total energy change before thermostat in Eh
+    E        = traj['E']
+    G        = traj['G']
+    G0       = traj['Gp']
+    state    = traj['old']                 # the state used for propagation in this step
+
+    if iter < 2:
+        return size,True
+
+    dgrad = np.amax(np.abs(G[state-1]-G0[state-1]))
+    gap   = np.abs(np.delete(E,state-1)-E[state-1])
+    gap   = np.amin(gap) if len(gap) > 0 else np.inf
+
+    accept = True
+    if   drift > maxdrift or dgrad > maxdgrad or gap < mingap:
+        accept = size <= minsize*(1+1e-8)
+        size = size*0.5
+    elif drift < 0.25*maxdrift and dgrad < 0.25*maxdgrad and gap > 2*mingap:
+        size = size*1.25
+
+    size = np.amin([np.amax([size,minsize]),maxsize])
+
+    return float(size),accept